@@ -0,0 +1,261 @@
+"""
+Admission control for model calls.
+The Gemini quota is shared by every user, so each analysis first passes:
+
+1. a per-caller token bucket (users by id, guests by client address),
+   rejected immediately when empty;
+2. a global token bucket sized to the model quota and a concurrency cap;
+3. when either is exhausted, a bounded weighted fair queue. Each caller is
+   a flow with start-time fair queuing, so one bulk uploader cannot push
+   everyone else to the back, and guests get a smaller weight than
+   signed-in users.
+
+Callers that cannot be admitted get an AdmissionRejected carrying a
+Retry-After estimate.
+"""
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import heapq
+import time
+
+from config import get_settings
+from logging_config import record_stage_timing
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTIONS
+
+# Idle per-caller buckets are dropped once this many are tracked
+MAX_TRACKED_CALLERS = 10000
+
+
+class AdmissionRejected(Exception):
+    """Raised when a model call cannot be admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Model call rejected ({reason}); retry after {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = max(1.0, retry_after)
+
+
+class TokenBucket:
+    """Classic token bucket; `rate` tokens per second up to `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_acquire(self, now: float) -> float:
+        """Take a token. Returns 0 on success, else seconds until one is available."""
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1.0)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish: float
+    seq: int
+    start: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class AdmissionController:
+    """
+    Per-caller and global rate limits in front of a weighted fair queue.
+
+    Args:
+        global_rate: Model calls per second across the instance (<= 0: unlimited)
+        global_burst: Global bucket size
+        caller_rate: Model calls per second per caller (<= 0: unlimited)
+        caller_burst: Per-caller bucket size
+        max_concurrency: Model calls in flight at once
+        max_queue: Waiting calls beyond which new calls are rejected
+        max_wait: Seconds a call may wait in the queue
+    """
+
+    def __init__(self, global_rate: float, global_burst: float, caller_rate: float,
+                 caller_burst: float, max_concurrency: int, max_queue: int, max_wait: float):
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.caller_rate = caller_rate
+        self.caller_burst = caller_burst
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._callers: Dict[str, TokenBucket] = {}
+        self._last_finish: Dict[str, float] = {}
+        self._heap: List[_Waiter] = []
+        self._seq = 0
+        self._queued = 0
+        self._active = 0
+        self._virtual_time = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _caller_bucket(self, key: str, now: float) -> Optional[TokenBucket]:
+        if self.caller_rate <= 0:
+            return None
+        bucket = self._callers.get(key)
+        if bucket is None:
+            if len(self._callers) >= MAX_TRACKED_CALLERS:
+                self._prune_callers(now)
+            bucket = self._callers[key] = TokenBucket(self.caller_rate, self.caller_burst)
+        return bucket
+
+    def _prune_callers(self, now: float) -> None:
+        """Forget callers whose bucket has refilled."""
+        for key in [key for key, bucket in self._callers.items() if bucket.is_full(now)]:
+            del self._callers[key]
+
+    def _prune_finish_tags(self) -> None:
+        """
+        Forget finish tags that no longer delay a caller: all of them once the
+        queue has drained, else those already passed by virtual time. Tags of
+        queued calls are kept, so the map stays bounded by max_queue.
+        """
+        if not self._queued:
+            self._last_finish.clear()
+            return
+        for key in [key for key, finish in self._last_finish.items() if finish <= self._virtual_time]:
+            del self._last_finish[key]
+
+    def _take_global(self, now: float) -> float:
+        return self.global_bucket.try_acquire(now) if self.global_bucket else 0.0
+
+    def _estimated_wait(self) -> float:
+        rate = self.global_bucket.rate if self.global_bucket else 1.0
+        return (self._queued + 1) / rate
+
+    def _reject(self, reason: str, retry_after: float) -> None:
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        raise AdmissionRejected(reason, retry_after)
+
+    def _dispatch(self) -> None:
+        """Hand free slots and global tokens to waiters in finish-tag order."""
+        self._timer = None
+        now = time.monotonic()
+        while self._heap and self._active < self.max_concurrency:
+            waiter = self._heap[0]
+            if waiter.future.done():  # timed out or cancelled while queued
+                heapq.heappop(self._heap)
+                continue
+            wait = self._take_global(now)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+            heapq.heappop(self._heap)
+            self._queued -= 1
+            self._active += 1
+            self._virtual_time = waiter.start
+            waiter.future.set_result(None)
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+
+    def _release(self) -> None:
+        self._active -= 1
+        if self._heap and self._timer is None:
+            self._dispatch()
+
+    def _enqueue(self, key: str, weight: float) -> _Waiter:
+        if key not in self._last_finish and len(self._last_finish) >= MAX_TRACKED_CALLERS:
+            self._prune_finish_tags()
+        start = max(self._virtual_time, self._last_finish.get(key, 0.0))
+        finish = start + 1.0 / weight
+        self._last_finish[key] = finish
+        self._seq += 1
+        waiter = _Waiter(finish, self._seq, start, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, waiter)
+        self._queued += 1
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        waiter.future.cancel()
+        self._queued -= 1
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+
+    @asynccontextmanager
+    async def admit(self, key: str, weight: float = 1.0, priority: str = "user") -> AsyncIterator[None]:
+        """
+        Hold one model-call slot for the duration of the block.
+
+        Args:
+            key: Caller identity (user id, or guest address)
+            weight: Fair-queue weight; higher weights get a larger share
+            priority: Metric label for the caller class
+
+        Raises:
+            AdmissionRejected: Caller over its rate, queue full, or waited too long
+        """
+        now = time.monotonic()
+        bucket = self._caller_bucket(key, now)
+        if bucket is not None:
+            wait = bucket.try_acquire(now)
+            if wait > 0:
+                self._reject("caller_rate", wait)
+
+        if not self._heap and self._active < self.max_concurrency and self._take_global(now) == 0:
+            self._active += 1
+            ADMISSION_QUEUE_WAIT.labels(priority).observe(0.0)
+        else:
+            if self._queued >= self.max_queue:
+                if bucket is not None:
+                    bucket.refund()
+                self._reject("queue_full", self._estimated_wait())
+
+            waiter = self._enqueue(key, weight)
+            if self._timer is None:
+                self._dispatch()
+            try:
+                await asyncio.wait({waiter.future}, timeout=self.max_wait)
+            except asyncio.CancelledError:
+                # Client went away; give back the slot if it was just granted
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release()
+                else:
+                    self._abandon(waiter)
+                raise
+            if not waiter.future.done():
+                self._abandon(waiter)
+                self._reject("queue_timeout", self._estimated_wait())
+            waited = time.monotonic() - now
+            ADMISSION_QUEUE_WAIT.labels(priority).observe(waited)
+            record_stage_timing("admission", waited)
+
+        try:
+            yield
+        finally:
+            self._release()
+
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    """Process-wide controller configured from settings."""
+    settings = get_settings()
+    return AdmissionController(
+        global_rate=settings.model_rate_per_minute / 60.0,
+        global_burst=settings.model_burst,
+        caller_rate=settings.caller_rate_per_minute / 60.0,
+        caller_burst=settings.caller_burst,
+        max_concurrency=settings.model_max_concurrency,
+        max_queue=settings.admission_max_queue,
+        max_wait=settings.admission_max_wait_seconds,
+    )
@@ -1,9 +1,18 @@
-import google.generativeai as genai
+from admission import AdmissionRejected, get_admission_controller
 from config import get_settings
-from typing import Dict, List, BinaryIO
+from metrics import MODEL_ROUTES, track_stage, record_model_usage
+from images import encode_model_image, estimate_complexity
+from nutrition_db import reconcile_analysis
+from telemetry import estimate_cost, usage_from_response
+from datetime import timedelta
+from functools import lru_cache
+from typing import Dict, List, BinaryIO, NamedTuple, Optional, Tuple
+import asyncio
 import logging
 import json
 import re
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -40,73 +49,240 @@ Respond strictly in valid JSON format with the following keys ONLY:
 
 Do not include any extra text."""
 
+# Same contract in a fraction of the tokens, for PROMPT_MODE=compact (models
+# without system instructions); JSON mode enforces the output format
+COMPACT_PROMPT = """Analyze the visible food in this meal photo (only what is visible). Return JSON:
+{"food_items":[str],"health_verdict":"Healthy"|"Neutral"|"Unhealthy","nutrition_advice":str,
+"benefits":[3-5 str],"cautions":[3-5 str],"calories":int,"protein":g,"carbs":g,"fats":g,
+"micronutrients":{name:{"amount":num,"unit":str}} incl. vitamin_a,vitamin_c,vitamin_d,calcium,iron,fiber}"""
+
+# User turn sent with the image when the instructions live in the system instruction
+IMAGE_TURN = "Analyze this meal."
+
+# PROMPT_MODE values:
+#   system  - NUTRITIONIST_PROMPT as the model's system instruction
+#   cached  - the same, stored once as cached content (falls back to system
+#             when the provider refuses, e.g. below the minimum cache size)
+#   compact - COMPACT_PROMPT as user content
+#   full    - NUTRITIONIST_PROMPT as user content (the original request shape)
+PROMPT_MODES = ("system", "cached", "compact", "full")
+
+JSON_OUTPUT = {"response_mime_type": "application/json"}
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+# Lifetime of a cached-content handle; refreshed shortly before it expires
+PROMPT_CACHE_TTL = timedelta(hours=1)
+_PROMPT_CACHE_MARGIN_SECONDS = 60
+# How long to use the system instruction before retrying a failed cache create
+PROMPT_CACHE_RETRY = timedelta(minutes=10)
+
+# Longest image side sent to the full model
+FULL_MAX_IMAGE_SIZE = 2048
+
+_genai = None
+
 
 def initialize_gemini():
+    """
+    Import and configure the Gemini SDK on first use.
+    The SDK is slow to import, so it is kept off the startup path.
+    """
+    global _genai
+    if _genai is None:
+        settings = get_settings()
+        if settings.ai_backend == "stub":
+            import stub_backend as genai
+        else:
+            import google.generativeai as genai
+        genai.configure(api_key=settings.gemini_api_key)
+        _genai = genai
+        logger.info("Gemini API initialized (%s backend)", settings.ai_backend)
+    return _genai
+
+
+@lru_cache(maxsize=16)
+def _prompt_model(model_name: str, mode: str):
+    """Reusable model client for a prompt mode (system instruction set once)."""
+    genai = initialize_gemini()
+    if mode in ("system", "cached"):
+        return genai.GenerativeModel(
+            model_name, safety_settings=SAFETY_SETTINGS,
+            generation_config=JSON_OUTPUT, system_instruction=NUTRITIONIST_PROMPT
+        )
+    generation_config = JSON_OUTPUT if mode == "compact" else None
+    return genai.GenerativeModel(model_name, safety_settings=SAFETY_SETTINGS, generation_config=generation_config)
+
+
+# model name -> (model client, monotonic expiry)
+_cached_models: Dict[str, tuple] = {}
+# Callers run in worker threads; one billed cache create per model at a time
+_cached_models_lock = threading.Lock()
+
+
+def _cached_prompt_model(model_name: str):
+    """
+    Model bound to a cached-content handle holding NUTRITIONIST_PROMPT.
+    If the provider cannot cache it (e.g. the stub backend), the
+    system-instruction model is used for PROMPT_CACHE_RETRY instead of
+    retrying on every call.
+    """
+    with _cached_models_lock:
+        now = time.monotonic()
+        entry = _cached_models.get(model_name)
+        if entry and entry[1] > now + _PROMPT_CACHE_MARGIN_SECONDS:
+            return entry[0]
+        
+        genai = initialize_gemini()
+        try:
+            cache = genai.caching.CachedContent.create(
+                model=f"models/{model_name}", system_instruction=NUTRITIONIST_PROMPT, ttl=PROMPT_CACHE_TTL
+            )
+            model = genai.GenerativeModel.from_cached_content(
+                cache, generation_config=JSON_OUTPUT, safety_settings=SAFETY_SETTINGS
+            )
+            ttl = PROMPT_CACHE_TTL
+        except Exception as e:
+            logger.warning("Prompt caching unavailable for %s, using system instruction for %s: %s",
+                           model_name, PROMPT_CACHE_RETRY, e)
+            model = _prompt_model(model_name, "system")
+            ttl = PROMPT_CACHE_RETRY
+        _cached_models[model_name] = (model, now + ttl.total_seconds())
+        return model
+
+
+def prompt_request(model_name: str, mode: str) -> Tuple[object, str]:
+    """The model client and the text sent with the image for a prompt mode."""
+    if mode == "cached":
+        return _cached_prompt_model(model_name), IMAGE_TURN
+    if mode == "system":
+        return _prompt_model(model_name, mode), IMAGE_TURN
+    text = COMPACT_PROMPT if mode == "compact" else NUTRITIONIST_PROMPT
+    return _prompt_model(model_name, mode), text
+
+
+class ModelRoute(NamedTuple):
+    tier: str                    # 'full' or 'light'
+    model: str
+    max_size: int                # Longest image side sent to the model
+    complexity: Optional[float]  # None when routing is off
+    suggested_tier: Optional[str]  # Tier the estimator chose (differs from tier in shadow mode)
+
+
+def choose_model_route(image_bytes: bytes) -> ModelRoute:
+    """
+    Route visually simple images (one item, plain background) to the light
+    model at a lower resolution and everything else to the full model.
+    In 'shadow' mode the decision is logged but the full model is used, so
+    the split can be evaluated before it is switched on.
+    """
     settings = get_settings()
-    genai.configure(api_key=settings.gemini_api_key)
-    logger.info("Gemini API initialized")
+    full = ModelRoute("full", settings.model_name, FULL_MAX_IMAGE_SIZE, None, None)
+    if settings.model_routing == "off":
+        return full
+    
+    try:
+        complexity = estimate_complexity(image_bytes)
+    except Exception as e:
+        logger.warning("Complexity estimate failed, using full model: %s", e)
+        return full
+    
+    tier = "light" if complexity["score"] < settings.routing_complexity_threshold else "full"
+    logger.info("Model route: %s (%s)", tier, settings.model_routing, extra={"fields": {
+        "route_tier": tier, "route_mode": settings.model_routing, **complexity
+    }})
+    MODEL_ROUTES.labels(tier, settings.model_routing).inc()
+    
+    if tier == "light" and settings.model_routing == "on":
+        return ModelRoute("light", settings.light_model_name, settings.light_max_image_size, complexity["score"], tier)
+    return full._replace(complexity=complexity["score"], suggested_tier=tier)
+
+
+def prepare_model_image(image_bytes: bytes) -> Tuple[ModelRoute, bytes, int, int]:
+    """
+    Pick the model tier (and resize target) from image complexity and
+    encode the image once for it; the SDK sends the bytes as they are.
+    CPU-bound, so callers run it in a thread.
+    """
+    route = choose_model_route(image_bytes)
+    payload, width, height = encode_model_image(image_bytes, route.max_size)
+    return route, payload, width, height
 
 
 async def analyze_food_image(image_content: BinaryIO, filename: str) -> Dict[str, any]:
+    """
+    Analyze a meal photo. The result always carries a 'telemetry' entry
+    (model, tokens, image size, latency and status) for accounting.
+    """
+    started = time.perf_counter()
+    prompt_mode = get_settings().prompt_mode
+    telemetry = {
+        "model": None,
+        "tier": None,
+        "suggested_tier": None,
+        "complexity": None,
+        "status": "error",
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "image_bytes": 0,
+        "image_width": 0,
+        "image_height": 0,
+        "image_pixels": 0,
+        "prompt_mode": prompt_mode,
+        "prompt_chars": None,
+        "payload_bytes": 0,
+        "latency_ms": None,
+        "cost_usd": None,
+    }
     try:
-        logger.info("=== Starting food image analysis ===")
-        initialize_gemini()
-        logger.info("✓ Gemini initialized")
-        
-        # Safety settings
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-        ]
-        logger.info("✓ Safety settings configured")
-        
-        # Model - using Gemini 2.0 Flash
-        model = genai.GenerativeModel('gemini-2.0-flash-001', safety_settings=safety_settings)
-        logger.info("✓ Model created: gemini-2.0-flash-001")
-        
-        # Load and resize image
-        import PIL.Image
-        import io
-        image_content.seek(0)
-        image_bytes = image_content.read()
-        logger.info(f"✓ Read {len(image_bytes)} bytes from upload")
-        
-        image = PIL.Image.open(io.BytesIO(image_bytes))
-        logger.info(f"✓ Opened image: {image.size}, mode: {image.mode}")
-        
-        # Resize if too large (max 2048px)
-        max_size = 2048
-        if image.width > max_size or image.height > max_size:
-            image.thumbnail((max_size, max_size), PIL.Image.Resampling.LANCZOS)
-            logger.info(f"✓ Resized image to {image.size}")
-        
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            logger.info(f"✓ Converted image to RGB")
+        # Load and resize image (PIL work runs in a thread, off the event loop)
+        with track_stage("decode"):
+            image_content.seek(0)
+            image_bytes = image_content.read()
+            route, payload, width, height = await asyncio.to_thread(prepare_model_image, image_bytes)
+            logger.debug("Model image: %d -> %d bytes, %dx%d", len(image_bytes), len(payload), width, height)
         
-        logger.info(f">>> Calling Gemini API with prompt: {NUTRITIONIST_PROMPT[:50]}...")
+        model_name = route.model
+        # May create the cached prompt on first use, which is a blocking SDK call
+        model, prompt_text = await asyncio.to_thread(prompt_request, model_name, prompt_mode)
+        telemetry.update(
+            model=model_name, tier=route.tier, suggested_tier=route.suggested_tier, complexity=route.complexity
+        )
+        telemetry.update(
+            image_bytes=len(image_bytes),
+            image_width=width,
+            image_height=height,
+            image_pixels=width * height,
+            payload_bytes=len(payload),
+            prompt_chars=len(prompt_text) + (len(NUTRITIONIST_PROMPT) if prompt_mode in ("system", "cached") else 0)
+        )
         
         # Generate content
-        response = model.generate_content([NUTRITIONIST_PROMPT, image])
-        logger.info("✓ Gemini API call completed")
-        
-        # Get text
-        logger.info(f"Response type: {type(response)}")
-        logger.info(f"Has text attr: {hasattr(response, 'text')}")
+        with track_stage("model") as model_timer:
+            response = await model.generate_content_async([prompt_text, {"mime_type": "image/jpeg", "data": payload}])
+        record_model_usage(model_name, response)
+        usage = usage_from_response(response)
+        telemetry.update(
+            usage,
+            latency_ms=round(model_timer.duration * 1000, 1),
+            cost_usd=estimate_cost(model_name, usage["input_tokens"], usage["output_tokens"])
+        )
         
+        # Get text (raises when the candidate was blocked or empty)
         response_text = None
-        if hasattr(response, 'text'):
-            try:
-                response_text = response.text
-                logger.info(f"✓ Got response text: {len(response_text)} chars")
-            except Exception as e:
-                logger.error(f"✗ Error accessing response.text: {e}")
+        try:
+            response_text = response.text
+        except Exception as e:
+            logger.error("Error accessing Gemini response text: %s", e)
         
         if not response_text:
             logger.error("Empty response from Gemini")
+            telemetry["status"] = "empty"
             return {
                 "food_items": ["Food item"],
                 "health_verdict": "Neutral",
@@ -114,17 +290,34 @@ async def analyze_food_image(image_content: BinaryIO, filename: str) -> Dict[str
                 "calories": 0,
                 "protein": 0,
                 "carbs": 0,
-                "fats": 0
+                "fats": 0,
+                "telemetry": telemetry
             }
         
-        logger.info(f"Got response: {response_text[:100]}...")
+        logger.debug("Gemini response (%d chars): %.100s", len(response_text), response_text)
         result = parse_gemini_response(response_text)
+        
+        # Cross-check totals against the local nutrition table (no model call)
+        reconciliation_mode = get_settings().macro_reconciliation
+        if reconciliation_mode != "off":
+            try:
+                with track_stage("reconcile"):
+                    result = reconcile_analysis(dict(result), reconciliation_mode)
+            except Exception as e:
+                # A table check must never cost a valid model analysis
+                logger.warning("Macro reconciliation failed, keeping the model totals: %s", e)
+            else:
+                if result["reconciliation"]["issues"]:
+                    logger.info("Reconciliation %s: %s", result["reconciliation"]["status"],
+                                ", ".join(result["reconciliation"]["issues"]))
+        
+        telemetry["status"] = "ok"
+        telemetry["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["telemetry"] = telemetry
         return result
         
     except Exception as e:
-        logger.error(f"Error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("Food image analysis failed: %s", e)
         return {
             "food_items": ["Food item"],
             "health_verdict": "Neutral",
@@ -132,10 +325,39 @@ async def analyze_food_image(image_content: BinaryIO, filename: str) -> Dict[str
             "calories": 0,
             "protein": 0,
             "carbs": 0,
-            "fats": 0
+            "fats": 0,
+            "telemetry": telemetry
         }
 
 
+# Fair-queue weight of background summaries relative to a signed-in user
+SUMMARY_ADMISSION_WEIGHT = 0.25
+SUMMARY_MAX_ATTEMPTS = 5
+
+
+async def summarize_insights(prompt: str) -> Optional[str]:
+    """
+    Plain-text weekly summary from the light model, or None on failure.
+    Calls share the admission controller with uploads at a low weight and
+    wait out rejections, so a summary batch paces itself to the quota.
+    """
+    model_name = get_settings().light_model_name
+    for _ in range(SUMMARY_MAX_ATTEMPTS):
+        try:
+            async with get_admission_controller().admit("insights", SUMMARY_ADMISSION_WEIGHT, "insights"):
+                model = initialize_gemini().GenerativeModel(model_name)
+                with track_stage("model"):
+                    response = await model.generate_content_async(prompt)
+            record_model_usage(model_name, response)
+            return response.text.strip()
+        except AdmissionRejected as e:
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.warning("Weekly summary failed: %s", e)
+            return None
+    return None
+
+
 def parse_gemini_response(response_text: str) -> Dict[str, any]:
     try:
         json_match = re.search(r'\{[\s\S]*\}', response_text)
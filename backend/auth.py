@@ -1,19 +1,18 @@
-from authlib.integrations.starlette_client import OAuth
-from starlette.config import Config
-from starlette.requests import Request
-from starlette.middleware.sessions import SessionMiddleware
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Query
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
+from functools import lru_cache
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 from config import get_settings
 from models import User
 from db import get_database
 import logging
 import uuid
 
+if TYPE_CHECKING:
+    from authlib.integrations.starlette_client import OAuth
+
 # Initialize logger
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -23,17 +22,27 @@ SECRET_KEY = settings.jwt_secret_key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-# OAuth configuration
-oauth = OAuth()
-oauth.register(
-    name='google',
-    client_id=settings.google_client_id,
-    client_secret=settings.google_client_secret,
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-    client_kwargs={
-        'scope': 'openid email profile'
-    }
-)
+
+@lru_cache()
+def get_oauth() -> "OAuth":
+    """
+    OAuth registry with the Google provider.
+    Built on first use because authlib is slow to import.
+    """
+    from authlib.integrations.starlette_client import OAuth
+    
+    oauth = OAuth()
+    oauth.register(
+        name='google',
+        client_id=settings.google_client_id,
+        client_secret=settings.google_client_secret,
+        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+        client_kwargs={
+            'scope': 'openid email profile'
+        }
+    )
+    return oauth
+
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
@@ -72,6 +81,20 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         
     return User(**user_data)
 
+async def get_admin_user(user: User = Depends(get_current_user)) -> User:
+    """Require a user whose email is listed in ADMIN_EMAILS."""
+    admins = {email.strip().lower() for email in settings.admin_emails.split(",") if email.strip()}
+    if user.email.lower() not in admins:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
+
+async def get_event_stream_user(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    access_token: Optional[str] = Query(default=None)
+) -> User:
+    """get_current_user that also accepts ?access_token=, since EventSource cannot send headers."""
+    return await get_current_user(token or access_token or "")
+
 async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optional)):
     """Get user if token is valid, otherwise return None."""
     if not token:
@@ -0,0 +1,340 @@
+"""
+Microbenchmarks for hot paths that do not need live services.
+
+Usage: python bench.py [scenario ...] [--live] [--image PATH]   (default: all scenarios)
+"""
+
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+import argparse
+import io
+import json
+import sys
+import time
+import timeit
+import uuid
+
+
+def _report(label: str, func: Callable[[], object], number: int) -> float:
+    """Run func `number` times (best of 5) and print the per-call cost."""
+    best = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {label:<48} {best * 1e6:>10.1f} us/call")
+    return best
+
+
+def _sample_meals(count: int = 20) -> List[dict]:
+    """Meal documents as stored in Mongo (one history page)."""
+    now = datetime.utcnow()
+    return [
+        {
+            "meal_id": str(uuid.uuid4()),
+            "user_id": "user-1",
+            "image_url": f"https://storage.googleapis.com/bucket/meals/{uuid.uuid4().hex}.jpg",
+            "thumbnail_url": f"https://storage.googleapis.com/bucket/renditions/{i}_thumb.webp",
+            "medium_url": f"https://storage.googleapis.com/bucket/renditions/{i}_medium.webp",
+            "food_items": ["grilled chicken", "brown rice", "broccoli"],
+            "health_verdict": "Healthy",
+            "nutrition_advice": "Well balanced meal with lean protein and fibre. " * 4,
+            "benefits": ["High protein", "Rich in fibre", "Low in saturated fat"],
+            "cautions": ["Watch the sodium in sauces", "Portion size of rice"],
+            "calories": 620,
+            "protein": 45.5,
+            "carbs": 60.0,
+            "fats": 14.2,
+            "micronutrients": {
+                "vitamin_a": {"amount": 120, "unit": "mcg"},
+                "vitamin_c": {"amount": 85, "unit": "mg"},
+                "vitamin_d": {"amount": 0.2, "unit": "mcg"},
+                "calcium": {"amount": 90, "unit": "mg"},
+                "iron": {"amount": 2.8, "unit": "mg"},
+                "fiber": {"amount": 7.5, "unit": "g"},
+            },
+            "created_at": now - timedelta(hours=i),
+        }
+        for i in range(count)
+    ]
+
+
+def bench_serialization():
+    """Serialization cost of one /meals/history page (20 meals)."""
+    from typing import List as TList
+
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from models import MealDocument
+
+    raw = _sample_meals()
+    raw_with_id = [{"_id": object(), **meal} for meal in raw]
+    adapter = TypeAdapter(TList[MealDocument])
+
+    def before():
+        # Raw docs re-validated by response_model, then encoded with json
+        meals = adapter.validate_python(raw_with_id)
+        return json.dumps(jsonable_encoder(meals)).encode()
+
+    def after():
+        # Projected docs (no _id) serialized directly
+        return orjson.dumps(raw)
+
+    print("serialization (history page, 20 meals)")
+    slow = _report("pydantic validate + jsonable_encoder + json", before, 200)
+    fast = _report("mongo projection + orjson", after, 2000)
+    print(f"  speedup: {slow / fast:.0f}x, payload {len(after())} bytes")
+
+
+def bench_logging():
+    """Caller-thread cost of logging (what the event loop pays per call)."""
+    import logging
+    import os
+    import queue
+    from logging.handlers import QueueListener
+
+    from logging_config import ContextFilter, JsonFormatter, LazyQueueHandler
+
+    class SlowSink:
+        """A log pipe under backpressure: every write blocks for 100us."""
+
+        def write(self, data):
+            time.sleep(0.0001)
+
+        def flush(self):
+            pass
+
+    size_kb, user = 512.0, "Jane Doe"
+
+    def make_logger(name, handler):
+        log = logging.getLogger(name)
+        log.propagate = False
+        log.handlers = [handler]
+        log.setLevel(logging.INFO)
+        return log
+
+    listeners = []
+    devnull = open(os.devnull, "w")
+    print("logging (per call, on the calling thread)")
+    for sink_name, sink in (("fast sink", devnull), ("slow sink", SlowSink())):
+        stream_handler = logging.StreamHandler(sink)
+        stream_handler.setFormatter(
+            logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        sync_logger = make_logger(f"bench.sync.{sink_name}", stream_handler)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = LazyQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queued_logger = make_logger(f"bench.queued.{sink_name}", queue_handler)
+        json_handler = logging.StreamHandler(sink)
+        json_handler.setFormatter(JsonFormatter())
+        listener = QueueListener(log_queue, json_handler)
+        listener.start()
+        listeners.append(listener)
+
+        number = 20000 if sink is devnull else 500
+        _report(f"{sink_name}: StreamHandler, f-string", lambda: sync_logger.info(
+            f"Processing upload for user: {user} ({size_kb:.1f}KB)"), number)
+        _report(f"{sink_name}: queue + JSON listener, lazy", lambda: queued_logger.info(
+            "Processing upload for user: %s (%.1fKB)", user, size_kb), number)
+
+    _report("disabled DEBUG, f-string", lambda: sync_logger.debug(
+        f"Processing upload for user: {user} ({size_kb:.1f}KB)"), 100000)
+    _report("disabled DEBUG, lazy args", lambda: sync_logger.debug(
+        "Processing upload for user: %s (%.1fKB)", user, size_kb), 100000)
+
+    for listener in listeners:
+        listener.stop()
+    devnull.close()
+
+
+def bench_nutrition():
+    """Text meal logging against the local nutrition index (no model call)."""
+    from nutrition_db import NutritionIndex, analyze_meal_text, get_nutrition_index, reconcile_analysis
+
+    print("Nutrition lookup")
+    _report("load index from CSV", NutritionIndex, 20)
+    index = get_nutrition_index()
+    _report("exact lookup ('eggs')", lambda: index.lookup("eggs"), 100000)
+    _report("fuzzy lookup ('bananna smoothie')", lambda: index.lookup("bananna smoothie"), 10000)
+    _report("analyze '2 eggs and toast'", lambda: analyze_meal_text("2 eggs and toast"), 10000)
+    _report("analyze 5-item meal", lambda: analyze_meal_text(
+        "200g grilled chicken, 1 cup brown rice, broccoli, half an avocado and a glass of orange juice"
+    ), 5000)
+    analysis = {
+        "food_items": ["Grilled chicken breast", "Steamed white rice", "Broccoli florets", "Glass of orange juice"],
+        "calories": 2400, "protein": 48.0, "carbs": 60.0, "fats": 8.0,
+    }
+    _report("reconcile 4-item model analysis", lambda: reconcile_analysis(dict(analysis), "correct"), 5000)
+
+
+def bench_export():
+    """Encoding cost of one /meals/export chunk per format."""
+    import asyncio
+    from export import COLUMNAR_FORMATS, EXPORT_MEDIA_TYPES, columnar_supported, stream_export
+
+    batch_size = 500
+    meals = _sample_meals(20) * (batch_size // 20)
+
+    class _Cursor:
+        def __aiter__(self):
+            async def documents():
+                for meal in meals:
+                    yield meal
+            return documents()
+
+    async def export(export_format: str) -> int:
+        return sum([len(chunk) async for chunk in stream_export(_Cursor(), export_format, batch_size)])
+
+    print(f"Export ({batch_size} meals)")
+    for export_format in EXPORT_MEDIA_TYPES:
+        if export_format in COLUMNAR_FORMATS and not columnar_supported():
+            print(f"  {export_format:<48} skipped (pyarrow not installed)")
+            continue
+        size = asyncio.run(export(export_format))
+        _report(f"{export_format} ({size / 1024:.0f}KB)", lambda: asyncio.run(export(export_format)), 5)
+
+
+def bench_buckets():
+    """Stored size and read cost of per-meal documents vs. user-day buckets."""
+    import bson
+    from meal_buckets import bucket_id, compact_meal, expand_bucket, save_meal_update
+
+    # 90 days of history, 3 meals a day
+    meals = []
+    for day in range(90):
+        for i, meal in enumerate(_sample_meals(3)):
+            meal["created_at"] = datetime(2024, 1, 1, 8) + timedelta(days=day, hours=5 * i)
+            meals.append(meal)
+
+    buckets: Dict[str, dict] = {}
+    for meal in meals:
+        _, update = save_meal_update(meal)
+        bucket = buckets.setdefault(bucket_id(meal["user_id"], meal["created_at"]), {
+            "_id": bucket_id(meal["user_id"], meal["created_at"]), **update["$setOnInsert"],
+            "count": 0, "totals": {}, "meals": [],
+        })
+        bucket["meals"].append(update["$push"]["meals"])
+        bucket["count"] += 1
+        for key, value in update["$inc"].items():
+            if key.startswith("totals."):
+                field = key.split(".", 1)[1]
+                bucket["totals"][field] = bucket["totals"].get(field, 0) + value
+
+    document_bytes = sum(len(bson.encode(meal)) for meal in meals)
+    bucket_bytes = sum(len(bson.encode(bucket)) for bucket in buckets.values())
+    print(f"Buckets ({len(meals)} meals over {len(buckets)} days)")
+    print(f"  {'documents layout':<48} {document_bytes / 1024:>10.0f} KB in {len(meals)} docs")
+    print(f"  {'buckets layout':<48} {bucket_bytes / 1024:>10.0f} KB in {len(buckets)} docs")
+    week = sum(bucket["count"] for bucket in list(buckets.values())[-7:])
+    print(f"  {'7-day stats docs read (documents / buckets)':<48} {week:>10} / 7")
+
+    day = next(iter(buckets.values()))
+    _report("compact one meal", lambda: compact_meal(meals[0]), 2000)
+    _report("expand one 3-meal bucket", lambda: expand_bucket(day), 2000)
+
+
+# Set from the command line (--live, --image)
+OPTIONS = argparse.Namespace(live=False, image=None)
+
+# Keys the analysis prompt asks for; a variant must keep returning all of them
+ANALYSIS_KEYS = ("food_items", "health_verdict", "nutrition_advice", "benefits", "cautions",
+                 "calories", "protein", "carbs", "fats", "micronutrients")
+
+
+def _bench_image() -> bytes:
+    if OPTIONS.image:
+        with open(OPTIONS.image, "rb") as handle:
+            return handle.read()
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (1600, 1200), (235, 230, 220))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((200, 150, 1400, 1050), fill=(250, 250, 250), outline=(180, 180, 180), width=12)
+    draw.ellipse((420, 380, 820, 760), fill=(190, 140, 80))
+    draw.rectangle((860, 420, 1180, 780), fill=(70, 140, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def bench_prompts():
+    """
+    Input tokens, latency and answer completeness per PROMPT_MODE. Uses the
+    stub backend (estimated tokens) unless run with --live (real Gemini calls).
+    """
+    import asyncio
+    import statistics
+    from config import get_settings
+
+    settings = get_settings()
+    if not OPTIONS.live:
+        settings.ai_backend = "stub"
+    import ai
+
+    image_bytes = _bench_image()
+    runs = 3 if OPTIONS.live else 20
+    print(f"Prompts ({settings.ai_backend} backend, {settings.model_name}, {runs} runs each)")
+    print(f"  {'mode':<10} {'prompt chars':>12} {'input tok':>10} {'output tok':>10} {'model ms':>9} {'total ms':>9} {'complete':>9}")
+    for mode in ai.PROMPT_MODES:
+        settings.prompt_mode = mode
+        results = [asyncio.run(ai.analyze_food_image(io.BytesIO(image_bytes), "meal.jpg")) for _ in range(runs)]
+        telemetry = [result["telemetry"] for result in results]
+        complete = statistics.mean(
+            sum(key in result and result[key] not in (None, "", []) for key in ANALYSIS_KEYS) / len(ANALYSIS_KEYS)
+            for result in results
+        )
+        print(f"  {mode:<10} {telemetry[0]['prompt_chars'] or 0:>12}"
+              f" {statistics.median(t['input_tokens'] for t in telemetry):>10.0f}"
+              f" {statistics.median(t['output_tokens'] for t in telemetry):>10.0f}"
+              f" {statistics.median(t['latency_ms'] or 0 for t in telemetry):>9.1f}"
+              f" {statistics.median(t.get('total_ms') or 0 for t in telemetry):>9.1f}"
+              f" {complete:>9.0%}")
+        if mode == "cached" and not hasattr(ai.initialize_gemini(), "caching"):
+            print("    (no prompt caching in this backend: measured as the system mode)")
+
+    # What the SDK used to do with the PIL image on every call, vs. encoding once
+    from PIL import Image
+    from images import encode_model_image
+    oversized = Image.open(io.BytesIO(image_bytes)).resize((3000, 2250))
+    buffer = io.BytesIO()
+    oversized.save(buffer, format="JPEG", quality=90)
+    big_bytes = buffer.getvalue()
+    print("Image payload (3000x2250 upload, resized to 2048)")
+    _report("pre-encoded JPEG (encode_model_image)", lambda: encode_model_image(big_bytes, 2048), 5)
+    try:
+        from google.generativeai.types import content_types
+    except ImportError:
+        print(f"  {'SDK PIL conversion':<48} skipped (google-generativeai not installed)")
+        return
+    resized = oversized.copy()
+    resized.thumbnail((2048, 2048))
+    _report("PIL image through the SDK (lossless WebP)", lambda: content_types.to_blob(resized), 2)
+
+
+SCENARIOS: Dict[str, Callable[[], None]] = {
+    "serialization": bench_serialization,
+    "logging": bench_logging,
+    "nutrition": bench_nutrition,
+    "export": bench_export,
+    "buckets": bench_buckets,
+    "prompts": bench_prompts,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EatRight microbenchmarks")
+    parser.add_argument("scenarios", nargs="*", help=f"any of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--live", action="store_true", help="prompts: call the configured model instead of the stub")
+    parser.add_argument("--image", help="prompts: meal photo to send (default: a generated plate)")
+    args = parser.parse_args()
+    OPTIONS.live, OPTIONS.image = args.live, args.image
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    for name in args.scenarios or SCENARIOS:
+        SCENARIOS[name]()
+        print()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+Per-user response caching and ETag helpers for read endpoints.
+Entries are keyed by the user's data version, which save_meal bumps, so a
+new meal makes every older entry unreachable instead of requiring
+explicit invalidation.
+"""
+
+from collections import OrderedDict
+from typing import Hashable, Optional
+import hashlib
+import threading
+
+from metrics import record_cache
+
+
+class ResponseCache:
+    """Small in-process LRU cache of rendered response bodies."""
+
+    def __init__(self, name: str, max_entries: int = 1024):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+        record_cache(self.name, body is not None)
+        return body
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def make_etag(*parts: object) -> str:
+    """
+    Weak ETag derived from the cache key (user, data version, endpoint, params).
+    Weak because the gzip and identity encodings of a body share it.
+    """
+    digest = hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest[:20]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against our ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison is what If-None-Match specifies
+    opaque = etag.removeprefix("W/")
+    return "*" in candidates or any(tag.removeprefix("W/") == opaque for tag in candidates)
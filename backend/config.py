@@ -10,24 +10,77 @@ class Settings(BaseSettings):
     
     # Gemini AI Configuration
     gemini_api_key: str = Field(..., alias="GEMINI_API_KEY")
+    ai_backend: str = Field(default="gemini", alias="AI_BACKEND")  # gemini or stub (offline, canned answers)
+    prompt_mode: str = Field(default="system", alias="PROMPT_MODE")  # system, cached, compact or full (see ai.PROMPT_MODES)
+    macro_reconciliation: str = Field(default="flag", alias="MACRO_RECONCILIATION")  # off, flag or correct
+    model_name: str = Field(default="gemini-2.0-flash-001", alias="MODEL_NAME")
+    light_model_name: str = Field(default="gemini-2.0-flash-lite-001", alias="LIGHT_MODEL_NAME")
+    light_max_image_size: int = Field(default=768, alias="LIGHT_MAX_IMAGE_SIZE")
+    model_routing: str = Field(default="shadow", alias="MODEL_ROUTING")  # off, shadow (log only) or on
+    routing_complexity_threshold: float = Field(default=0.35, alias="ROUTING_COMPLEXITY_THRESHOLD")
+    
+    # Admission control for model calls (rates <= 0 disable a limit)
+    model_rate_per_minute: float = Field(default=60, alias="MODEL_RATE_PER_MINUTE")
+    model_burst: int = Field(default=10, alias="MODEL_BURST")
+    model_max_concurrency: int = Field(default=8, alias="MODEL_MAX_CONCURRENCY")
+    caller_rate_per_minute: float = Field(default=10, alias="CALLER_RATE_PER_MINUTE")
+    caller_burst: int = Field(default=3, alias="CALLER_BURST")
+    guest_weight: float = Field(default=0.5, alias="GUEST_WEIGHT")  # Fair-queue share of a guest vs. a signed-in user
+    trusted_proxies: str = Field(default="", alias="TRUSTED_PROXIES")  # Comma-separated IPs/CIDRs (or *) whose X-Forwarded-For keys guests
+    admission_max_queue: int = Field(default=32, alias="ADMISSION_MAX_QUEUE")
+    admission_max_wait_seconds: float = Field(default=20, alias="ADMISSION_MAX_WAIT_SECONDS")
+    
+    # Guest (signed-out) analyses
+    guest_mode: str = Field(default="ephemeral", alias="GUEST_MODE")  # ephemeral (no storage) or persist
+    guest_preview_size: int = Field(default=0, alias="GUEST_PREVIEW_SIZE")  # Inline data-URL preview, longest side px (0: none)
+    guest_review_sample_rate: float = Field(default=0.0, alias="GUEST_REVIEW_SAMPLE_RATE")  # Fraction of ephemeral guest meals still stored for review
     
     # MongoDB Configuration
     mongodb_uri: str = Field(..., alias="MONGODB_URI")
     mongodb_db_name: str = Field(default="eatright", alias="MONGODB_DB_NAME")
     mongodb_collection_name: str = Field(default="meals", alias="MONGODB_COLLECTION_NAME")
+    meal_storage_layout: str = Field(default="documents", alias="MEAL_STORAGE_LAYOUT")  # documents or buckets (one doc per user-day; run migrate_buckets.py first)
+    export_batch_size: int = Field(default=500, alias="EXPORT_BATCH_SIZE")  # Meals per cursor batch / chunk in /meals/export
     
     # Google Cloud Storage Configuration
     gcs_bucket_name: str = Field(..., alias="GCS_BUCKET_NAME")
     google_application_credentials: str = Field(..., alias="GOOGLE_APPLICATION_CREDENTIALS")
+    image_rendition_format: str = Field(default="webp", alias="IMAGE_RENDITION_FORMAT")  # webp or avif
+    direct_upload_max_bytes: int = Field(default=10 * 1024 * 1024, alias="DIRECT_UPLOAD_MAX_BYTES")
+    direct_upload_ttl_seconds: int = Field(default=900, alias="DIRECT_UPLOAD_TTL_SECONDS")
+    
+    # Weekly insights (materialized in the background)
+    insights_flush_seconds: float = Field(default=2, alias="INSIGHTS_FLUSH_SECONDS")  # Coalescing window for queued meals
+    insights_batch_size: int = Field(default=200, alias="INSIGHTS_BATCH_SIZE")
+    insights_max_queue: int = Field(default=10000, alias="INSIGHTS_MAX_QUEUE")
+    insights_summaries: bool = Field(default=False, alias="INSIGHTS_SUMMARIES")  # Model-written weekly summary
+    insights_summary_hours: str = Field(default="2-5", alias="INSIGHTS_SUMMARY_HOURS")  # Off-peak UTC hours, start-end
+    insights_summary_interval_seconds: float = Field(default=600, alias="INSIGHTS_SUMMARY_INTERVAL_SECONDS")
+    insights_summary_batch: int = Field(default=50, alias="INSIGHTS_SUMMARY_BATCH")  # Weeks refreshed per run
+    
+    # Live dashboard events (/meals/events)
+    event_broker: str = Field(default="local", alias="EVENT_BROKER")  # local (single worker) or redis
+    redis_url: str = Field(default="redis://localhost:6379/0", alias="REDIS_URL")
+    event_heartbeat_seconds: float = Field(default=15, alias="EVENT_HEARTBEAT_SECONDS")
     
     # Application Configuration
     environment: str = Field(default="development", alias="ENVIRONMENT")
+    response_cache_max_entries: int = Field(default=1024, alias="RESPONSE_CACHE_MAX_ENTRIES")
+    fast_start: bool = Field(default=False, alias="FAST_START")  # Skip the startup MongoDB ping too
+    
+    # Observability Configuration
+    log_level: str = Field(default="INFO", alias="LOG_LEVEL")
+    log_format: str = Field(default="json", alias="LOG_FORMAT")  # json or text
+    log_debug_sample_rate: float = Field(default=1.0, alias="LOG_DEBUG_SAMPLE_RATE")
+    tracing_enabled: bool = Field(default=False, alias="TRACING_ENABLED")
+    telemetry_ttl_days: int = Field(default=90, alias="TELEMETRY_TTL_DAYS")  # Retention of per-analysis telemetry
     
     # Authentication Configuration
     google_client_id: str = Field(default="", alias="GOOGLE_CLIENT_ID")
     google_client_secret: str = Field(default="", alias="GOOGLE_CLIENT_SECRET")
     jwt_secret_key: str = Field(default="your-secret-key", alias="JWT_SECRET_KEY")
     frontend_url: str = Field(default="http://localhost:5173", alias="FRONTEND_URL")
+    admin_emails: str = Field(default="", alias="ADMIN_EMAILS")  # Comma-separated; may call /admin/* endpoints
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
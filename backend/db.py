@@ -4,22 +4,69 @@ Uses Motor for async MongoDB operations.
 """
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReturnDocument
 from config import get_settings
-from models import MealDocument
-from typing import Optional
+from models import MealDocument, MEAL_DOCUMENT_PROJECTION
+from metrics import MongoPoolListener
+import meal_buckets
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Reference counts for content-addressed images, keyed by image URL
+IMAGE_REFS_COLLECTION = "image_refs"
+
+# Attempts at bumping a user's data version before giving up
+DATA_VERSION_ATTEMPTS = 3
+
+# Every meal query is scoped to one user, so every index starts with user_id
+MEAL_INDEXES = [
+    # History pages and date-range filters
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created"),
+    # Verdict filter, newest first
+    IndexModel([("user_id", ASCENDING), ("health_verdict", ASCENDING), ("created_at", DESCENDING)],
+               name="user_verdict_created"),
+    # Calorie range filter
+    IndexModel([("user_id", ASCENDING), ("calories", ASCENDING)], name="user_calories"),
+    # Full-text search; the user_id prefix keeps each search inside one user's meals
+    IndexModel([("user_id", ASCENDING), ("food_items", TEXT), ("nutrition_advice", TEXT)],
+               name="user_text", weights={"food_items": 10, "nutrition_advice": 1},
+               default_language="english"),
+]
+
+# Bucketed layout (MEAL_STORAGE_LAYOUT=buckets): one document per user-day
+BUCKET_INDEXES = [
+    # History, stats and date-range filters walk a user's days newest first
+    IndexModel([("user_id", ASCENDING), ("day", DESCENDING)], name="user_day"),
+    # Narrows text search to the days mentioning the query
+    IndexModel([("user_id", ASCENDING), ("meals.fi", TEXT), ("meals.adv", TEXT)],
+               name="user_text", weights={"meals.fi": 10, "meals.adv": 1},
+               default_language="english"),
+]
+
+# Calorie facet bucket boundaries (kcal); the last bucket is open-ended
+CALORIE_FACET_BOUNDARIES = [0, 300, 600, 900, 1200]
+# Missing, null, negative or non-numeric calories
+CALORIE_FACET_UNKNOWN = "unknown"
+
+# Numeric fields that accept min/max range filters in search
+MACRO_RANGE_FIELDS = ("calories", "protein", "carbs", "fats")
+
 # Global MongoDB client
 _mongodb_client: Optional[AsyncIOMotorClient] = None
 _mongodb_database: Optional[AsyncIOMotorDatabase] = None
 
 
-async def connect_to_mongodb():
+async def connect_to_mongodb(ping: bool = True):
     """
     Establish connection to MongoDB.
     Should be called on application startup.
+    
+    Args:
+        ping: Verify the connection before returning. Fast-start mode skips
+            this and lets the background warmup fill the pool instead.
     """
     global _mongodb_client, _mongodb_database
     
@@ -29,16 +76,21 @@ async def connect_to_mongodb():
         # Add timeout to prevent hanging
         _mongodb_client = AsyncIOMotorClient(
             settings.mongodb_uri,
-            serverSelectionTimeoutMS=5000  # 5 second timeout
+            serverSelectionTimeoutMS=5000,  # 5 second timeout
+            event_listeners=[MongoPoolListener()]  # Pool stats for /metrics
         )
         _mongodb_database = _mongodb_client[settings.mongodb_db_name]
         
+        if not ping:
+            logger.info("MongoDB client created for database: %s", settings.mongodb_db_name)
+            return
+        
         # Test the connection
-        await _mongodb_client.admin.command('ping')
-        logger.info(f"Successfully connected to MongoDB database: {settings.mongodb_db_name}")
+        await ping_mongodb()
+        logger.info("Successfully connected to MongoDB database: %s", settings.mongodb_db_name)
         
     except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {e}")
+        logger.error("Failed to connect to MongoDB: %s", e)
         logger.error("Common fixes:")
         logger.error("1. Check if MongoDB URI is correct in .env file")
         logger.error("2. Whitelist your IP in MongoDB Atlas: Network Access -> Add IP Address")
@@ -46,6 +98,13 @@ async def connect_to_mongodb():
         raise
 
 
+async def ping_mongodb():
+    """Round-trip to the server, opening a pooled connection if needed."""
+    if _mongodb_client is None:
+        raise RuntimeError("Database not initialized. Call connect_to_mongodb() first.")
+    await _mongodb_client.admin.command('ping')
+
+
 async def close_mongodb_connection():
     """
     Close MongoDB connection.
@@ -58,6 +117,19 @@ async def close_mongodb_connection():
         logger.info("MongoDB connection closed")
 
 
+async def ensure_indexes():
+    """Create the meal indexes (no-op when they already exist)."""
+    settings = get_settings()
+    db = get_database()
+    await db[settings.mongodb_collection_name].create_indexes(MEAL_INDEXES)
+    if settings.meal_storage_layout == "buckets":
+        await db[meal_buckets.BUCKETS_COLLECTION].create_indexes(BUCKET_INDEXES)
+
+
+def uses_buckets() -> bool:
+    return get_settings().meal_storage_layout == "buckets"
+
+
 def get_database() -> AsyncIOMotorDatabase:
     """Get the MongoDB database instance."""
     if _mongodb_database is None:
@@ -68,6 +140,8 @@ def get_database() -> AsyncIOMotorDatabase:
 async def save_meal(meal_data: MealDocument) -> str:
     """
     Save meal data to MongoDB.
+    With the bucketed layout, signed-in users' meals are appended to their
+    user-day bucket; guest meals always go to the meals collection.
     
     Args:
         meal_data: MealDocument instance containing meal information
@@ -80,14 +154,93 @@ async def save_meal(meal_data: MealDocument) -> str:
     collection = db[settings.mongodb_collection_name]
     
     try:
-        # Insert the meal document
-        result = await collection.insert_one(meal_data.to_dict())
-        logger.info(f"Meal saved to MongoDB with ID: {meal_data.meal_id}")
-        return meal_data.meal_id
+        if meal_data.user_id and uses_buckets():
+            bucket_filter, update = meal_buckets.save_meal_update(meal_data.to_dict())
+            await db[meal_buckets.BUCKETS_COLLECTION].update_one(bucket_filter, update, upsert=True)
+        else:
+            # Insert the meal document
+            await collection.insert_one(meal_data.to_dict())
+        logger.debug("Meal saved to MongoDB with ID: %s", meal_data.meal_id)
         
     except Exception as e:
-        logger.error(f"Failed to save meal to MongoDB: {e}")
+        logger.error("Failed to save meal to MongoDB: %s", e)
         raise
+    
+    # After the write, so a concurrent read cannot cache pre-insert data under
+    # the new version. The meal is saved either way, so a failure is not raised.
+    if meal_data.user_id:
+        await bump_user_data_version(meal_data.user_id)
+    return meal_data.meal_id
+
+
+async def bump_user_data_version(user_id: str) -> bool:
+    """
+    Increment the user's data version, invalidating cached history/stats
+    responses and their ETags. Retried, then logged; never raised.
+    
+    Returns:
+        False if every attempt failed (cached responses stay stale until
+        the user's next saved meal)
+    """
+    db = get_database()
+    for attempt in range(1, DATA_VERSION_ATTEMPTS + 1):
+        try:
+            await db["users"].update_one({"user_id": user_id}, {"$inc": {"data_version": 1}})
+            return True
+        except Exception as e:
+            logger.warning("Data version bump failed (attempt %d/%d): %s", attempt, DATA_VERSION_ATTEMPTS, e)
+    logger.error("Data version of user %s not bumped; cached history/stats may be stale", user_id)
+    return False
+
+
+async def get_bucketed_meals(user_id: str, skip: int = 0, limit: int = 20) -> List[dict]:
+    """
+    One page of a user's meals, newest first, from the bucketed layout.
+    Reads whole days from the user_day index until the page is filled.
+    """
+    db = get_database()
+    cursor = db[meal_buckets.BUCKETS_COLLECTION].find({"user_id": user_id}).sort("day", DESCENDING)
+    meals: List[dict] = []
+    async for bucket in cursor:
+        meals.extend(meal_buckets.expand_bucket(bucket))
+        if len(meals) >= skip + limit:
+            break
+    return meals[skip:skip + limit]
+
+
+async def get_bucketed_stats(user_id: str, days: int = 7) -> List[dict]:
+    """Daily totals for the last `days` days with meals; one bucket read per day."""
+    db = get_database()
+    buckets = await db[meal_buckets.BUCKETS_COLLECTION].find(
+        {"user_id": user_id},
+        {"day": 1, "count": 1, "totals": 1}
+    ).sort("day", DESCENDING).limit(days).to_list(length=days)
+    return meal_buckets.stats_from_buckets(buckets)
+
+
+async def iter_bucketed_meals(user_id: str, batch_size: int):
+    """All of a user's meals, oldest first, for export."""
+    db = get_database()
+    cursor = db[meal_buckets.BUCKETS_COLLECTION].find({"user_id": user_id}).sort("day", ASCENDING)
+    async for bucket in cursor.batch_size(max(1, batch_size // 8)):
+        for meal in reversed(meal_buckets.expand_bucket(bucket)):
+            yield meal
+
+
+async def get_user_meals_between(user_id: str, start: datetime, end: datetime) -> List[dict]:
+    """A user's meals with start <= created_at < end, from either layout."""
+    db = get_database()
+    if uses_buckets():
+        buckets = await db[meal_buckets.BUCKETS_COLLECTION].find(
+            {"user_id": user_id, "day": {"$gte": meal_buckets.bucket_day(start), "$lt": end}}
+        ).to_list(length=None)
+        return [
+            meal for bucket in buckets for meal in meal_buckets.expand_bucket(bucket)
+            if start <= meal["created_at"] < end
+        ]
+    return await db[get_settings().mongodb_collection_name].find(
+        {"user_id": user_id, "created_at": {"$gte": start, "$lt": end}}, MEAL_DOCUMENT_PROJECTION
+    ).to_list(length=None)
 
 
 async def get_meal_by_id(meal_id: str) -> Optional[dict]:
@@ -109,5 +262,177 @@ async def get_meal_by_id(meal_id: str) -> Optional[dict]:
         return meal
         
     except Exception as e:
-        logger.error(f"Failed to retrieve meal from MongoDB: {e}")
+        logger.error("Failed to retrieve meal from MongoDB: %s", e)
         raise
+
+
+async def acquire_image_ref(image_url: str) -> bool:
+    """
+    Record one more meal referencing an image.
+    Identical uploads share a content-addressed object, so the object may
+    only be deleted once no meal refers to it.
+    
+    Call this before checking whether the image's objects already exist:
+    the reference then either stops gc_images.py from claiming the image,
+    or reports the claim so the caller rewrites the objects.
+    
+    Returns:
+        True if gc_images.py is collecting the image, in which case the
+        caller must rewrite its objects instead of reusing them
+    """
+    db = get_database()
+    ref = await db[IMAGE_REFS_COLLECTION].find_one_and_update(
+        {"_id": image_url},
+        {"$inc": {"refs": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return bool(ref.get("collecting"))
+
+
+async def release_image_ref(image_url: str) -> int:
+    """
+    Drop one reference to an image, e.g. when a meal is deleted.
+    The object itself is removed later by gc_images.py once the count
+    has stayed at zero for the grace period.
+    
+    Returns:
+        Remaining reference count
+    """
+    db = get_database()
+    ref = await db[IMAGE_REFS_COLLECTION].find_one_and_update(
+        {"_id": image_url},
+        {"$inc": {"refs": -1}, "$set": {"updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    return ref["refs"] if ref else 0
+
+
+def build_meal_search_pipeline(
+    user_id: str,
+    query: Optional[str] = None,
+    verdict: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+    skip: int = 0,
+    limit: int = 20
+) -> List[dict]:
+    """
+    Build a single aggregation returning one page of matching meals, the
+    total match count and facet counts.
+    
+    The leading $match uses the indexes in MEAL_INDEXES. The verdict filter
+    is applied inside $facet so the verdict facet still counts every
+    verdict (selecting "Healthy" shows how many Unhealthy meals match too).
+    
+    Args:
+        user_id: Owner of the meals
+        query: Text search over food_items and nutrition_advice
+        verdict: Healthy, Neutral or Unhealthy
+        date_from: Inclusive lower bound on created_at
+        date_to: Exclusive upper bound on created_at
+        ranges: Field -> (min, max) for fields in MACRO_RANGE_FIELDS
+        skip: Results to skip
+        limit: Results to return
+        
+    Returns:
+        Pipeline producing one document with results, total and facets
+    """
+    match: dict = {"user_id": user_id}
+    if query:
+        match["$text"] = {"$search": query}
+    if date_from or date_to:
+        match["created_at"] = {}
+        if date_from:
+            match["created_at"]["$gte"] = date_from
+        if date_to:
+            match["created_at"]["$lt"] = date_to
+    match.update(_range_match(ranges))
+    
+    sort = {"score": {"$meta": "textScore"}, "created_at": -1} if query else {"created_at": -1}
+    return [
+        {"$match": match},
+        {"$sort": sort},
+        _search_facet_stage(verdict, skip, limit, MEAL_DOCUMENT_PROJECTION),
+    ]
+
+
+def build_bucket_search_pipeline(
+    user_id: str,
+    query: Optional[str] = None,
+    verdict: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+    skip: int = 0,
+    limit: int = 20
+) -> List[dict]:
+    """
+    build_meal_search_pipeline for the bucketed layout. Same arguments and
+    output; results carry mn/mx arrays for meal_buckets.expand_search_results.
+    Ranked by recency only, since text scores belong to whole buckets.
+    """
+    stages, meal_match = meal_buckets.bucket_search_stages(user_id, query, date_from, date_to)
+    meal_match.update(_range_match(ranges))
+    if meal_match:
+        stages.append({"$match": meal_match})
+    return stages + [
+        {"$sort": {"created_at": -1}},
+        _search_facet_stage(verdict, skip, limit, {"_id": 0}),
+    ]
+
+
+def _range_match(ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]]) -> dict:
+    match = {}
+    for field, (low, high) in (ranges or {}).items():
+        if low is not None or high is not None:
+            match[field] = {}
+            if low is not None:
+                match[field]["$gte"] = low
+            if high is not None:
+                match[field]["$lte"] = high
+    return match
+
+
+def _search_facet_stage(verdict: Optional[str], skip: int, limit: int, projection: dict) -> dict:
+    verdict_match = [{"$match": {"health_verdict": verdict}}] if verdict else []
+    return {"$facet": {
+        "results": verdict_match + [
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$project": projection},
+        ],
+        "total": verdict_match + [{"$count": "count"}],
+        "health_verdict": [
+            {"$group": {"_id": "$health_verdict", "count": {"$sum": 1}}},
+        ],
+        "calories": verdict_match + [
+            {"$bucket": {
+                "groupBy": "$calories",
+                "boundaries": CALORIE_FACET_BOUNDARIES + [float("inf")],
+                "default": CALORIE_FACET_UNKNOWN,
+                "output": {"count": {"$sum": 1}},
+            }},
+        ],
+    }}
+
+
+def format_meal_search_result(result: dict) -> dict:
+    """Flatten the $facet output of build_meal_search_pipeline."""
+    boundaries = CALORIE_FACET_BOUNDARIES
+    labels = {low: f"{low}-{high}" for low, high in zip(boundaries, boundaries[1:])}
+    labels[boundaries[-1]] = f"{boundaries[-1]}+"
+    labels[CALORIE_FACET_UNKNOWN] = CALORIE_FACET_UNKNOWN
+    
+    total = result["total"][0]["count"] if result["total"] else 0
+    return {
+        "results": result["results"],
+        "total": total,
+        "facets": {
+            "health_verdict": {
+                bucket["_id"]: bucket["count"] for bucket in result["health_verdict"] if bucket["_id"]
+            },
+            "calories": {labels[bucket["_id"]]: bucket["count"] for bucket in result["calories"]},
+        },
+    }
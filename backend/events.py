@@ -0,0 +1,188 @@
+"""
+Per-user live events (new meals and stat deltas) pushed to dashboards.
+
+Publishers call `get_event_broker().publish(user_id, event)` after a meal
+is saved; `/meals/events` streams each user's events as Server-Sent Events.
+EVENT_BROKER picks the broker:
+
+- local: in-process pub/sub. Enough for a single worker.
+- redis: Redis pub/sub (needs the `redis` package and REDIS_URL), so an
+  event published by one worker reaches subscribers on every worker.
+
+Other brokers implement EventBroker and are added to BROKERS.
+"""
+
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import AsyncContextManager, AsyncIterator, Callable, Dict, Set
+import asyncio
+import logging
+
+import orjson
+
+from config import get_settings
+from metrics import EVENT_SUBSCRIBERS
+
+logger = logging.getLogger(__name__)
+
+# Events a slow subscriber may fall behind by before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 64
+
+
+class EventBroker:
+    """Interface for delivering per-user events to subscribed connections."""
+
+    async def publish(self, user_id: str, event: dict) -> None:
+        raise NotImplementedError
+
+    def subscribe(self, user_id: str) -> AsyncContextManager[asyncio.Queue]:
+        """Async context manager yielding a queue of the user's events."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+def _offer(queue: asyncio.Queue, event: dict) -> None:
+    """Enqueue without blocking the publisher; drop the oldest event when full."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+class LocalEventBroker(EventBroker):
+    """In-process pub/sub: one bounded queue per open connection."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    async def publish(self, user_id: str, event: dict) -> None:
+        for queue in self._subscribers.get(user_id, ()):
+            _offer(queue, event)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: str) -> AsyncIterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        EVENT_SUBSCRIBERS.inc()
+        try:
+            yield queue
+        finally:
+            EVENT_SUBSCRIBERS.dec()
+            queues = self._subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[user_id]
+
+
+class RedisEventBroker(EventBroker):
+    """
+    Redis pub/sub on channel `eatright:events:<user_id>`. Each worker keeps
+    one Redis subscription per user with open connections and fans out to
+    them through a LocalEventBroker.
+    """
+
+    CHANNEL_PREFIX = "eatright:events:"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("EVENT_BROKER=redis requires the redis package") from e
+        self._redis = redis.from_url(url)
+        self._local = LocalEventBroker()
+        self._listeners: Dict[str, asyncio.Task] = {}
+        self._refs: Dict[str, int] = {}
+
+    async def publish(self, user_id: str, event: dict) -> None:
+        await self._redis.publish(self.CHANNEL_PREFIX + user_id, orjson.dumps(event))
+
+    async def _listen(self, user_id: str) -> None:
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.CHANNEL_PREFIX + user_id)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    await self._local.publish(user_id, orjson.loads(message["data"]))
+        finally:
+            await pubsub.aclose()
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: str) -> AsyncIterator[asyncio.Queue]:
+        self._refs[user_id] = self._refs.get(user_id, 0) + 1
+        if user_id not in self._listeners:
+            self._listeners[user_id] = asyncio.create_task(self._listen(user_id))
+        try:
+            async with self._local.subscribe(user_id) as queue:
+                yield queue
+        finally:
+            self._refs[user_id] -= 1
+            if not self._refs[user_id]:
+                del self._refs[user_id]
+                self._listeners.pop(user_id).cancel()
+
+    async def close(self) -> None:
+        for task in self._listeners.values():
+            task.cancel()
+        await self._redis.aclose()
+
+
+BROKERS: Dict[str, Callable[[], EventBroker]] = {
+    "local": LocalEventBroker,
+    "redis": lambda: RedisEventBroker(get_settings().redis_url),
+}
+
+
+@lru_cache()
+def get_event_broker() -> EventBroker:
+    name = get_settings().event_broker
+    if name not in BROKERS:
+        raise ValueError(f"Unknown EVENT_BROKER '{name}' (expected one of: {', '.join(BROKERS)})")
+    return BROKERS[name]()
+
+
+def meal_saved_event(meal: dict) -> dict:
+    """
+    Event for a newly saved meal: the meal as /meals/history returns it, plus the
+    change to its day's row in /meals/stats.
+    """
+    created_at: datetime = meal["created_at"]
+    return {
+        "type": "meal_saved",
+        "meal": meal,
+        "stats_delta": {
+            "_id": f"{created_at:%Y-%m-%d}",
+            "total_calories": meal.get("calories") or 0,
+            "total_protein": meal.get("protein") or 0,
+            "total_carbs": meal.get("carbs") or 0,
+            "total_fats": meal.get("fats") or 0,
+            "meal_count": 1,
+        },
+    }
+
+
+async def publish_meal_saved(user_id: str, meal: dict) -> None:
+    """Notify the user's open dashboards; failures are logged, never raised."""
+    try:
+        await get_event_broker().publish(user_id, meal_saved_event(meal))
+    except Exception as e:
+        logger.warning("Failed to publish meal event: %s", e)
+
+
+async def stream_events(user_id: str, heartbeat: float) -> AsyncIterator[bytes]:
+    """
+    SSE frames for the user's events, with comment heartbeats so idle
+    proxies keep the connection open. The subscription lives as long as
+    the stream; a client disconnect cancels it.
+    """
+    async with get_event_broker().subscribe(user_id) as queue:
+        yield b"retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+            yield b"event: " + event["type"].encode() + b"\ndata: " + orjson.dumps(event) + b"\n\n"
@@ -0,0 +1,206 @@
+"""
+Streaming meal history export (NDJSON, CSV, Parquet, Arrow IPC).
+Meals are read from a Motor cursor in batches and each batch is encoded
+and yielded as one chunk, so memory use does not grow with history size.
+Parquet and Arrow need pyarrow, which is optional.
+"""
+
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+import csv
+import importlib.util
+import io
+
+import orjson
+
+from models import MICRONUTRIENT_UNITS, micronutrient_amount
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+# Micronutrients become one column each, in the dictionary's canonical unit
+MICRONUTRIENT_COLUMNS = {key: f"{key}_{unit}" for key, unit in MICRONUTRIENT_UNITS.items()}
+
+EXPORT_COLUMNS = [
+    "meal_id", "created_at", "source", "health_verdict",
+    "calories", "protein", "carbs", "fats",
+    *MICRONUTRIENT_COLUMNS.values(),
+    "food_items", "benefits", "cautions", "nutrition_advice", "image_url",
+]
+
+# Separator for list fields in flat formats
+LIST_SEPARATOR = "; "
+
+# Projection for export queries: every field the writers use
+EXPORT_PROJECTION = {
+    "_id": 0, "meal_id": 1, "created_at": 1, "source": 1, "health_verdict": 1,
+    "calories": 1, "protein": 1, "carbs": 1, "fats": 1, "micronutrients": 1,
+    "food_items": 1, "benefits": 1, "cautions": 1, "nutrition_advice": 1,
+    "image_url": 1, "thumbnail_url": 1, "medium_url": 1, "reconciliation": 1,
+}
+
+
+def columnar_supported() -> bool:
+    # Checked without importing: pyarrow is only loaded by a columnar export
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def flatten_meal(meal: dict) -> dict:
+    """One flat row per meal, micronutrients spread over their own columns."""
+    micronutrients = meal.get("micronutrients") or {}
+    row = {
+        "meal_id": meal.get("meal_id"),
+        "created_at": meal.get("created_at"),
+        "source": meal.get("source", "image"),
+        "health_verdict": meal.get("health_verdict"),
+        "calories": meal.get("calories"),
+        "protein": meal.get("protein"),
+        "carbs": meal.get("carbs"),
+        "fats": meal.get("fats"),
+    }
+    for key, column in MICRONUTRIENT_COLUMNS.items():
+        row[column] = micronutrient_amount(micronutrients.get(key), MICRONUTRIENT_UNITS[key])
+    for field in ("food_items", "benefits", "cautions"):
+        row[field] = LIST_SEPARATOR.join(str(item) for item in meal.get(field) or [])
+    row["nutrition_advice"] = meal.get("nutrition_advice")
+    row["image_url"] = meal.get("image_url")
+    return row
+
+
+def _encode_ndjson(meals: List[dict], first: bool) -> bytes:
+    # NDJSON keeps the document shape (nested micronutrients included)
+    return b"".join(orjson.dumps(meal) + b"\n" for meal in meals)
+
+
+def _encode_csv(meals: List[dict], first: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+    if first:
+        writer.writeheader()
+    for meal in meals:
+        row = flatten_meal(meal)
+        if isinstance(row["created_at"], datetime):
+            row["created_at"] = row["created_at"].isoformat()
+        writer.writerow(row)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _arrow_schema(pa):
+    fields = [
+        pa.field("meal_id", pa.string()),
+        pa.field("created_at", pa.timestamp("ms")),
+        pa.field("source", pa.string()),
+        pa.field("health_verdict", pa.string()),
+        pa.field("calories", pa.int64()),
+        pa.field("protein", pa.float64()),
+        pa.field("carbs", pa.float64()),
+        pa.field("fats", pa.float64()),
+        *(pa.field(column, pa.float64()) for column in MICRONUTRIENT_COLUMNS.values()),
+        pa.field("food_items", pa.list_(pa.string())),
+        pa.field("benefits", pa.list_(pa.string())),
+        pa.field("cautions", pa.list_(pa.string())),
+        pa.field("nutrition_advice", pa.string()),
+        pa.field("image_url", pa.string()),
+    ]
+    return pa.schema(fields)
+
+
+def _arrow_batch(pa, meals: List[dict], schema):
+    """Build a RecordBatch; list fields stay lists in columnar formats."""
+    rows = []
+    for meal in meals:
+        row = flatten_meal(meal)
+        for field in ("food_items", "benefits", "cautions"):
+            row[field] = [str(item) for item in meal.get(field) or []]
+        rows.append(row)
+    columns = {name: [row[name] for row in rows] for name in schema.names}
+    return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only file object whose contents are taken after every batch."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _batches(cursor, batch_size: int) -> AsyncIterator[List[dict]]:
+    batch: List[dict] = []
+    async for meal in cursor:
+        batch.append(meal)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream_export(cursor, export_format: str, batch_size: int) -> AsyncIterator[bytes]:
+    """
+    Encode meals from `cursor` as `export_format`, one chunk per batch.
+
+    Args:
+        cursor: Motor cursor over meal documents (EXPORT_PROJECTION)
+        export_format: One of EXPORT_MEDIA_TYPES
+        batch_size: Documents per chunk (also the cursor's batch size)
+    """
+    if export_format in COLUMNAR_FORMATS:
+        async for chunk in _stream_columnar(cursor, export_format, batch_size):
+            yield chunk
+        return
+
+    encode = _encode_ndjson if export_format == "ndjson" else _encode_csv
+    first = True
+    async for batch in _batches(cursor, batch_size):
+        yield encode(batch, first)
+        first = False
+    if first and export_format == "csv":
+        yield encode([], True)  # header only
+
+
+async def _stream_columnar(cursor, export_format: str, batch_size: int) -> AsyncIterator[bytes]:
+    import pyarrow as pa
+
+    schema = _arrow_schema(pa)
+    sink = _DrainableSink()
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        write = writer.write_batch  # one row group per batch
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+
+    try:
+        async for batch in _batches(cursor, batch_size):
+            write(_arrow_batch(pa, batch, schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_filename(export_format: str, now: Optional[datetime] = None) -> str:
+    extension = "arrows" if export_format == "arrow" else export_format
+    return f"eatright-meals-{(now or datetime.utcnow()):%Y%m%d}.{extension}"
+
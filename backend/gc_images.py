@@ -0,0 +1,75 @@
+"""
+Garbage-collect content-addressed meal images and their renditions.
+Deletes GCS objects whose reference count (see db.release_image_ref) has
+been zero for longer than the grace period.
+
+An upload can re-reference an image while it is being collected, so the
+reference is claimed (flagged `collecting`) rather than removed, and each
+object is deleted only at the generation read before the claim. An upload
+that sees the flag rewrites the objects (db.acquire_image_ref), and the
+new generation survives the conditional delete.
+
+Usage: python gc_images.py [--grace-hours N] [--dry-run]
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+
+from db import IMAGE_REFS_COLLECTION, connect_to_mongodb, close_mongodb_connection, get_database
+from storage import delete_generation, get_object_name, image_object_names, object_generation
+
+
+async def collect_garbage(grace_hours: float, dry_run: bool) -> int:
+    await connect_to_mongodb()
+    try:
+        refs = get_database()[IMAGE_REFS_COLLECTION]
+        cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+        stale = {"refs": {"$lte": 0}, "updated_at": {"$lt": cutoff}}
+
+        deleted = 0
+        async for ref in refs.find(stale, {"_id": 1}):
+            image_url = ref["_id"]
+            object_name = get_object_name(image_url)
+
+            if dry_run:
+                print(f"Would delete: {object_name or image_url}")
+                continue
+
+            object_names = image_object_names(object_name) if object_name else []
+            generations = {
+                name: await asyncio.to_thread(object_generation, name) for name in object_names
+            }
+
+            # Claim atomically: a concurrent upload may have re-acquired it
+            claimed = await refs.find_one_and_update({"_id": image_url, **stale}, {"$set": {"collecting": True}})
+            if claimed is None:
+                continue
+
+            for name, generation in generations.items():
+                if generation is not None and await asyncio.to_thread(delete_generation, name, generation):
+                    deleted += 1
+                    print(f"Deleted: {name}")
+
+            # Drop the reference unless an upload re-acquired it meanwhile
+            released = await refs.find_one_and_delete({"_id": image_url, "collecting": True, "refs": {"$lte": 0}})
+            if released is None:
+                await refs.update_one({"_id": image_url}, {"$unset": {"collecting": ""}})
+
+        return deleted
+    finally:
+        await close_mongodb_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--grace-hours", type=float, default=24.0)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    deleted = asyncio.run(collect_garbage(args.grace_hours, args.dry_run))
+    print(f"Deleted {deleted} unreferenced image object(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Image helpers built on Pillow: rendition generation (thumbnail and medium
+sizes), produced once at upload time so history pages never have to
+download full-resolution originals, and a cheap visual complexity
+estimate used for model routing.
+"""
+
+from functools import lru_cache
+from typing import Dict, Tuple
+import io
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels, largest first (smaller renditions are cut from larger ones)
+RENDITION_SIZES = {
+    "medium": 1280,
+    "thumb": 480,  # History cards are ~280-400px wide; covers 2x displays at 240px
+}
+
+RENDITION_QUALITY = 80
+
+RENDITION_CONTENT_TYPES = {
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+
+@lru_cache()
+def resolve_rendition_format(requested: str) -> str:
+    """
+    Return the requested format if this Pillow build can encode it, else WebP.
+    Probing codecs loads Pillow, so this is resolved on first use (or in warmup).
+    """
+    from PIL import features
+
+    requested = requested.lower()
+    if requested == "avif" and features.check("avif"):
+        return "avif"
+    if requested != "webp":
+        logger.warning("Rendition format '%s' unsupported, using webp", requested)
+    return "webp"
+
+
+def generate_renditions(image_bytes: bytes, image_format: str = "webp") -> Dict[str, bytes]:
+    """
+    Encode every rendition in RENDITION_SIZES.
+
+    Args:
+        image_bytes: Original image bytes
+        image_format: 'webp' or 'avif' (see resolve_rendition_format)
+
+    Returns:
+        Mapping of rendition name to encoded bytes
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(image_bytes))
+
+    # Let the JPEG decoder downscale by a power of two while decoding
+    largest = max(RENDITION_SIZES.values())
+    image.draft("RGB", (largest, largest))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+
+    renditions = {}
+    for name, size in sorted(RENDITION_SIZES.items(), key=lambda item: -item[1]):
+        if image.width > size or image.height > size:
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format.upper(), quality=RENDITION_QUALITY)
+        renditions[name] = buffer.getvalue()
+
+    return renditions
+
+
+# JPEG quality of images sent to the model
+MODEL_JPEG_QUALITY = 90
+
+_EXIF_ORIENTATION = 0x0112
+
+
+def encode_model_image(image_bytes: bytes, max_size: int) -> Tuple[bytes, int, int]:
+    """
+    JPEG bytes for the model request, longest side at most `max_size`.
+    Upright RGB JPEGs that already fit are passed through untouched;
+    anything else is decoded, resized and encoded once here, so the SDK
+    does not re-serialize a PIL image (as lossless WebP) on every call.
+
+    Returns:
+        (jpeg_bytes, width, height)
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(image_bytes))
+    upright = image.getexif().get(_EXIF_ORIENTATION, 1) == 1
+    if (image.format == "JPEG" and image.mode == "RGB" and upright
+            and image.width <= max_size and image.height <= max_size):
+        return image_bytes, image.width, image.height
+
+    image.draft("RGB", (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+    if image.width > max_size or image.height > max_size:
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=MODEL_JPEG_QUALITY)
+    return buffer.getvalue(), image.width, image.height
+
+
+def generate_preview_data_url(image_bytes: bytes, size: int, image_format: str = "webp") -> str:
+    """
+    Small inline preview as a data: URL, for responses whose image is not
+    stored anywhere (ephemeral guest analyses).
+    """
+    import base64
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("RGB", (size, size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    image.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper(), quality=RENDITION_QUALITY)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return f"data:{RENDITION_CONTENT_TYPES[image_format]};base64,{encoded}"
+
+
+# Complexity is measured on a copy this small (longest side, pixels)
+COMPLEXITY_SAMPLE_SIZE = 128
+# Gradient magnitude (0-255) above which a pixel counts as an edge
+EDGE_THRESHOLD = 48
+# Edge density treated as maximally busy
+EDGE_DENSITY_CEILING = 0.25
+COMPLEXITY_PALETTE_COLORS = 64
+
+
+def estimate_complexity(image_bytes: bytes) -> Dict[str, float]:
+    """
+    Estimate how visually busy an image is, in a few milliseconds.
+    A single apple on a plate scores low; a crowded table scores high.
+    JPEGs are decoded at reduced scale (draft mode), so the cost barely
+    depends on the original resolution.
+
+    Args:
+        image_bytes: Original image bytes
+
+    Returns:
+        edge_density (share of edge pixels), color_entropy (bits, over a
+        64-colour palette) and score (0-1 blend of both)
+    """
+    from PIL import Image, ImageFilter
+
+    sample = Image.open(io.BytesIO(image_bytes))
+    sample.draft("RGB", (COMPLEXITY_SAMPLE_SIZE, COMPLEXITY_SAMPLE_SIZE))
+    sample.thumbnail((COMPLEXITY_SAMPLE_SIZE, COMPLEXITY_SAMPLE_SIZE), Image.Resampling.BILINEAR)
+    if sample.mode != "RGB":
+        sample = sample.convert("RGB")
+
+    edges = sample.convert("L").filter(ImageFilter.FIND_EDGES)
+    histogram = edges.histogram()
+    edge_density = sum(histogram[EDGE_THRESHOLD:]) / max(1, sum(histogram))
+
+    palette = sample.quantize(colors=COMPLEXITY_PALETTE_COLORS, method=Image.Quantize.FASTOCTREE)
+    color_entropy = abs(palette.entropy())  # entropy() can return -0.0
+
+    score = (
+        0.6 * min(edge_density / EDGE_DENSITY_CEILING, 1.0)
+        + 0.4 * color_entropy / math.log2(COMPLEXITY_PALETTE_COLORS)
+    )
+    return {
+        "edge_density": round(edge_density, 4),
+        "color_entropy": round(color_entropy, 3),
+        "score": round(min(score, 1.0), 3),
+    }
@@ -0,0 +1,335 @@
+"""
+Weekly health insights, materialized in the background.
+
+Each saved meal is queued to the InsightsScheduler, which folds it into
+the user's `weekly_insights` document for that ISO week (verdict counts,
+macro totals, and benefit/caution counts keyed by a normalized slug so
+rewordings like "High protein." and "high protein" count once). Bursts
+are coalesced into one bulk write per flush.
+
+Off-peak (INSIGHTS_SUMMARY_HOURS), stale weeks are rebuilt from the meals
+themselves, which also repairs updates lost in a restart, and, with
+INSIGHTS_SUMMARIES on, given a short model summary. Reading a week is a
+single _id lookup.
+"""
+
+from datetime import datetime, timedelta, time as dtime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import re
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+
+from config import get_settings
+from db import get_database, get_user_meals_between
+
+logger = logging.getLogger(__name__)
+
+INSIGHTS_COLLECTION = "weekly_insights"
+
+VERDICTS = ("Healthy", "Neutral", "Unhealthy")
+TOTAL_FIELDS = ("calories", "protein", "carbs", "fats")
+
+# Benefits/cautions returned per week, most frequent first
+TOP_ITEMS = 5
+
+# kcal per gram
+_KCAL = {"protein": 4, "carbs": 4, "fats": 9}
+
+INSIGHTS_INDEXES = [
+    IndexModel([("user_id", ASCENDING), ("week_start", DESCENDING)], name="user_week"),
+    # The off-peak job only looks at weeks changed since their last rebuild
+    IndexModel([("updated_at", ASCENDING)], name="stale_updated",
+               partialFilterExpression={"summary_stale": True}),
+]
+
+
+async def ensure_insights_indexes():
+    await get_database()[INSIGHTS_COLLECTION].create_indexes(INSIGHTS_INDEXES)
+
+
+def week_start(moment: datetime) -> datetime:
+    """Monday 00:00 (UTC) of the week containing `moment`."""
+    return datetime.combine(moment.date() - timedelta(days=moment.weekday()), dtime.min)
+
+
+def insight_id(user_id: str, week: datetime) -> str:
+    return f"{user_id}:{week:%Y-%m-%d}"
+
+
+def item_key(text: str) -> str:
+    """Slug used to deduplicate benefits/cautions (also a safe Mongo field name)."""
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")[:80]
+
+
+def _meal_changes(meal: dict, inc: Dict[str, float], labels: Dict[str, str]) -> None:
+    """Accumulate one meal's counters into `inc` and display texts into `labels`."""
+    inc["meal_count"] = inc.get("meal_count", 0) + 1
+    verdict = meal.get("health_verdict")
+    if verdict in VERDICTS:
+        inc[f"verdicts.{verdict}"] = inc.get(f"verdicts.{verdict}", 0) + 1
+    for field in TOTAL_FIELDS:
+        inc[f"totals.{field}"] = inc.get(f"totals.{field}", 0) + (meal.get(field) or 0)
+    for kind in ("benefits", "cautions"):
+        seen = set()
+        for text in meal.get(kind) or ():
+            key = item_key(str(text))
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            inc[f"{kind}.{key}.count"] = inc.get(f"{kind}.{key}.count", 0) + 1
+            labels[f"{kind}.{key}.text"] = str(text).strip()
+
+
+def coalesce_updates(meals: Iterable[dict], now: Optional[datetime] = None) -> List[UpdateOne]:
+    """One upsert per user-week for a batch of newly saved meals."""
+    grouped: Dict[str, Tuple[dict, Dict[str, float], Dict[str, str]]] = {}
+    for meal in meals:
+        week = week_start(meal["created_at"])
+        _id = insight_id(meal["user_id"], week)
+        if _id not in grouped:
+            grouped[_id] = ({"user_id": meal["user_id"], "week_start": week}, {}, {})
+        _, inc, labels = grouped[_id]
+        _meal_changes(meal, inc, labels)
+
+    now = now or datetime.utcnow()
+    return [
+        UpdateOne({"_id": _id}, {
+            "$setOnInsert": on_insert,
+            "$inc": inc,
+            "$set": {**labels, "updated_at": now, "summary_stale": True},
+        }, upsert=True)
+        for _id, (on_insert, inc, labels) in grouped.items()
+    ]
+
+
+def build_week(user_id: str, week: datetime, meals: Iterable[dict]) -> dict:
+    """The full counters of a week, computed from its meals."""
+    inc: Dict[str, float] = {}
+    labels: Dict[str, str] = {}
+    for meal in meals:
+        _meal_changes(meal, inc, labels)
+
+    doc: dict = {
+        "user_id": user_id,
+        "week_start": week,
+        "meal_count": 0,
+        "verdicts": {},
+        "totals": dict.fromkeys(TOTAL_FIELDS, 0),
+        "benefits": {},
+        "cautions": {},
+    }
+    for path, value in list(inc.items()) + list(labels.items()):
+        *parents, leaf = path.split(".")
+        target = doc
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return doc
+
+
+def _ranked(items: Optional[dict]) -> List[dict]:
+    ranked = sorted((items or {}).values(), key=lambda item: (-item["count"], item["text"]))
+    return [{"text": item["text"], "count": item["count"]} for item in ranked[:TOP_ITEMS]]
+
+
+def format_insights(doc: Optional[dict], user_id: str, week: datetime) -> dict:
+    """API shape: ratios, macro balance and ranked benefits/cautions."""
+    doc = doc or build_week(user_id, week, ())
+    count = doc.get("meal_count", 0)
+    verdicts = doc.get("verdicts") or {}
+    totals = doc.get("totals") or {}
+    macro_kcal = {field: (totals.get(field) or 0) * kcal for field, kcal in _KCAL.items()}
+    kcal_sum = sum(macro_kcal.values())
+    return {
+        "week_start": f"{week:%Y-%m-%d}",
+        "meal_count": count,
+        "verdict_ratios": {
+            verdict: round(verdicts.get(verdict, 0) / count, 3) if count else 0.0 for verdict in VERDICTS
+        },
+        "average_calories": round((totals.get("calories") or 0) / count) if count else 0,
+        # Share of macro energy from each macronutrient, in percent
+        "macro_balance": {
+            field: round(100 * value / kcal_sum, 1) if kcal_sum else 0.0 for field, value in macro_kcal.items()
+        },
+        "top_benefits": _ranked(doc.get("benefits")),
+        "top_cautions": _ranked(doc.get("cautions")),
+        "summary": doc.get("summary"),
+        "updated_at": doc.get("updated_at"),
+    }
+
+
+async def get_weekly_insights(user_id: str, moment: datetime) -> dict:
+    week = week_start(moment)
+    doc = await get_database()[INSIGHTS_COLLECTION].find_one({"_id": insight_id(user_id, week)})
+    return format_insights(doc, user_id, week)
+
+
+def in_window(hours: str, moment: datetime) -> bool:
+    """Whether `moment`'s UTC hour falls in 'start-end' (end exclusive, may wrap midnight)."""
+    start, end = (int(part) for part in hours.split("-"))
+    hour = moment.hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def summary_prompt(insights: dict) -> str:
+    ratios = insights["verdict_ratios"]
+    balance = insights["macro_balance"]
+    lines = [
+        f"Meals logged this week: {insights['meal_count']}",
+        f"Healthy/neutral/unhealthy share: {ratios['Healthy']:.0%}/{ratios['Neutral']:.0%}/{ratios['Unhealthy']:.0%}",
+        f"Average calories per meal: {insights['average_calories']}",
+        f"Energy from protein/carbs/fats: {balance['protein']}%/{balance['carbs']}%/{balance['fats']}%",
+        "Recurring benefits: " + "; ".join(item["text"] for item in insights["top_benefits"]),
+        "Recurring cautions: " + "; ".join(item["text"] for item in insights["top_cautions"]),
+    ]
+    return (
+        "You are a nutrition coach. In 2-3 short sentences, summarize this week of eating "
+        "and give one concrete suggestion. Plain text only.\n\n" + "\n".join(lines)
+    )
+
+
+class InsightsScheduler:
+    """
+    Background tasks owned by the app lifespan: one folds queued meals into
+    weekly documents, the other rebuilds and summarizes stale weeks off-peak.
+    """
+
+    def __init__(self, flush_interval: float, batch_size: int, max_queue: int,
+                 summary_interval: float, summary_hours: str, summary_batch: int, summaries: bool):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.summary_interval = summary_interval
+        self.summary_hours = summary_hours
+        self.summary_batch = summary_batch
+        self.summaries = summaries
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks: List[asyncio.Task] = []
+        # Weeks of dropped meals being flagged stale, by insight _id
+        self._marking: Dict[str, asyncio.Task] = {}
+
+    def enqueue(self, meal: dict) -> None:
+        """
+        Queue a saved meal; never blocks the request. When the queue is full
+        the meal's week is flagged stale instead, so the off-peak rebuild
+        counts it from the meals collection.
+        """
+        if not meal.get("user_id"):
+            return
+        try:
+            self._queue.put_nowait(meal)
+        except asyncio.QueueFull:
+            logger.warning("Insights queue full, meal %s left for the off-peak rebuild", meal.get("meal_id"))
+            self._mark_stale(meal)
+
+    def _mark_stale(self, meal: dict) -> None:
+        week = week_start(meal["created_at"])
+        _id = insight_id(meal["user_id"], week)
+        if _id in self._marking:  # one write per week while a burst is dropped
+            return
+        task = asyncio.create_task(self._write_stale(_id, meal["user_id"], week))
+        self._marking[_id] = task
+        task.add_done_callback(lambda _: self._marking.pop(_id, None))
+
+    async def _write_stale(self, _id: str, user_id: str, week: datetime) -> None:
+        try:
+            await get_database()[INSIGHTS_COLLECTION].update_one({"_id": _id}, {
+                "$setOnInsert": {"user_id": user_id, "week_start": week},
+                "$set": {"updated_at": datetime.utcnow(), "summary_stale": True},
+            }, upsert=True)
+        except Exception as e:
+            logger.error("Failed to flag weekly insights %s for rebuild: %s", _id, e)
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._materialize_loop()),
+            asyncio.create_task(self._summary_loop()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._marking.values(), return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+
+    def _drain(self) -> List[dict]:
+        meals = []
+        while len(meals) < self.batch_size and not self._queue.empty():
+            meals.append(self._queue.get_nowait())
+        return meals
+
+    async def flush(self) -> int:
+        """Write everything queued so far; returns the number of meals applied."""
+        applied = 0
+        while not self._queue.empty():
+            meals = self._drain()
+            try:
+                await get_database()[INSIGHTS_COLLECTION].bulk_write(coalesce_updates(meals), ordered=False)
+                applied += len(meals)
+            except Exception as e:
+                logger.error("Failed to update weekly insights: %s", e)
+        return applied
+
+    async def _materialize_loop(self) -> None:
+        while True:
+            meal = await self._queue.get()
+            self._queue.put_nowait(meal)
+            # Let a burst of meals arrive so they share one write per user-week
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _summary_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            if in_window(self.summary_hours, datetime.utcnow()):
+                try:
+                    await self.refresh_stale_weeks()
+                except Exception as e:
+                    logger.error("Weekly insights refresh failed: %s", e)
+
+    async def refresh_stale_weeks(self) -> int:
+        """
+        Rebuild up to `summary_batch` stale weeks from their meals and
+        (optionally) summarize them. A week that receives a meal meanwhile
+        keeps its stale flag and is picked up again next time.
+        """
+        from ai import summarize_insights
+
+        collection = get_database()[INSIGHTS_COLLECTION]
+        stale = await collection.find(
+            {"summary_stale": True}, {"user_id": 1, "week_start": 1, "updated_at": 1}
+        ).sort("updated_at", ASCENDING).limit(self.summary_batch).to_list(length=self.summary_batch)
+
+        refreshed = 0
+        for doc in stale:
+            week = doc["week_start"]
+            meals = await get_user_meals_between(doc["user_id"], week, week + timedelta(days=7))
+            rebuilt = build_week(doc["user_id"], week, meals)
+            if self.summaries and rebuilt["meal_count"]:
+                rebuilt["summary"] = await summarize_insights(
+                    summary_prompt(format_insights(rebuilt, doc["user_id"], week))
+                )
+                rebuilt["summary_at"] = datetime.utcnow()
+            result = await collection.update_one(
+                {"_id": doc["_id"], "updated_at": doc["updated_at"]},
+                {"$set": {**rebuilt, "summary_stale": False}}
+            )
+            refreshed += result.modified_count
+        return refreshed
+
+
+@lru_cache()
+def get_insights_scheduler() -> InsightsScheduler:
+    settings = get_settings()
+    return InsightsScheduler(
+        flush_interval=settings.insights_flush_seconds,
+        batch_size=settings.insights_batch_size,
+        max_queue=settings.insights_max_queue,
+        summary_interval=settings.insights_summary_interval_seconds,
+        summary_hours=settings.insights_summary_hours,
+        summary_batch=settings.insights_summary_batch,
+        summaries=settings.insights_summaries,
+    )
@@ -0,0 +1,214 @@
+"""
+Non-blocking structured logging.
+Records are handed to a QueueHandler on the event-loop thread and
+formatted/written by a QueueListener thread, so log I/O never blocks a
+request. Each record carries the current request id, and every request
+ends with one summary line including its stage timings.
+"""
+
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+import atexit
+import copy
+import logging
+import queue
+import random
+import sys
+import time
+import uuid
+
+import orjson
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+stage_timings_var: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+debug_sampled_var: ContextVar[bool] = ContextVar("debug_sampled", default=True)
+
+_listener: Optional[QueueListener] = None
+_debug_sample_rate = 1.0
+
+access_logger = logging.getLogger("eatright.access")
+
+
+def record_stage_timing(stage: str, duration: float) -> None:
+    """Attach a stage duration to the current request's summary line."""
+    timings = stage_timings_var.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + duration * 1000, 2)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamp records with the request id and drop DEBUG records of requests
+    that were not sampled. Runs on the calling thread, so it stays cheap.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and not debug_sampled_var.get():
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler that defers message interpolation to the listener thread.
+    The stock handler formats every record before enqueueing it; only the
+    traceback (which cannot cross threads safely) is rendered here.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, timestamps in UTC."""
+
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    """The original human-readable format, plus request id and extra fields."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        fields = getattr(record, "fields", None)
+        if request_id:
+            line += f" [request_id={request_id}]"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging(level: str = "INFO", log_format: str = "json",
+                      debug_sample_rate: float = 1.0) -> None:
+    """
+    Route all logging through a queue to a background writer thread.
+
+    Args:
+        level: Root log level
+        log_format: 'json' or 'text'
+        debug_sample_rate: Fraction of requests whose DEBUG records are kept
+            (only relevant when level is DEBUG)
+    """
+    global _listener, _debug_sample_rate
+
+    if _listener is not None:
+        return
+
+    _debug_sample_rate = debug_sample_rate
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    # Uvicorn installs its own handlers; send its records through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+    # RequestContextMiddleware writes the access line (with request id and timings)
+    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestContextMiddleware:
+    """
+    Pure ASGI middleware that assigns a request id (honouring an incoming
+    X-Request-ID), decides DEBUG sampling for the request, and logs one
+    summary line with status, latency and stage timings.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        request_token = request_id_var.set(request_id)
+        timings: Dict[str, float] = {}
+        timings_token = stage_timings_var.set(timings)
+        sampled_token = debug_sampled_var.set(random.random() < _debug_sample_rate)
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            access_logger.info(
+                "%s %s %s", scope["method"], getattr(route, "path", scope["path"]), status_holder[0],
+                extra={"fields": {
+                    "status": status_holder[0],
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                    # Copied: tasks that inherited the context (renditions, insights)
+                    # can still record stages while the listener thread formats this
+                    "stages_ms": dict(timings),
+                }},
+            )
+            debug_sampled_var.reset(sampled_token)
+            stage_timings_var.reset(timings_token)
+            request_id_var.reset(request_token)
@@ -3,49 +3,96 @@ FastAPI application entry point for EatRight AI Nutrition Assistant.
 Handles image uploads, AI analysis, authentication, and data persistence.
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import RedirectResponse
+from starlette.background import BackgroundTask, BackgroundTasks
+from starlette.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from contextlib import asynccontextmanager
+import asyncio
+import ipaddress
 import logging
+import math
+import orjson
+import random
 from io import BytesIO
-from typing import Optional, List
-from datetime import datetime
+from typing import Awaitable, Callable, NamedTuple, Optional, List
+from datetime import date, datetime, time, timedelta
 
 from config import get_settings
-from models import MealResponse, MealDocument, User
-from db import connect_to_mongodb, close_mongodb_connection, save_meal, get_database
-from storage import upload_image_to_gcs
+from models import (
+    MealResponse, MealDocument, User, MEAL_DOCUMENT_PROJECTION, MEAL_RESPONSE_FIELDS,
+    DirectUploadRequest, DirectUploadResponse, FinalizeUploadRequest, TextMealRequest, MealSearchResponse
+)
+from db import (
+    connect_to_mongodb, close_mongodb_connection, save_meal, get_database, acquire_image_ref, release_image_ref,
+    build_meal_search_pipeline, build_bucket_search_pipeline, format_meal_search_result,
+    uses_buckets, get_bucketed_meals, get_bucketed_stats, iter_bucketed_meals
+)
+from meal_buckets import BUCKETS_COLLECTION, expand_search_results
+from storage import (
+    upload_image_to_gcs, store_image_renditions, create_direct_upload, fetch_direct_upload, promote_direct_upload,
+    delete_direct_upload, get_public_url, image_object_name
+)
 from ai import analyze_food_image
+from telemetry import build_telemetry_summary_pipeline, format_telemetry_summary, save_analysis_telemetry, TELEMETRY_COLLECTION
+from admission import AdmissionRejected, get_admission_controller
+from events import get_event_broker, publish_meal_saved, stream_events
+from insights import get_insights_scheduler, get_weekly_insights
+from nutrition_db import analyze_meal_text
+from images import generate_preview_data_url, resolve_rendition_format
+from export import (
+    EXPORT_MEDIA_TYPES, EXPORT_PROJECTION, COLUMNAR_FORMATS, columnar_supported, export_filename, stream_export
+)
+from cache import ResponseCache, etag_matches, make_etag
+from logging_config import configure_logging, RequestContextMiddleware
+from metrics import (
+    MetricsMiddleware, CONTENT_TYPE_LATEST, GUEST_MEALS, enable_tracing, render_metrics, track_stage
+)
+from warmup import run_warmup, check_readiness
 from auth import (
-    oauth, create_access_token, get_current_user, 
-    get_optional_user, create_or_update_user, ACCESS_TOKEN_EXPIRE_MINUTES
+    get_oauth, create_access_token, get_current_user, 
+    get_optional_user, get_admin_user, get_event_stream_user, create_or_update_user,
+    ACCESS_TOKEN_EXPIRE_MINUTES
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Configure logging (queued, written by a background thread)
+configure_logging(settings.log_level, settings.log_format, settings.log_debug_sample_rate)
+logger = logging.getLogger(__name__)
+response_cache = ResponseCache("response", settings.response_cache_max_entries)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager."""
     logger.info("Starting EatRight Backend...")
+    if settings.tracing_enabled and not enable_tracing():
+        logger.warning("TRACING_ENABLED is set but opentelemetry is not installed")
+    warmup_task = None
     try:
-        await connect_to_mongodb()
+        # Only the MongoDB ping (skipped in fast-start mode) delays binding
+        # the port; clients and indexes are warmed in the background and
+        # /ready reports when that has finished
+        await connect_to_mongodb(ping=not settings.fast_start)
+        warmup_task = asyncio.create_task(run_warmup())
+        get_insights_scheduler().start()
         logger.info("Application startup complete")
     except Exception as e:
-        logger.error(f"Failed to start application: {e}")
+        logger.error("Failed to start application: %s", e)
         raise
     
     yield
     
     logger.info("Shutting down EatRight Backend...")
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    await get_insights_scheduler().stop()
+    if get_event_broker.cache_info().currsize:
+        await get_event_broker().close()
     await close_mongodb_connection()
     logger.info("Application shutdown complete")
 
@@ -55,7 +102,8 @@ app = FastAPI(
     title="EatRight AI Nutrition Assistant",
     description="Backend API for AI-powered food analysis and nutrition advice",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Session Middleware for OAuth
@@ -79,10 +127,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class EventStreamAwareGZipMiddleware(GZipMiddleware):
+    """GZip that passes Server-Sent Events through: compressing would hold frames in zlib's buffer."""
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and any(
+            name == b"accept" and b"text/event-stream" in value for name, value in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Compress large JSON payloads (history pages, exports)
+app.add_middleware(EventStreamAwareGZipMiddleware, minimum_size=1024)
+
+# Request latency / in-flight metrics
+app.add_middleware(MetricsMiddleware)
+
+# Request id, debug sampling and the per-request summary log line (outermost)
+app.add_middleware(RequestContextMiddleware)
+
 
 @app.get("/")
 async def root():
-    """Health check endpoint."""
+    """Liveness endpoint; never touches external dependencies."""
     return {
         "status": "healthy",
         "service": "EatRight AI Nutrition Assistant",
@@ -90,48 +159,57 @@ async def root():
     }
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until warmup has finished and MongoDB is reachable."""
+    readiness = await check_readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint with timing info."""
-    import time
-    start_time = time.time()
-    
     # Quick DB check
     try:
-        db = get_database()
-        await db.command('ping')
+        with track_stage("db") as timer:
+            db = get_database()
+            await db.command('ping')
         db_status = "connected"
     except Exception as e:
-        logger.error(f"DB health check failed: {e}")
+        logger.error("DB health check failed: %s", e)
         db_status = "disconnected"
     
-    response_time = (time.time() - start_time) * 1000  # Convert to ms
-    
     return {
         "status": "healthy",
         "database": db_status,
-        "response_time_ms": round(response_time, 2)
+        "response_time_ms": round(timer.duration * 1000, 2)
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 # Auth Endpoints
 @app.get("/auth/google")
 async def login_google(request: Request):
     """Redirect to Google for authentication."""
     redirect_uri = request.url_for('auth_google_callback')
-    return await oauth.google.authorize_redirect(request, redirect_uri)
+    return await get_oauth().google.authorize_redirect(request, redirect_uri)
 
 
 @app.get("/auth/google/callback")
 async def auth_google_callback(request: Request):
     """Handle Google OAuth callback."""
     try:
-        token = await oauth.google.authorize_access_token(request)
+        token = await get_oauth().google.authorize_access_token(request)
         user_info = token.get('userinfo')
         
         if not user_info:
             # Fallback if userinfo is not in token
-            user_info = await oauth.google.userinfo(token=token)
+            user_info = await get_oauth().google.userinfo(token=token)
             
         # Create or update user
         user = await create_or_update_user(user_info)
@@ -146,9 +224,7 @@ async def auth_google_callback(request: Request):
         return RedirectResponse(url=f"{frontend_url}?token={access_token}")
         
     except Exception as e:
-        logger.error(f"Auth error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.exception("Auth error: %s", e)
         raise HTTPException(status_code=400, detail=f"Authentication failed: {str(e)}")
 
 
@@ -159,109 +235,600 @@ async def get_current_user_profile(user: User = Depends(get_current_user)):
 
 
 # Meal Endpoints
+def meal_response(meal_document: MealDocument) -> Response:
+    """
+    Serialize a validated MealDocument as a MealResponse body directly,
+    skipping FastAPI's second validation pass through response_model.
+    """
+    return ORJSONResponse(meal_document.model_dump(include=MEAL_RESPONSE_FIELDS))
+
+
+def build_meal_document(analysis: dict, user: Optional[User], **fields) -> MealDocument:
+    """Build a MealDocument from an analysis dict (image or text analyzer)."""
+    return MealDocument(
+        user_id=user.user_id if user else None,
+        food_items=analysis["food_items"],
+        health_verdict=analysis["health_verdict"],
+        nutrition_advice=analysis["nutrition_advice"],
+        benefits=analysis.get("benefits", []),
+        cautions=analysis.get("cautions", []),
+        calories=analysis.get("calories", 0),
+        protein=analysis.get("protein", 0),
+        carbs=analysis.get("carbs", 0),
+        fats=analysis.get("fats", 0),
+        micronutrients=analysis.get("micronutrients", {}),
+        reconciliation=analysis.get("reconciliation"),
+        **fields
+    )
+
+
+async def meal_saved(user: User, meal_document: MealDocument) -> None:
+    """Fan a saved meal out to live dashboards and the weekly insights."""
+    meal = meal_document.to_dict()
+    get_insights_scheduler().enqueue(meal)
+    await publish_meal_saved(user.user_id, meal)
+
+
+def is_ephemeral_guest(user: Optional[User]) -> bool:
+    """Guest meals are not stored (GUEST_MODE=ephemeral), except review samples."""
+    return user is None and settings.guest_mode == "ephemeral"
+
+
+def _trusted_proxies() -> tuple:
+    """(trust any peer, networks) from TRUSTED_PROXIES; invalid entries are skipped."""
+    entries = [entry.strip() for entry in settings.trusted_proxies.split(",") if entry.strip()]
+    networks = []
+    for entry in entries:
+        if entry == "*":
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            logger.warning("Ignoring invalid TRUSTED_PROXIES entry: %r", entry)
+    return "*" in entries, tuple(networks)
+
+
+TRUSTED_PROXIES = _trusted_proxies()
+
+
+def _in_networks(address: str, networks: tuple) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(request: Request) -> str:
+    """
+    The caller's address, used to key guest admission. When the socket
+    peer is a trusted proxy (TRUSTED_PROXIES), this is the nearest
+    X-Forwarded-For hop that is not itself a listed proxy; earlier hops
+    are client-supplied and ignored. Otherwise it is the peer itself.
+    """
+    peer = request.client.host if request.client else ""
+    trust_any, networks = TRUSTED_PROXIES
+    if not (trust_any or _in_networks(peer, networks)):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _in_networks(hop, networks):
+            return hop
+    return hops[0] if hops else peer
+
+
+def sampled_for_review() -> bool:
+    return random.random() < settings.guest_review_sample_rate
+
+
+# Stores the original image and returns its URL; called with `overwrite`
+# (see ImageRef) so objects being garbage-collected are rewritten
+StoreImage = Callable[[bool], Awaitable[str]]
+
+
+class ImageRef(NamedTuple):
+    url: str
+    overwrite: bool  # gc_images.py is collecting the image: rewrite, don't reuse
+
+
+async def acquire_image(image_bytes: bytes, filename: str) -> ImageRef:
+    """
+    Reference the image's content-addressed URL before anything checks
+    whether its objects (original and renditions) exist, so garbage
+    collection cannot delete them between that check and the meal save.
+    """
+    url = get_public_url(image_object_name(image_bytes, filename))
+    return ImageRef(url, await acquire_image_ref(url))
+
+
+def rendition_format() -> str:
+    return resolve_rendition_format(settings.image_rendition_format)
+
+
+async def release_image(image_ref: ImageRef) -> None:
+    """Drop a reference taken by acquire_image for a meal that was not saved."""
+    try:
+        await release_image_ref(image_ref.url)
+    except Exception as e:
+        logger.warning("Failed to release image reference: %s", e)
+
+
+async def process_meal(
+    image_bytes: bytes,
+    filename: str,
+    user: Optional[User],
+    client_host: str,
+    store_image: StoreImage,
+    discard_image: Optional[Callable[[], Awaitable[object]]] = None
+) -> Response:
+    """
+    Analyze an image, store it via `store_image` and persist the meal.
+    Shared by the multipart upload and the direct-to-storage finalize flow.
+    Ephemeral guest analyses return after the model call; see guest_meal_response.
+    `discard_image` cleans up an already staged image that is not stored.
+    """
+    ephemeral = is_ephemeral_guest(user)
+    
+    # Wait for a model slot (fair across callers); raises AdmissionRejected
+    if user:
+        admission = get_admission_controller().admit(f"user:{user.user_id}", 1.0, "user")
+    else:
+        admission = get_admission_controller().admit(f"guest:{client_host}", settings.guest_weight, "guest")
+    
+    async with admission:
+        image_ref = renditions_task = None
+        if not ephemeral:
+            image_ref = await acquire_image(image_bytes, filename)
+            # Renditions are resized and uploaded while the model runs
+            renditions_task = asyncio.create_task(
+                store_image_renditions(image_bytes, rendition_format(), image_ref.overwrite)
+            )
+        
+        # Analyze with AI (decode/model stages are timed inside the analyzer)
+        try:
+            ai_analysis = await analyze_food_image(BytesIO(image_bytes), filename)
+        except BaseException:
+            # E.g. cancelled on client disconnect: don't leave the renditions
+            # running or the image referenced by a meal that is never saved
+            await discard_task(renditions_task)
+            if image_ref is not None:
+                await release_image(image_ref)
+            raise
+    
+    if ephemeral:
+        return await guest_meal_response(ai_analysis, image_bytes, filename, store_image, discard_image)
+    
+    if user is None:
+        GUEST_MEALS.labels("persisted").inc()
+    meal_document = await store_meal(ai_analysis, user, image_ref, store_image, renditions_task)
+    return meal_response(meal_document)
+
+
+async def discard_task(task: Optional[asyncio.Task]) -> None:
+    """Cancel a task unless it has finished, and retrieve its outcome."""
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def store_meal(
+    ai_analysis: dict,
+    user: Optional[User],
+    image_ref: ImageRef,
+    store_image: StoreImage,
+    renditions_task: "asyncio.Task[dict]"
+) -> MealDocument:
+    """
+    Store the image and its renditions, then save the meal and its
+    telemetry. The image reference is released if the meal is not saved.
+    """
+    try:
+        # Store the image in GCS
+        with track_stage("storage") as gcs_timer:
+            image_url = await store_image(image_ref.overwrite)
+            try:
+                renditions = await renditions_task
+            except Exception as e:
+                # Not fatal: the history view falls back to the original
+                logger.error("Failed to store image renditions: %s", e)
+                renditions = {}
+        
+        # Create meal document
+        meal_document = build_meal_document(
+            ai_analysis, user,
+            image_url=image_url,
+            thumbnail_url=renditions.get("thumb"),
+            medium_url=renditions.get("medium")
+        )
+        
+        # Save to DB (the meal and its model-call telemetry, which never raises)
+        with track_stage("db") as db_timer:
+            await asyncio.gather(
+                save_meal(meal_document),
+                save_analysis_telemetry(
+                    ai_analysis.get("telemetry", {}), meal_document.meal_id, meal_document.user_id
+                )
+            )
+    except Exception:
+        await release_image(image_ref)
+        raise
+    finally:
+        # Not awaited above when the upload failed
+        await discard_task(renditions_task)
+    logger.debug("Meal stored (GCS: %.2fs, DB: %.2fs)", gcs_timer.duration, db_timer.duration)
+    if user:
+        await meal_saved(user, meal_document)
+    return meal_document
+
+
+async def guest_meal_response(
+    ai_analysis: dict,
+    image_bytes: bytes,
+    filename: str,
+    store_image: StoreImage,
+    discard_image: Optional[Callable[[], Awaitable[object]]] = None
+) -> Response:
+    """
+    Respond to an ephemeral guest analysis without touching GCS or the
+    meals collection. Telemetry, and for review samples the full store,
+    run as a background task after the response is sent; so does
+    `discard_image` when the image is not kept.
+    """
+    image_url = ""
+    if settings.guest_preview_size > 0:
+        try:
+            image_url = await asyncio.to_thread(
+                generate_preview_data_url, image_bytes, settings.guest_preview_size
+            )
+        except Exception as e:
+            logger.warning("Failed to build guest preview: %s", e)
+    
+    response = meal_response(build_meal_document(ai_analysis, None, image_url=image_url))
+    if sampled_for_review():
+        GUEST_MEALS.labels("sampled").inc()
+        response.background = BackgroundTask(keep_guest_meal, ai_analysis, image_bytes, filename, store_image)
+    else:
+        GUEST_MEALS.labels("ephemeral").inc()
+        response.background = BackgroundTasks()
+        response.background.add_task(save_analysis_telemetry, ai_analysis.get("telemetry", {}), None, None)
+        if discard_image:
+            response.background.add_task(discard_guest_image, discard_image)
+    return response
+
+
+async def discard_guest_image(discard_image: Callable[[], Awaitable[object]]) -> None:
+    try:
+        await discard_image()
+    except Exception as e:
+        logger.warning("Failed to discard guest image: %s", e)
+
+
+async def keep_guest_meal(
+    ai_analysis: dict,
+    image_bytes: bytes,
+    filename: str,
+    store_image: StoreImage
+) -> None:
+    """Store a sampled guest meal (user_id None) for quality review."""
+    try:
+        image_ref = await acquire_image(image_bytes, filename)
+        renditions_task = asyncio.create_task(
+            store_image_renditions(image_bytes, rendition_format(), image_ref.overwrite)
+        )
+        await store_meal(ai_analysis, None, image_ref, store_image, renditions_task)
+    except Exception as e:
+        logger.error("Failed to store sampled guest meal: %s", e)
+
+
+def admission_error(error: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="The analyzer is busy, please retry shortly",
+        headers={"Retry-After": str(int(math.ceil(error.retry_after)))}
+    )
+
+
 @app.post("/upload-meal", response_model=MealResponse)
 async def upload_meal(
+    request: Request,
     file: UploadFile = File(...),
     user: Optional[User] = Depends(get_optional_user)
 ):
     """Upload and analyze a meal image."""
-    import time
-    start_time = time.time()
-    
     try:
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        logger.info(f"Processing upload for user: {user.name if user else 'Guest'}")
-        
         # Read file
         file_content = await file.read()
-        file_size_kb = len(file_content) / 1024
-        logger.info(f"Image size: {file_size_kb:.1f}KB")
-        
-        file_stream = BytesIO(file_content)
+        logger.debug("Upload of %d bytes (authenticated: %s)", len(file_content), user is not None)
         
-        # Analyze with AI
-        ai_start = time.time()
-        ai_analysis = await analyze_food_image(file_stream, file.filename)
-        ai_duration = time.time() - ai_start
-        logger.info(f"AI analysis completed in {ai_duration:.2f}s")
-        
-        # Upload to GCS
-        file_stream.seek(0)
-        gcs_start = time.time()
-        image_url = await upload_image_to_gcs(file_stream, file.filename)
-        gcs_duration = time.time() - gcs_start
-        logger.info(f"GCS upload completed in {gcs_duration:.2f}s")
-        
-        # Create meal document
-        meal_document = MealDocument(
-            user_id=user.user_id if user else None,
-            image_url=image_url,
-            food_items=ai_analysis["food_items"],
-            health_verdict=ai_analysis["health_verdict"],
-            nutrition_advice=ai_analysis["nutrition_advice"],
-            benefits=ai_analysis.get("benefits", []),
-            cautions=ai_analysis.get("cautions", []),
-            calories=ai_analysis.get("calories", 0),
-            protein=ai_analysis.get("protein", 0),
-            carbs=ai_analysis.get("carbs", 0),
-            fats=ai_analysis.get("fats", 0),
-            micronutrients=ai_analysis.get("micronutrients", {})
+        return await process_meal(
+            file_content, file.filename, user, client_address(request),
+            lambda overwrite: upload_image_to_gcs(BytesIO(file_content), file.filename, overwrite)
         )
         
-        # Save to DB
-        db_start = time.time()
-        meal_id = await save_meal(meal_document)
-        db_duration = time.time() - db_start
-        
-        total_duration = time.time() - start_time
-        logger.info(f"Total request time: {total_duration:.2f}s (AI: {ai_duration:.2f}s, GCS: {gcs_duration:.2f}s, DB: {db_duration:.2f}s)")
-        
-        return MealResponse(
-            meal_id=meal_document.meal_id,
-            image_url=image_url,
-            food_items=ai_analysis["food_items"],
-            health_verdict=ai_analysis["health_verdict"],
-            nutrition_advice=ai_analysis["nutrition_advice"],
-            benefits=ai_analysis.get("benefits", []),
-            cautions=ai_analysis.get("cautions", []),
-            calories=ai_analysis.get("calories", 0),
-            protein=ai_analysis.get("protein", 0),
-            carbs=ai_analysis.get("carbs", 0),
-            fats=ai_analysis.get("fats", 0),
-            micronutrients=ai_analysis.get("micronutrients", {})
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error processing meal upload: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/meals/upload-url", response_model=DirectUploadResponse)
+async def create_meal_upload_url(
+    upload: DirectUploadRequest,
+    request: Request,
+    user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Phase one of a direct upload: issue a resumable GCS session URL the
+    client uploads the image to, bypassing the API server.
+    """
+    if not upload.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    if upload.size > settings.direct_upload_max_bytes:
+        raise HTTPException(status_code=413, detail="File is too large")
+    if is_ephemeral_guest(user):
+        # Ephemeral guest images are never stored; they go through /upload-meal
+        raise HTTPException(status_code=403, detail="Direct uploads require signing in")
+    
+    try:
+        upload_id, upload_url = await create_direct_upload(
+            upload.filename, upload.content_type, upload.size,
+            origin=request.headers.get("origin")
         )
-        
     except Exception as e:
-        logger.error(f"Error processing meal upload: {e}")
+        logger.error("Error creating upload session: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to create upload session")
+    
+    return DirectUploadResponse(
+        upload_id=upload_id,
+        upload_url=upload_url,
+        expires_in=settings.direct_upload_ttl_seconds
+    )
+
+
+@app.post("/meals/finalize-upload", response_model=MealResponse)
+async def finalize_meal_upload(
+    finalize: FinalizeUploadRequest,
+    request: Request,
+    user: Optional[User] = Depends(get_optional_user)
+):
+    """Phase two of a direct upload: analyze the uploaded object and save the meal."""
+    try:
+        image_bytes = await fetch_direct_upload(
+            finalize.upload_id,
+            max_bytes=settings.direct_upload_max_bytes,
+            max_age_seconds=settings.direct_upload_ttl_seconds
+        )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        return await process_meal(
+            image_bytes, finalize.upload_id, user, client_address(request),
+            lambda overwrite: promote_direct_upload(finalize.upload_id, image_bytes, overwrite),
+            lambda: delete_direct_upload(finalize.upload_id)
+        )
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except Exception as e:
+        logger.error("Error finalizing meal upload: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/meals/log-text", response_model=MealResponse)
+async def log_text_meal(
+    meal: TextMealRequest,
+    user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Log a meal from a text description such as "2 eggs and toast".
+    Nutrition is computed from the local nutrition table; no model call.
+    """
+    try:
+        with track_stage("nutrition"):
+            analysis = analyze_meal_text(meal.text)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not analysis["food_items"]:
+        raise HTTPException(status_code=422, detail="No known foods found in the description")
+    
+    meal_document = build_meal_document(analysis, user, source="text")
+    if is_ephemeral_guest(user):
+        response = meal_response(meal_document)
+        if sampled_for_review():
+            GUEST_MEALS.labels("sampled").inc()
+            response.background = BackgroundTask(save_meal, meal_document)
+        else:
+            GUEST_MEALS.labels("ephemeral").inc()
+        return response
+    
+    if user is None:
+        GUEST_MEALS.labels("persisted").inc()
+    try:
+        with track_stage("db"):
+            await save_meal(meal_document)
+    except Exception as e:
+        logger.error("Error saving text meal: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to save meal")
+    
+    response = meal_response(meal_document)
+    if user:
+        await meal_saved(user, meal_document)
+    return response
+
+
+async def cached_user_response(
+    request: Request,
+    user: User,
+    endpoint: str,
+    params: tuple,
+    build: Callable[[], Awaitable[bytes]]
+) -> Response:
+    """
+    Serve a per-user JSON response with a weak ETag derived from the
+    user's data version (shared by its gzip and identity encodings, hence
+    Vary: Accept-Encoding). Matching If-None-Match requests get a 304 without
+    touching the meals collection; other requests are served from the
+    response cache when possible.
+    """
+    key = (user.user_id, user.data_version, endpoint, params)
+    etag = make_etag(*key)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    body = response_cache.get(key)
+    if body is None:
+        body = await build()
+        response_cache.put(key, body)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/meals/history", response_model=List[MealDocument])
 async def get_meal_history(
+    request: Request,
     limit: int = 20, 
     skip: int = 0,
     user: User = Depends(get_current_user)
 ):
     """Get meal history for current user."""
-    try:
+    async def build() -> bytes:
+        if uses_buckets():
+            return orjson.dumps(await get_bucketed_meals(user.user_id, skip, limit))
         db = get_database()
+        # Projection yields response-shaped documents: no Pydantic round-trip
         cursor = db["meals"].find(
-            {"user_id": user.user_id}
+            {"user_id": user.user_id}, MEAL_DOCUMENT_PROJECTION
         ).sort("created_at", -1).skip(skip).limit(limit)
         
         meals = await cursor.to_list(length=limit)
-        return meals
+        return orjson.dumps(meals)
+    
+    try:
+        return await cached_user_response(request, user, "history", (limit, skip), build)
     except Exception as e:
-        logger.error(f"Error fetching history: {e}")
+        logger.error("Error fetching history: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch history")
 
 
+@app.get("/meals/search", response_model=MealSearchResponse)
+async def search_meals(
+    request: Request,
+    q: Optional[str] = Query(default=None, max_length=200, description="Words to find in food items and advice"),
+    verdict: Optional[str] = Query(default=None, pattern="^(Healthy|Neutral|Unhealthy)$"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = Query(default=None, description="Inclusive"),
+    min_calories: Optional[float] = None,
+    max_calories: Optional[float] = None,
+    min_protein: Optional[float] = None,
+    max_protein: Optional[float] = None,
+    min_carbs: Optional[float] = None,
+    max_carbs: Optional[float] = None,
+    min_fats: Optional[float] = None,
+    max_fats: Optional[float] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    skip: int = Query(default=0, ge=0),
+    user: User = Depends(get_current_user)
+):
+    """Search the user's meals with filters; returns facet counts with the page."""
+    q = q.strip() if q else None
+    ranges = {
+        "calories": (min_calories, max_calories),
+        "protein": (min_protein, max_protein),
+        "carbs": (min_carbs, max_carbs),
+        "fats": (min_fats, max_fats),
+    }
+    params = (q, verdict, date_from, date_to, tuple(ranges.values()), limit, skip)
+    
+    async def build() -> bytes:
+        bucketed = uses_buckets()
+        build_pipeline = build_bucket_search_pipeline if bucketed else build_meal_search_pipeline
+        pipeline = build_pipeline(
+            user.user_id,
+            query=q,
+            verdict=verdict,
+            date_from=datetime.combine(date_from, time.min) if date_from else None,
+            date_to=datetime.combine(date_to + timedelta(days=1), time.min) if date_to else None,
+            ranges=ranges,
+            skip=skip,
+            limit=limit
+        )
+        collection = BUCKETS_COLLECTION if bucketed else settings.mongodb_collection_name
+        db = get_database()
+        with track_stage("db"):
+            result = await db[collection].aggregate(pipeline).to_list(length=1)
+        if bucketed:
+            expand_search_results(result[0]["results"])
+        return orjson.dumps(format_meal_search_result(result[0]))
+    
+    try:
+        return await cached_user_response(request, user, "search", params, build)
+    except Exception as e:
+        logger.error("Error searching meals: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to search meals")
+
+
+@app.get("/meals/export")
+async def export_meals(
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv|parquet|arrow)$"),
+    user: User = Depends(get_current_user)
+):
+    """
+    Stream the user's full meal history, oldest first, as NDJSON, CSV,
+    Parquet or Arrow IPC. Micronutrients are flattened into columns in the
+    tabular formats.
+    """
+    if format in COLUMNAR_FORMATS and not columnar_supported():
+        raise HTTPException(status_code=501, detail=f"{format} export requires pyarrow to be installed")
+    
+    if uses_buckets():
+        cursor = iter_bucketed_meals(user.user_id, settings.export_batch_size)
+    else:
+        db = get_database()
+        cursor = db[settings.mongodb_collection_name].find(
+            {"user_id": user.user_id}, EXPORT_PROJECTION
+        ).sort("created_at", 1).batch_size(settings.export_batch_size)
+    
+    return StreamingResponse(
+        stream_export(cursor, format, settings.export_batch_size),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{export_filename(format)}"',
+            "Cache-Control": "private, no-store",
+        }
+    )
+
+
+@app.get("/meals/events")
+async def meal_events(user: User = Depends(get_event_stream_user)):
+    """
+    Server-Sent Events stream of the user's new meals ("meal_saved": the
+    meal plus its day's stat delta), so open dashboards update without
+    refetching. EventSource clients pass the token as ?access_token=.
+    """
+    return StreamingResponse(
+        stream_events(user.user_id, settings.event_heartbeat_seconds),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/meals/stats")
-async def get_meal_stats(user: User = Depends(get_current_user)):
+async def get_meal_stats(request: Request, user: User = Depends(get_current_user)):
     """Get calorie stats for the user."""
-    try:
+    async def build() -> bytes:
+        if uses_buckets():
+            return orjson.dumps(await get_bucketed_stats(user.user_id))
         db = get_database()
         pipeline = [
             {"$match": {"user_id": user.user_id}},
@@ -278,12 +845,53 @@ async def get_meal_stats(user: User = Depends(get_current_user)):
         ]
         
         stats = await db["meals"].aggregate(pipeline).to_list(length=7)
-        return stats
+        return orjson.dumps(stats)
+    
+    try:
+        return await cached_user_response(request, user, "stats", (), build)
     except Exception as e:
-        logger.error(f"Error fetching stats: {e}")
+        logger.error("Error fetching stats: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch stats")
 
 
+@app.get("/insights/weekly")
+async def weekly_insights(
+    week: Optional[date] = Query(default=None, description="Any day of the week; default this week"),
+    user: User = Depends(get_current_user)
+):
+    """
+    The user's materialized insights for one week: verdict ratios, macro
+    balance, ranked recurring benefits/cautions and the optional summary.
+    Updated in the background a few seconds after each meal.
+    """
+    moment = datetime.combine(week, time.min) if week else datetime.utcnow()
+    try:
+        return await get_weekly_insights(user.user_id, moment)
+    except Exception as e:
+        logger.error("Error fetching weekly insights: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to fetch insights")
+
+
+@app.get("/admin/telemetry")
+async def get_telemetry_summary(
+    days: int = Query(default=7, ge=1, le=90),
+    admin: User = Depends(get_admin_user)
+):
+    """
+    Per-model, per-day model-call statistics: counts, errors, token totals,
+    estimated cost and p50/p90/p99 of latency, tokens and image size.
+    """
+    try:
+        db = get_database()
+        rows = await db[TELEMETRY_COLLECTION].aggregate(
+            build_telemetry_summary_pipeline(days)
+        ).to_list(length=None)
+    except Exception as e:
+        logger.error("Error aggregating telemetry: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to aggregate telemetry")
+    return ORJSONResponse(format_telemetry_summary(rows))
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
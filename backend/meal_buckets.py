@@ -0,0 +1,336 @@
+"""
+Bucketed meal storage: one document per user per day.
+
+    {
+        "_id": "<user_id>:<YYYY-MM-DD>",
+        "user_id": ..., "day": <midnight UTC>, "schema_version": 1,
+        "count": 3,
+        "totals": {"calories": ..., "protein": ..., "carbs": ..., "fats": ...},
+        "meals": [{"id": ..., "t": <created_at>, "fi": [...], "cal": 620, ...,
+                   "mn": [120.0, 85.0, null, ...]}, ...]
+    }
+
+Meals use short field names (COMPACT_FIELDS) and micronutrients are a
+numeric array ordered by models.MICRONUTRIENT_KEYS, in each nutrient's
+dictionary unit, so key names and unit strings are not repeated per meal.
+Daily totals are maintained on write, so stats read one document per day.
+
+Everything here is a pure transform; db.py does the I/O.
+"""
+
+from datetime import datetime, time
+from typing import List, NamedTuple, Optional, Tuple
+import re
+
+from pymongo import UpdateOne
+
+from models import MICRONUTRIENT_KEYS, MICRONUTRIENT_UNITS, micronutrient_amount
+
+BUCKETS_COLLECTION = "meal_buckets"
+
+# Bump when the bucket layout changes; readers reject versions they do not know
+SCHEMA_VERSION = 1
+
+# MealDocument field -> compact bucket field (micronutrients are handled separately)
+COMPACT_FIELDS = {
+    "meal_id": "id",
+    "created_at": "t",
+    "image_url": "img",
+    "thumbnail_url": "th",
+    "medium_url": "md",
+    "food_items": "fi",
+    "health_verdict": "v",
+    "nutrition_advice": "adv",
+    "benefits": "ben",
+    "cautions": "cau",
+    "calories": "cal",
+    "protein": "p",
+    "carbs": "c",
+    "fats": "f",
+    "source": "src",
+    "reconciliation": "rec",
+}
+
+# Values equal to these defaults are not stored
+_OMITTED_DEFAULTS = {"image_url": "", "source": "image"}
+
+TOTAL_FIELDS = ("calories", "protein", "carbs", "fats")
+
+
+def bucket_day(created_at: datetime) -> datetime:
+    return datetime.combine(created_at.date(), time.min)
+
+
+def bucket_id(user_id: str, created_at: datetime) -> str:
+    return f"{user_id}:{created_at:%Y-%m-%d}"
+
+
+def compact_meal(meal: dict) -> dict:
+    """MealDocument dict -> compact bucket entry."""
+    compact = {}
+    for field, short in COMPACT_FIELDS.items():
+        value = meal.get(field)
+        if value is None or value == [] or _OMITTED_DEFAULTS.get(field, object()) == value:
+            continue
+        compact[short] = value
+
+    micronutrients = meal.get("micronutrients") or {}
+    values = [micronutrient_amount(micronutrients.get(key), MICRONUTRIENT_UNITS[key]) for key in MICRONUTRIENT_KEYS]
+    if any(value is not None for value in values):
+        compact["mn"] = values
+    # Nutrients outside the shared dictionary (or in unknown units) are kept verbatim
+    extra = {
+        key: value for key, value in micronutrients.items()
+        if key not in MICRONUTRIENT_UNITS
+        or micronutrient_amount(value, MICRONUTRIENT_UNITS[key]) is None
+    }
+    if extra:
+        compact["mx"] = extra
+    return compact
+
+
+def expand_micronutrients(values: Optional[List[Optional[float]]], extra: Optional[dict]) -> dict:
+    micronutrients = {
+        key: {"amount": amount, "unit": MICRONUTRIENT_UNITS[key]}
+        for key, amount in zip(MICRONUTRIENT_KEYS, values or ())
+        if amount is not None
+    }
+    micronutrients.update(extra or {})
+    return micronutrients
+
+
+def expand_meal(user_id: str, compact: dict, schema_version: int = SCHEMA_VERSION) -> dict:
+    """Compact bucket entry -> dict in MealDocument field order."""
+    if schema_version != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported meal bucket schema version {schema_version}")
+    get = compact.get
+    return {
+        "meal_id": get("id"),
+        "user_id": user_id,
+        "image_url": get("img", ""),
+        "thumbnail_url": get("th"),
+        "medium_url": get("md"),
+        "food_items": get("fi", []),
+        "health_verdict": get("v"),
+        "nutrition_advice": get("adv", ""),
+        "benefits": get("ben", []),
+        "cautions": get("cau", []),
+        "calories": get("cal", 0),
+        "protein": get("p", 0),
+        "carbs": get("c", 0),
+        "fats": get("f", 0),
+        "micronutrients": expand_micronutrients(get("mn"), get("mx")),
+        "source": get("src", "image"),
+        "reconciliation": get("rec"),
+        "created_at": get("t"),
+    }
+
+
+def expand_bucket(bucket: dict) -> List[dict]:
+    """All meals of a bucket, newest first."""
+    version = bucket.get("schema_version", SCHEMA_VERSION)
+    meals = [expand_meal(bucket["user_id"], compact, version) for compact in bucket.get("meals", ())]
+    meals.sort(key=lambda meal: meal["created_at"], reverse=True)
+    return meals
+
+
+def _push_update(meal: dict, compact: dict) -> dict:
+    return {
+        "$push": {"meals": compact},
+        "$inc": {"count": 1, **{f"totals.{field}": meal.get(field) or 0 for field in TOTAL_FIELDS}},
+    }
+
+
+def save_meal_update(meal: dict) -> Tuple[dict, dict]:
+    """Filter and update for an upsert appending one new meal to its user-day bucket."""
+    update = _push_update(meal, compact_meal(meal))
+    update["$setOnInsert"] = {
+        "user_id": meal["user_id"],
+        "day": bucket_day(meal["created_at"]),
+        "schema_version": SCHEMA_VERSION,
+    }
+    return {"_id": bucket_id(meal["user_id"], meal["created_at"])}, update
+
+
+def migrate_meal_ops(meal: dict) -> List[UpdateOne]:
+    """
+    Idempotent ops copying an existing meal into its bucket: create the
+    bucket if missing, then append the meal unless it is already there.
+    """
+    _id = bucket_id(meal["user_id"], meal["created_at"])
+    return [
+        UpdateOne({"_id": _id}, {"$setOnInsert": {
+            "user_id": meal["user_id"],
+            "day": bucket_day(meal["created_at"]),
+            "schema_version": SCHEMA_VERSION,
+            "meals": [],
+            "count": 0,
+            "totals": dict.fromkeys(TOTAL_FIELDS, 0),
+        }}, upsert=True),
+        UpdateOne({"_id": _id, "meals.id": {"$ne": meal["meal_id"]}}, _push_update(meal, compact_meal(meal))),
+    ]
+
+
+def stats_from_buckets(buckets: List[dict]) -> List[dict]:
+    """Per-day stats in the shape of the documents-layout aggregation."""
+    return [
+        {
+            "_id": f"{bucket['day']:%Y-%m-%d}",
+            "total_calories": bucket["totals"]["calories"],
+            "total_protein": bucket["totals"]["protein"],
+            "total_carbs": bucket["totals"]["carbs"],
+            "total_fats": bucket["totals"]["fats"],
+            "meal_count": bucket["count"],
+        }
+        for bucket in buckets
+    ]
+
+
+# Aggregation expression rebuilding a meal from an unwound bucket ($meals)
+_EXPANDED_MEAL_EXPR = {
+    "meal_id": "$meals.id",
+    "user_id": "$user_id",
+    "image_url": {"$ifNull": ["$meals.img", ""]},
+    "thumbnail_url": {"$ifNull": ["$meals.th", None]},
+    "medium_url": {"$ifNull": ["$meals.md", None]},
+    "food_items": {"$ifNull": ["$meals.fi", []]},
+    "health_verdict": "$meals.v",
+    "nutrition_advice": {"$ifNull": ["$meals.adv", ""]},
+    "benefits": {"$ifNull": ["$meals.ben", []]},
+    "cautions": {"$ifNull": ["$meals.cau", []]},
+    "calories": {"$ifNull": ["$meals.cal", 0]},
+    "protein": {"$ifNull": ["$meals.p", 0]},
+    "carbs": {"$ifNull": ["$meals.c", 0]},
+    "fats": {"$ifNull": ["$meals.f", 0]},
+    "mn": {"$ifNull": ["$meals.mn", None]},
+    "mx": {"$ifNull": ["$meals.mx", None]},
+    "source": {"$ifNull": ["$meals.src", "image"]},
+    "reconciliation": {"$ifNull": ["$meals.rec", None]},
+    "created_at": "$meals.t",
+}
+
+
+# Words $text drops from queries (a subset of its English stop words)
+_STOP_WORDS = frozenset(
+    "a an and are as at be by for from in is it of on or the to with".split()
+)
+_QUERY_TOKEN = re.compile(r'(-?)"([^"]*)"?|(-?)([^\s"]+)')
+_SUFFIXES = ("ies", "es", "ing", "ed", "s", "y")
+
+
+class TextQuery(NamedTuple):
+    terms: List[str]           # any of them must match (ignored when there are phrases)
+    phrases: List[str]         # all of them must match
+    excluded: List[str]        # negated terms and phrases; none may match
+    excluded_phrases: List[str]
+
+
+def parse_text_query(query: str) -> TextQuery:
+    """Split a $text $search string into terms, "phrases" and -negations, as $text does."""
+    terms, phrases, excluded, excluded_phrases = [], [], [], []
+    for match in _QUERY_TOKEN.finditer(query.lower()):
+        negated_phrase, phrase, negated, token = match.groups()
+        if phrase is not None:
+            if phrase.strip():
+                (excluded_phrases if negated_phrase else phrases).append(" ".join(phrase.split()))
+            continue
+        words = [word for word in re.split(r"\W+", token) if word and word not in _STOP_WORDS]
+        (excluded if negated else terms).extend(words)
+    return TextQuery(terms, phrases, excluded, excluded_phrases)
+
+
+def stem(word: str) -> str:
+    """
+    Crude English stem, so "pizzas" matches "pizza" and "berries" matches
+    "berry". Matching is by prefix, so it is looser than $text stemming.
+    """
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _text_condition(pattern: str, negate: bool) -> dict:
+    regex = {"$regex": pattern, "$options": "i"}
+    if negate:
+        return {"food_items": {"$not": regex}, "nutrition_advice": {"$not": regex}}
+    return {"$or": [{"food_items": regex}, {"nutrition_advice": regex}]}
+
+
+def meal_text_match(text_query: TextQuery) -> dict:
+    """
+    Per-meal re-check of a $text query on unwound bucket meals. Follows
+    $text: every phrase must match (then terms are ignored), otherwise any
+    term; negated terms and phrases exclude the meal. Terms are stemmed
+    and matched as word prefixes, so e.g. "run" also matches "runner",
+    which $text would not.
+    """
+    conditions = [_text_condition(re.escape(phrase).replace(r"\ ", r"\s+"), False) for phrase in text_query.phrases]
+    if not text_query.phrases:
+        conditions.append(_text_condition(
+            "|".join(r"\b" + re.escape(stem(term)) for term in text_query.terms) or "(?!)", False
+        ))
+    conditions += [_text_condition(r"\b" + re.escape(stem(term)), True) for term in text_query.excluded]
+    conditions += [
+        _text_condition(re.escape(phrase).replace(r"\ ", r"\s+"), True) for phrase in text_query.excluded_phrases
+    ]
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def bucket_text_search(text_query: TextQuery) -> str:
+    """
+    $search string for the bucket-level $text match. Negations are left to
+    meal_text_match: a bucket holding one excluded meal can still hold
+    meals that match.
+    """
+    return " ".join(text_query.terms + [f'"{phrase}"' for phrase in text_query.phrases])
+
+
+def bucket_search_stages(
+    user_id: str,
+    query: Optional[str],
+    date_from: Optional[datetime],
+    date_to: Optional[datetime]
+) -> Tuple[List[dict], dict]:
+    """
+    Leading stages for searching bucketed meals, plus the per-meal match.
+
+    Buckets are narrowed by the user/day index (and the bucket text index
+    when there is a query), then unwound into meal-shaped documents. A
+    bucket matching the text query can hold other meals, so the query is
+    re-checked per meal with meal_text_match, which parses it the way
+    $text does but matches stems by prefix (see there).
+    """
+    bucket_match: dict = {"user_id": user_id}
+    meal_match: dict = {}
+    if query:
+        text_query = parse_text_query(query)
+        # Only negations (or stop words): $text matches nothing either
+        bucket_match["$text"] = {"$search": bucket_text_search(text_query) or query}
+        meal_match.update(meal_text_match(text_query))
+    if date_from or date_to:
+        bucket_match["day"] = {}
+        meal_match["created_at"] = {}
+        if date_from:
+            bucket_match["day"]["$gte"] = bucket_day(date_from)
+            meal_match["created_at"]["$gte"] = date_from
+        if date_to:
+            bucket_match["day"]["$lt"] = date_to
+            meal_match["created_at"]["$lt"] = date_to
+
+    stages = [
+        {"$match": bucket_match},
+        {"$unwind": "$meals"},
+        {"$replaceWith": _EXPANDED_MEAL_EXPR},
+    ]
+    return stages, meal_match
+
+
+def expand_search_results(meals: List[dict]) -> List[dict]:
+    """Turn the mn/mx arrays of unwound search results back into micronutrient dicts."""
+    for meal in meals:
+        micronutrients = expand_micronutrients(meal.pop("mn", None), meal.pop("mx", None))
+        meal["micronutrients"] = micronutrients
+        meal.pop("_id", None)
+    return meals
+
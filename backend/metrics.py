@@ -0,0 +1,429 @@
+"""
+Lightweight Prometheus-style metrics and optional tracing.
+Collectors are registered once at import time and label children are cached,
+so recording a sample on the request path does not allocate new objects.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+import threading
+import time
+
+from pymongo import monitoring
+
+from logging_config import record_stage_timing
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:  # OpenTelemetry is optional
+    _otel_trace = None
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, tuned for a request path dominated by a model call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base collector holding one child per label-value combination."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        REGISTRY.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Return the (cached) child for the given label values."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self._children[()]
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class _ValueChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _ValueChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram (cumulative buckets are computed at scrape time)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (float("inf"),), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds every collector and renders the text exposition format."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# Pre-registered collectors
+REQUEST_LATENCY = Histogram(
+    "eatright_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ("method", "route", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "eatright_http_requests_in_flight",
+    "HTTP requests currently being served",
+)
+STAGE_LATENCY = Histogram(
+    "eatright_stage_duration_seconds",
+    "Latency of pipeline stages (decode, model, storage, db)",
+    ("stage",),
+)
+STAGES_IN_FLIGHT = Gauge(
+    "eatright_stages_in_flight",
+    "Pipeline stages currently executing",
+    ("stage",),
+)
+STAGE_ERRORS = Counter(
+    "eatright_stage_errors_total",
+    "Pipeline stages that raised an exception",
+    ("stage",),
+)
+MODEL_TOKENS = Counter(
+    "eatright_model_tokens_total",
+    "Tokens reported by the model usage metadata",
+    ("model", "direction"),
+)
+MODEL_ROUTES = Counter(
+    "eatright_model_routes_total",
+    "Model routing decisions by tier (full/light) and routing mode (shadow/on)",
+    ("tier", "mode"),
+)
+EVENT_SUBSCRIBERS = Gauge(
+    "eatright_event_subscribers",
+    "Open /meals/events connections on this worker",
+)
+GUEST_MEALS = Counter(
+    "eatright_guest_meals_total",
+    "Guest analyses by outcome (ephemeral, sampled for review, persisted)",
+    ("outcome",),
+)
+CACHE_REQUESTS = Counter(
+    "eatright_cache_requests_total",
+    "Cache lookups by cache name and result (hit/miss)",
+    ("cache", "result"),
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "eatright_admission_queue_wait_seconds",
+    "Time model calls waited for admission, by caller priority (user/guest)",
+    ("priority",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0),
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "eatright_admission_queue_depth",
+    "Model calls waiting for admission",
+)
+ADMISSION_REJECTIONS = Counter(
+    "eatright_admission_rejections_total",
+    "Model calls rejected by admission control",
+    ("reason",),
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "eatright_mongo_pool_connections",
+    "Open MongoDB connections per server",
+    ("address",),
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "eatright_mongo_pool_checked_out",
+    "MongoDB connections currently checked out per server",
+    ("address",),
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "eatright_mongo_pool_checkout_failures_total",
+    "Failed MongoDB connection checkouts",
+    ("address", "reason"),
+)
+
+
+def record_cache(cache: str, hit: bool):
+    """Record a cache lookup outcome."""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_model_usage(model: str, response) -> None:
+    """Record token counts from a model response's usage metadata, if present."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    MODEL_TOKENS.labels(model, "input").inc(getattr(usage, "prompt_token_count", 0) or 0)
+    MODEL_TOKENS.labels(model, "output").inc(getattr(usage, "candidates_token_count", 0) or 0)
+
+
+class StageTimer:
+    """Result handle for :func:`track_stage`; ``duration`` is set on exit."""
+
+    __slots__ = ("stage", "duration")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.duration = 0.0
+
+
+_tracer = None
+
+
+def enable_tracing(service_name: str = "eatright-backend") -> bool:
+    """Enable OpenTelemetry spans around stages if the SDK is installed."""
+    global _tracer
+    if _otel_trace is None:
+        return False
+    _tracer = _otel_trace.get_tracer(service_name)
+    return True
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[StageTimer]:
+    """
+    Time a pipeline stage, observing its latency histogram and (when
+    tracing is enabled) wrapping it in an OpenTelemetry span.
+    """
+    timer = StageTimer(stage)
+    in_flight = STAGES_IN_FLIGHT.labels(stage)
+    span_cm = _tracer.start_as_current_span(f"eatright.{stage}") if _tracer else None
+    if span_cm is not None:
+        span_cm.__enter__()
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield timer
+    except BaseException as exc:
+        STAGE_ERRORS.labels(stage).inc()
+        if span_cm is not None:
+            span_cm.__exit__(type(exc), exc, exc.__traceback__)
+            span_cm = None
+        raise
+    finally:
+        timer.duration = time.perf_counter() - start
+        in_flight.dec()
+        STAGE_LATENCY.labels(stage).observe(timer.duration)
+        record_stage_timing(stage, timer.duration)
+        if span_cm is not None:
+            span_cm.__exit__(None, None, None)
+
+
+def render_metrics() -> str:
+    """Render all registered collectors in Prometheus text format."""
+    return REGISTRY.render()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request latency per route template and
+    the number of in-flight requests. Unmatched paths share one label so
+    scanners cannot blow up label cardinality.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.labels(
+                scope["method"], route_path, str(status_holder[0])
+            ).observe(time.perf_counter() - start)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """pymongo ConnectionPoolListener feeding the Mongo pool gauges."""
+
+    def _address(self, event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels(self._address(event)).set(0)
+        MONGO_POOL_CHECKED_OUT.labels(self._address(event)).set(0)
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.labels(self._address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels(self._address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILURES.labels(self._address(event), str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.labels(self._address(event)).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.labels(self._address(event)).dec()
+
@@ -0,0 +1,75 @@
+"""
+Copy signed-in users' meals into the bucketed layout (one document per user-day).
+Every write is guarded on the meal id, so the migration can be re-run: run
+it, switch MEAL_STORAGE_LAYOUT to buckets, then run it again to pick up
+meals saved in between. The meals collection is left untouched.
+
+Usage: python migrate_buckets.py [--batch-size N] [--dry-run]
+"""
+
+import argparse
+import asyncio
+
+from config import get_settings
+from db import BUCKET_INDEXES, connect_to_mongodb, close_mongodb_connection, get_database
+from meal_buckets import BUCKETS_COLLECTION, migrate_meal_ops
+
+
+async def collection_stats(name: str) -> dict:
+    stats = await get_database().command("collStats", name)
+    return {key: stats.get(key, 0) for key in ("count", "size", "storageSize", "totalIndexSize")}
+
+
+def print_stats(label: str, stats: dict) -> None:
+    print(f"{label:>12}: {stats['count']} docs, {stats['size'] / 1024:.0f} KiB data, "
+          f"{stats['storageSize'] / 1024:.0f} KiB on disk, {stats['totalIndexSize'] / 1024:.0f} KiB indexes")
+
+
+async def migrate(batch_size: int, dry_run: bool) -> int:
+    await connect_to_mongodb()
+    try:
+        db = get_database()
+        meals = db[get_settings().mongodb_collection_name]
+        buckets = db[BUCKETS_COLLECTION]
+        if not dry_run:
+            await buckets.create_indexes(BUCKET_INDEXES)
+
+        # Grouping by user and time keeps consecutive writes on the same bucket
+        cursor = meals.find({"user_id": {"$ne": None}}, {"_id": 0}).sort(
+            [("user_id", 1), ("created_at", 1)]
+        ).batch_size(batch_size)
+
+        migrated = 0
+        ops = []
+        async for meal in cursor:
+            migrated += 1
+            if dry_run:
+                continue
+            ops.extend(migrate_meal_ops(meal))
+            if len(ops) >= batch_size * 2:
+                await buckets.bulk_write(ops, ordered=True)
+                ops = []
+        if ops:
+            await buckets.bulk_write(ops, ordered=True)
+
+        print_stats("meals", await collection_stats(meals.name))
+        if not dry_run:
+            print_stats("buckets", await collection_stats(BUCKETS_COLLECTION))
+        return migrated
+    finally:
+        await close_mongodb_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    migrated = asyncio.run(migrate(args.batch_size, args.dry_run))
+    verb = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{verb} {migrated} meal(s)")
+
+
+if __name__ == "__main__":
+    main()
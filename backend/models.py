@@ -8,6 +8,38 @@ from datetime import datetime
 import uuid
 
 
+# Shared micronutrient dictionary: key -> unit (matches what the AI prompt asks for).
+# Bucketed meals store amounts as arrays in this order: append only, never reorder.
+MICRONUTRIENT_UNITS = {
+    "vitamin_a": "mcg",
+    "vitamin_c": "mg",
+    "vitamin_d": "mcg",
+    "calcium": "mg",
+    "iron": "mg",
+    "fiber": "g",
+}
+MICRONUTRIENT_KEYS = tuple(MICRONUTRIENT_UNITS)
+
+# Mass units in micrograms, for converting to the dictionary's unit
+_MICROGRAMS = {"g": 1e6, "mg": 1e3, "mcg": 1.0, "µg": 1.0, "ug": 1.0}
+
+
+def micronutrient_amount(value: object, target_unit: str) -> Optional[float]:
+    """Amount of a {"amount", "unit"} micronutrient in `target_unit`, or None if unknown."""
+    if not isinstance(value, dict):
+        return None
+    try:
+        amount = float(value.get("amount"))
+    except (TypeError, ValueError):
+        return None
+    unit = str(value.get("unit", target_unit)).strip().lower()
+    if unit == target_unit:
+        return amount
+    if unit in _MICROGRAMS and target_unit in _MICROGRAMS:
+        return round(amount * _MICROGRAMS[unit] / _MICROGRAMS[target_unit], 4)
+    return None
+
+
 class User(BaseModel):
     """User model for OAuth authentication."""
     user_id: str = Field(..., description="Unique user identifier (UUID)")
@@ -16,23 +48,21 @@ class User(BaseModel):
     name: str = Field(..., description="User full name")
     picture: str = Field(default="", description="URL to user profile picture")
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    data_version: int = Field(default=0, description="Bumped whenever the user's meals change")
     
     def to_dict(self) -> dict:
-        return {
-            "user_id": self.user_id,
-            "google_id": self.google_id,
-            "email": self.email,
-            "name": self.name,
-            "picture": self.picture,
-            "created_at": self.created_at
-        }
+        # data_version is omitted on purpose: it is only ever changed with
+        # $inc in save_meal, and a profile $set must not overwrite it
+        return self.model_dump(exclude={"data_version"})
 
 
 class MealResponse(BaseModel):
     """Response model for the /upload-meal endpoint."""
     
     meal_id: str = Field(..., description="Unique identifier for the meal")
-    image_url: str = Field(..., description="Public URL of the uploaded image in GCS")
+    image_url: str = Field(default="", description="Public URL of the uploaded image in GCS (empty for text meals)")
+    thumbnail_url: Optional[str] = Field(default=None, description="Public URL of the small WebP/AVIF rendition")
+    medium_url: Optional[str] = Field(default=None, description="Public URL of the medium WebP/AVIF rendition")
     food_items: List[str] = Field(..., description="List of identified food items")
     health_verdict: str = Field(..., description="Health assessment: Healthy, Neutral, or Unhealthy")
     nutrition_advice: str = Field(..., description="AI-generated nutritionist advice")
@@ -43,6 +73,8 @@ class MealResponse(BaseModel):
     carbs: float = Field(default=0, description="Estimated carbs in grams")
     fats: float = Field(default=0, description="Estimated fats in grams")
     micronutrients: dict = Field(default_factory=dict, description="Micronutrients with amounts and units")
+    source: str = Field(default="image", description="How the meal was logged: image or text")
+    reconciliation: Optional[dict] = Field(default=None, description="Result of checking the totals against the local nutrition table")
     
     class Config:
         json_schema_extra = {
@@ -64,12 +96,42 @@ class MealResponse(BaseModel):
         }
 
 
+class DirectUploadRequest(BaseModel):
+    """Request body for /meals/upload-url."""
+    
+    filename: str = Field(..., description="Original filename (used for the extension)")
+    content_type: str = Field(..., description="MIME type of the image to upload")
+    size: int = Field(..., gt=0, description="Exact size of the image in bytes")
+
+
+class DirectUploadResponse(BaseModel):
+    """Response model for /meals/upload-url."""
+    
+    upload_id: str = Field(..., description="Id to pass to /meals/finalize-upload")
+    upload_url: str = Field(..., description="Resumable GCS session URL; PUT the image bytes here")
+    expires_in: int = Field(..., description="Seconds within which the upload must be finalized")
+
+
+class FinalizeUploadRequest(BaseModel):
+    """Request body for /meals/finalize-upload."""
+    
+    upload_id: str = Field(..., description="Id returned by /meals/upload-url")
+
+
+class TextMealRequest(BaseModel):
+    """Request body for /meals/log-text."""
+    
+    text: str = Field(..., min_length=1, max_length=1000, description="Free-text meal description, e.g. '2 eggs and toast'")
+
+
 class MealDocument(BaseModel):
     """MongoDB document schema for storing meal data."""
     
     meal_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: Optional[str] = Field(default=None, description="ID of the user who uploaded the meal")
-    image_url: str
+    image_url: str = Field(default="")
+    thumbnail_url: Optional[str] = Field(default=None)
+    medium_url: Optional[str] = Field(default=None)
     food_items: List[str]
     health_verdict: str
     nutrition_advice: str
@@ -80,23 +142,25 @@ class MealDocument(BaseModel):
     carbs: float = Field(default=0)
     fats: float = Field(default=0)
     micronutrients: dict = Field(default_factory=dict)
+    source: str = Field(default="image")
+    reconciliation: Optional[dict] = Field(default=None)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     def to_dict(self) -> dict:
         """Convert model to dictionary for MongoDB insertion."""
-        return {
-            "meal_id": self.meal_id,
-            "user_id": self.user_id,
-            "image_url": self.image_url,
-            "food_items": self.food_items,
-            "health_verdict": self.health_verdict,
-            "nutrition_advice": self.nutrition_advice,
-            "benefits": self.benefits,
-            "cautions": self.cautions,
-            "calories": self.calories,
-            "protein": self.protein,
-            "carbs": self.carbs,
-            "fats": self.fats,
-            "micronutrients": self.micronutrients,
-            "created_at": self.created_at
-        }
+        return self.model_dump()
+
+
+class MealSearchResponse(BaseModel):
+    """Response model for /meals/search."""
+    
+    results: List[MealDocument] = Field(..., description="One page of matching meals")
+    total: int = Field(..., description="Number of matching meals")
+    facets: dict = Field(..., description="Counts per health_verdict and calorie range")
+
+
+# Fields of a meal returned by the upload endpoints (subset of MealDocument)
+MEAL_RESPONSE_FIELDS = frozenset(MealResponse.model_fields)
+
+# Mongo projection returning meal documents already in response shape
+MEAL_DOCUMENT_PROJECTION = {"_id": 0, **{name: 1 for name in MealDocument.model_fields}}
@@ -0,0 +1,431 @@
+"""
+Local nutrition database for text meal logging and for sanity-checking
+model estimates.
+A bundled per-100g nutrition table (USDA-style values) is loaded into
+column arrays with a trigram index for fuzzy name matching, so a meal
+like "2 eggs and toast" is resolved locally without a model call.
+"""
+
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import csv
+import math
+import re
+
+from models import MICRONUTRIENT_UNITS
+
+DATA_PATH = Path(__file__).parent / "data" / "nutrition.csv"
+
+MACRO_COLUMNS = ("calories", "protein", "carbs", "fats")
+NUTRIENT_COLUMNS = MACRO_COLUMNS + tuple(MICRONUTRIENT_UNITS)
+
+# Minimum Dice similarity between trigram sets for a fuzzy match
+MIN_MATCH_SCORE = 0.5
+
+# Atwater factors (kcal per gram)
+KCAL_PER_GRAM = {"protein": 4.0, "carbs": 4.0, "fats": 9.0}
+
+# Reconciliation: model calories outside [expected / r, expected * r] are implausible
+IMPLAUSIBLE_CALORIE_RATIO = 2.5
+# Share of food items that must resolve before the table estimate is trusted
+MIN_RECONCILE_COVERAGE = 0.5
+
+
+def normalize_name(text: str) -> str:
+    return re.sub(r"[^a-z ]+", " ", text.lower()).strip()
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NutritionIndex:
+    """
+    Column-oriented nutrition table.
+    Each nutrient is an array('d') indexed by food id; names and aliases
+    resolve through an exact dictionary first and a trigram index second.
+    """
+
+    def __init__(self, path: Path = DATA_PATH):
+        self.names: List[str] = []
+        self.portion_g = array("d")
+        self.health_score = array("b")
+        self.columns: Dict[str, array] = {column: array("d") for column in NUTRIENT_COLUMNS}
+
+        self._exact: Dict[str, int] = {}
+        self._keys: List[Tuple[str, int]] = []  # (normalized key, food id)
+        self._key_trigrams: List[int] = []      # trigram count per key
+        self._trigram_index: Dict[str, array] = defaultdict(lambda: array("H"))
+
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                self._add(row)
+
+    def _add(self, row: Dict[str, str]) -> None:
+        food_id = len(self.names)
+        self.names.append(row["name"])
+        self.portion_g.append(float(row["portion_g"]))
+        self.health_score.append(int(row["health_score"]))
+        for column in NUTRIENT_COLUMNS:
+            self.columns[column].append(float(row[column]))
+
+        keys = [row["name"]] + [alias for alias in row["aliases"].split(";") if alias]
+        for key in keys:
+            key = normalize_name(key)
+            self._exact.setdefault(key, food_id)
+            key_id = len(self._keys)
+            grams = _trigrams(key)
+            self._keys.append((key, food_id))
+            self._key_trigrams.append(len(grams))
+            for gram in grams:
+                self._trigram_index[gram].append(key_id)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def lookup(self, name: str) -> Optional[int]:
+        """Resolve a food name to a food id, or None if nothing is close enough."""
+        key = normalize_name(name)
+        if not key:
+            return None
+
+        food_id = self._exact.get(key)
+        if food_id is None and key.endswith("s"):
+            food_id = self._exact.get(key[:-1])
+        if food_id is not None:
+            return food_id
+
+        grams = _trigrams(key)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for key_id in self._trigram_index.get(gram, ()):
+                shared[key_id] += 1
+
+        best_id, best_score = None, MIN_MATCH_SCORE
+        for key_id, count in shared.items():
+            score = 2 * count / (len(grams) + self._key_trigrams[key_id])
+            if score > best_score:
+                best_id, best_score = key_id, score
+
+        return self._keys[best_id][1] if best_id is not None else None
+
+    def match_item(self, name: str) -> Optional[int]:
+        """
+        Resolve a descriptive item name such as "steamed jasmine rice".
+        Falls back to exact matches on shorter word windows (longest,
+        rightmost first), since the head noun usually comes last.
+        """
+        food_id = self.lookup(name)
+        if food_id is not None:
+            return food_id
+
+        words = normalize_name(re.sub(r"\(.*?\)", " ", name)).split()
+        for size in range(min(len(words) - 1, 3), 0, -1):
+            for start in range(len(words) - size, -1, -1):
+                window = " ".join(words[start:start + size])
+                food_id = self._exact.get(window)
+                if food_id is None and window.endswith("s"):
+                    food_id = self._exact.get(window[:-1])
+                if food_id is not None:
+                    return food_id
+        return None
+
+    def nutrients(self, food_id: int, grams: float) -> Dict[str, float]:
+        """Nutrient amounts for `grams` of a food."""
+        factor = grams / 100.0
+        return {column: values[food_id] * factor for column, values in self.columns.items()}
+
+
+@lru_cache()
+def get_nutrition_index() -> NutritionIndex:
+    """Shared index, loaded on first use."""
+    return NutritionIndex()
+
+
+# Quantity parsing
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twelve": 12,
+    "half": 0.5, "a half": 0.5, "half a": 0.5, "half an": 0.5, "quarter": 0.25, "a quarter": 0.25,
+    "dozen": 12, "a dozen": 12, "couple": 2, "a couple": 2, "few": 3, "a few": 3,
+}
+
+# Absolute units in grams (ml treated as grams)
+WEIGHT_UNITS = {
+    "g": 1, "gram": 1, "grams": 1, "gr": 1, "kg": 1000,
+    "oz": 28.35, "ounce": 28.35, "ounces": 28.35, "lb": 453.6, "lbs": 453.6,
+    "ml": 1, "l": 1000, "litre": 1000, "liter": 1000,
+    "tbsp": 15, "tablespoon": 15, "tablespoons": 15,
+    "tsp": 5, "teaspoon": 5, "teaspoons": 5,
+}
+
+# Household units as multiples of the food's typical portion
+PORTION_UNITS = {
+    "piece": 1, "pieces": 1, "slice": 1, "slices": 1, "serving": 1, "servings": 1,
+    "cup": 1, "cups": 1, "glass": 1, "glasses": 1, "can": 1, "cans": 1,
+    "handful": 1, "handfuls": 1, "bowl": 1.5, "bowls": 1.5, "plate": 2, "plates": 2,
+    "small": 0.7, "medium": 1, "large": 1.3,
+}
+
+# Mixed numbers first, so "1 1/2" is not read as "1" followed by "1/2 ..."
+_NUMBER = r"\d+\s+\d+\s*/\s*\d+|\d+(?:\.\d+)?(?:\s*/\s*\d+)?"
+_WORDS = "|".join(sorted((re.escape(w) for w in NUMBER_WORDS), key=len, reverse=True))
+_UNITS = "|".join(sorted((re.escape(u) for u in list(WEIGHT_UNITS) + list(PORTION_UNITS)), key=len, reverse=True))
+ITEM_PATTERN = re.compile(
+    rf"^(?P<qty>{_NUMBER}|(?:{_WORDS})\b)?\s*"
+    rf"(?:(?P<unit>{_UNITS})\b\.?)?\s*"
+    rf"(?:of\s+)?(?:(?:a|an|the|some)\s+)?(?P<name>.+)$"
+)
+SPLIT_PATTERN = re.compile(r",|;|\+|&|\n|\band\b|\bwith\b|\bplus\b|\bon\b")
+
+
+# Largest quantity accepted in a description ("10000 g" is already 10 kg)
+MAX_QUANTITY = 10_000
+
+
+def _parse_number(text: str) -> float:
+    """
+    Parse a quantity ("2", "1.5", "3/4", "1 1/2" or a number word).
+
+    Raises:
+        ValueError: for a zero denominator or a quantity that is not a
+            finite number in (0, MAX_QUANTITY].
+    """
+    text = text.strip()
+    if text in NUMBER_WORDS:
+        return NUMBER_WORDS[text]
+    parts = text.split()
+    if len(parts) == 2:  # mixed number, e.g. "1 1/2"
+        value = _parse_number(parts[0]) + _parse_number(parts[1])
+    elif "/" in text:
+        numerator, denominator = (float(part) for part in text.split("/"))
+        if denominator == 0:
+            raise ValueError(f"Invalid quantity '{text[:20]}': zero denominator")
+        value = numerator / denominator
+    else:
+        value = float(text)
+    if not math.isfinite(value) or not 0 < value <= MAX_QUANTITY:
+        raise ValueError(f"Invalid quantity '{text[:20]}'")
+    return value
+
+
+@dataclass
+class ParsedItem:
+    text: str
+    quantity: float
+    unit: Optional[str]
+    name: str
+
+
+def parse_meal_text(text: str) -> List[ParsedItem]:
+    """
+    Split free text into items with quantity, unit and food name.
+
+    Raises:
+        ValueError: if an item's quantity is invalid (see _parse_number).
+    """
+    items = []
+    for chunk in SPLIT_PATTERN.split(text.lower()):
+        chunk = chunk.strip(" .")
+        if not chunk:
+            continue
+        # Glued weights such as "200g chicken"
+        chunk = re.sub(r"^(\d+(?:\.\d+)?)(g|kg|oz|ml|lb)\b", r"\1 \2", chunk)
+        match = ITEM_PATTERN.match(chunk)
+        if not match:
+            continue
+        quantity = _parse_number(match.group("qty")) if match.group("qty") else 1.0
+        items.append(ParsedItem(
+            text=chunk,
+            quantity=quantity,
+            unit=match.group("unit"),
+            name=match.group("name").strip(),
+        ))
+    return items
+
+
+def _grams_for(item: ParsedItem, portion_g: float) -> float:
+    if item.unit in WEIGHT_UNITS:
+        return item.quantity * WEIGHT_UNITS[item.unit]
+    return item.quantity * portion_g * PORTION_UNITS.get(item.unit, 1)
+
+
+def _format_grams(grams: float) -> str:
+    return f"{grams:.0f} g"
+
+
+def analyze_meal_text(text: str) -> Dict[str, object]:
+    """
+    Compute a meal analysis from free text using the local index.
+
+    Returns:
+        Dict with the same keys as the image analyzer (food_items,
+        health_verdict, nutrition_advice, benefits, cautions, macros,
+        micronutrients) plus 'unmatched' items.
+
+    Raises:
+        ValueError: if an item's quantity is invalid.
+    """
+    index = get_nutrition_index()
+    totals = dict.fromkeys(NUTRIENT_COLUMNS, 0.0)
+    food_items: List[str] = []
+    unmatched: List[str] = []
+    weighted_score = 0.0
+
+    for item in parse_meal_text(text):
+        food_id = index.lookup(item.name)
+        if food_id is None:
+            unmatched.append(item.text)
+            continue
+
+        grams = _grams_for(item, index.portion_g[food_id])
+        nutrients = index.nutrients(food_id, grams)
+        for column, amount in nutrients.items():
+            totals[column] += amount
+        weighted_score += index.health_score[food_id] * max(nutrients["calories"], 1.0)
+        food_items.append(f"{index.names[food_id]} ({_format_grams(grams)})")
+
+    calories = totals["calories"]
+    score = weighted_score / max(calories, 1.0) if food_items else 0.0
+    if score >= 0.34:
+        health_verdict = "Healthy"
+    elif score <= -0.34:
+        health_verdict = "Unhealthy"
+    else:
+        health_verdict = "Neutral"
+
+    benefits, cautions = _assess(totals)
+    if unmatched:
+        cautions.append(f"Not found in the nutrition table: {', '.join(unmatched)}")
+
+    return {
+        "food_items": food_items,
+        "health_verdict": health_verdict,
+        "nutrition_advice": (
+            f"Estimated from a local nutrition table for {len(food_items)} item(s). "
+            "Portions without a unit use a typical serving size."
+        ),
+        "benefits": benefits,
+        "cautions": cautions,
+        "calories": int(round(calories)),
+        "protein": round(totals["protein"], 1),
+        "carbs": round(totals["carbs"], 1),
+        "fats": round(totals["fats"], 1),
+        "micronutrients": {
+            key: {"amount": round(totals[key], 1), "unit": unit}
+            for key, unit in MICRONUTRIENT_UNITS.items()
+        },
+        "unmatched": unmatched,
+    }
+
+
+def _assess(totals: Dict[str, float]) -> Tuple[List[str], List[str]]:
+    """Rule-based benefits and cautions for computed totals."""
+    benefits, cautions = [], []
+    if totals["protein"] >= 20:
+        benefits.append("Good source of protein")
+    if totals["fiber"] >= 5:
+        benefits.append("High in fibre, which supports digestion and satiety")
+    if totals["vitamin_c"] >= 30:
+        benefits.append("Provides a good amount of vitamin C")
+    if totals["calcium"] >= 250:
+        benefits.append("Contributes calcium for bone health")
+    if totals["iron"] >= 4:
+        benefits.append("Contributes iron")
+    if totals["calories"] >= 900:
+        cautions.append("High calorie meal; consider a smaller portion")
+    if totals["fats"] >= 35:
+        cautions.append("High in fat")
+    if totals["calories"] > 0 and totals["carbs"] * 4 > totals["calories"] * 0.65:
+        cautions.append("Carbohydrate-heavy; add protein or vegetables for balance")
+    if totals["fiber"] < 2 and totals["calories"] >= 300:
+        cautions.append("Low in fibre")
+    return benefits, cautions
+
+
+def _expected_totals(food_items: List[str]) -> Tuple[Dict[str, float], int]:
+    """Table totals for the resolvable items and the number resolved."""
+    index = get_nutrition_index()
+    food_ids, grams = [], []
+    for food_item in food_items:
+        try:
+            parsed = parse_meal_text(str(food_item))
+        except ValueError:
+            # Names such as "0% fat greek yogurt" are not quantities; leave unresolved
+            continue
+        item = parsed[0] if len(parsed) == 1 else None
+        food_id = index.match_item(item.name if item else str(food_item))
+        if food_id is None:
+            continue
+        food_ids.append(food_id)
+        grams.append(_grams_for(item, index.portion_g[food_id]) if item else index.portion_g[food_id])
+
+    factors = [g / 100.0 for g in grams]
+    totals = {
+        column: sum(values[food_id] * factor for food_id, factor in zip(food_ids, factors))
+        for column, values in index.columns.items()
+    }
+    return totals, len(food_ids)
+
+
+def reconcile_analysis(analysis: Dict[str, object], mode: str = "flag") -> Dict[str, object]:
+    """
+    Check model totals for internal consistency and against the local table.
+
+    Two checks, neither of which calls the model:
+      * energy: calories vs. 4/4/9 kcal per gram of protein/carbs/fats
+      * plausibility: calories vs. typical portions of the identified items
+        (only when at least MIN_RECONCILE_COVERAGE of the items resolve)
+
+    Args:
+        analysis: Parsed analyzer output (modified in place)
+        mode: 'flag' records the findings; 'correct' also repairs totals
+
+    Returns:
+        The analysis with a 'reconciliation' entry
+    """
+    food_items = analysis.get("food_items") or []
+    calories = float(analysis.get("calories") or 0)
+    macro_kcal = sum(float(analysis.get(key) or 0) * kcal for key, kcal in KCAL_PER_GRAM.items())
+    issues: List[str] = []
+    corrected: List[str] = []
+
+    if macro_kcal and abs(calories - macro_kcal) > 0.25 * max(calories, macro_kcal):
+        issues.append("energy_mismatch")
+
+    expected, matched = _expected_totals(food_items)
+    coverage = matched / len(food_items) if food_items else 0.0
+    expected_kcal = expected["calories"] / coverage if coverage else 0.0
+
+    def plausible(kcal: float) -> bool:
+        return expected_kcal / IMPLAUSIBLE_CALORIE_RATIO <= kcal <= expected_kcal * IMPLAUSIBLE_CALORIE_RATIO
+
+    trusted = coverage >= MIN_RECONCILE_COVERAGE and expected_kcal > 0
+    if trusted and not plausible(calories):
+        issues.append("implausible_calories")
+
+    if mode == "correct" and issues:
+        if "energy_mismatch" in issues and (not trusted or plausible(macro_kcal)):
+            # Itemised macro grams are usually closer than the headline figure
+            analysis["calories"] = int(round(macro_kcal))
+            corrected = ["calories"]
+        elif "implausible_calories" in issues:
+            # Replace totals with the table estimate, scaled up for unresolved items
+            analysis["calories"] = int(round(expected_kcal))
+            for key in KCAL_PER_GRAM:
+                analysis[key] = round(expected[key] / coverage, 1)
+            corrected = ["calories", *KCAL_PER_GRAM]
+
+    analysis["reconciliation"] = {
+        "status": ("corrected" if corrected else "flagged") if issues else "consistent",
+        "issues": issues,
+        "corrected": corrected,
+        "matched_items": matched,
+        "expected_calories": int(round(expected_kcal)) if trusted else None,
+    }
+    return analysis
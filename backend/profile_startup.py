@@ -0,0 +1,59 @@
+"""
+Startup profile: import-time breakdown of the application module.
+Runs `python -X importtime -c "import main"` in a fresh interpreter and
+prints the slowest top-level imports.
+
+Usage: python profile_startup.py [module] [top_n]
+"""
+
+import subprocess
+import sys
+
+
+def profile_imports(module: str = "main"):
+    """Return (total_us, [(cumulative_us, self_us, depth, name), ...]) for a cold import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        raise SystemExit(f"Importing {module} failed")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((int(cumulative_us), int(self_us), depth, name.strip()))
+
+    total = sum(cumulative for cumulative, _, depth, _ in entries if depth == 0)
+    return total, entries
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "main"
+    top_n = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    total, entries = profile_imports(module)
+
+    # Direct dependencies of the target module
+    children = [e for e in entries if e[2] == 1]
+
+    print("=" * 70)
+    print(f"IMPORT PROFILE: {module} (total {total / 1000:.1f}ms)")
+    print("=" * 70)
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative, self_us, _, name in sorted(children, reverse=True)[:top_n]:
+        print(f"{cumulative / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {name}")
+
+    print("\nSlowest modules anywhere in the tree:")
+    for cumulative, _, _, name in sorted(entries, reverse=True)[:top_n]:
+        print(f"{cumulative / 1000:>10.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
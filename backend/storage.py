@@ -1,79 +1,405 @@
 """
 Google Cloud Storage integration for image uploads.
-Handles file upload and public URL generation.
+Handles content-addressed file upload, renditions and public URL generation.
 """
 
-from google.cloud import storage
 from config import get_settings
-import uuid
+from datetime import datetime, timezone
+import asyncio
+import hashlib
 import logging
-from typing import BinaryIO
+from typing import BinaryIO, Dict, List, Optional, Tuple, TYPE_CHECKING
 import os
+import re
+import uuid
+
+if TYPE_CHECKING:
+    from google.cloud import storage
 
 logger = logging.getLogger(__name__)
 
+# Direct (client-to-GCS) uploads land here before being content-addressed.
+# Add a bucket lifecycle rule deleting this prefix after a day to clean up
+# sessions that are never finalized.
+STAGING_PREFIX = "uploads/"
+# Content-addressed objects never change, so browsers and CDNs may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}(\.[a-z0-9]{1,5})?$")
+# Extensions kept on upload ids; anything else is staged without one
+UPLOAD_EXTENSIONS = (".jpg", ".png", ".gif", ".webp", ".heic", ".avif")
 
-def get_storage_client() -> storage.Client:
+# Shared client; created on first use so the SDK import stays off the startup path
+_storage_client: Optional["storage.Client"] = None
+
+
+def get_storage_client() -> "storage.Client":
     """
     Get Google Cloud Storage client.
     Credentials are loaded from GOOGLE_APPLICATION_CREDENTIALS env variable.
     """
+    global _storage_client
+    
+    if _storage_client is not None:
+        return _storage_client
+    
     settings = get_settings()
     
+    # Local emulator (e.g. fake-gcs-server) needs no credentials
+    if os.environ.get("STORAGE_EMULATOR_HOST"):
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import storage
+        _storage_client = storage.Client(project="emulator", credentials=AnonymousCredentials())
+        return _storage_client
+    
     # Ensure credentials file path is set
     if not os.path.exists(settings.google_application_credentials):
         raise FileNotFoundError(
             f"Google Cloud credentials file not found: {settings.google_application_credentials}"
         )
     
-    return storage.Client()
+    from google.cloud import storage
+    _storage_client = storage.Client()
+    return _storage_client
+
+
+def compute_content_hash(data: bytes) -> str:
+    """SHA-256 hex digest used as the content address of an image."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_extension(filename: str) -> str:
+    """Lower-case file extension with '.jpeg' folded into '.jpg'."""
+    file_extension = os.path.splitext(filename or "")[1].lower()
+    return '.jpg' if file_extension == '.jpeg' else file_extension
+
+
+def _public_base_url() -> str:
+    settings = get_settings()
+    host = os.environ.get("STORAGE_EMULATOR_HOST", "https://storage.googleapis.com").rstrip("/")
+    return f"{host}/{settings.gcs_bucket_name}/"
+
+
+def get_public_url(object_name: str) -> str:
+    """Public URL of an object (bucket must be configured for public access)."""
+    return f"{_public_base_url()}{object_name}"
+
+
+def get_object_name(public_url: str) -> Optional[str]:
+    """Inverse of get_public_url; None for URLs outside our bucket."""
+    prefix = _public_base_url()
+    if not public_url.startswith(prefix):
+        return None
+    return public_url[len(prefix):]
+
+
+def image_object_name(data: bytes, filename: str) -> str:
+    """Content-addressed object name of an original image."""
+    return f"meals/{compute_content_hash(data)}{normalize_extension(filename)}"
+
+
+def rendition_object_name(content_hash: str, name: str, image_format: str) -> str:
+    return f"renditions/{content_hash}_{name}.{image_format}"
+
+
+def image_object_names(object_name: str) -> List[str]:
+    """
+    An original image and every rendition derived from it (in all
+    formats, in case IMAGE_RENDITION_FORMAT changed). These are stored and
+    collected together under the original's reference count.
+    """
+    from images import RENDITION_CONTENT_TYPES, RENDITION_SIZES
+    
+    content_hash = os.path.splitext(os.path.basename(object_name))[0]
+    return [object_name] + [
+        rendition_object_name(content_hash, name, image_format)
+        for image_format in RENDITION_CONTENT_TYPES for name in RENDITION_SIZES
+    ]
 
 
-async def upload_image_to_gcs(file_content: BinaryIO, filename: str) -> str:
+def _upload_if_absent(object_name: str, data: bytes, content_type: str, overwrite: bool = False) -> bool:
+    """
+    Upload bytes unless the object already exists.
+    
+    Args:
+        overwrite: Write even if the object exists. Used when gc_images.py
+            may be deleting it: the new generation survives its
+            generation-conditional delete.
+    
+    Returns:
+        True if bytes were uploaded, False if an identical object was reused
+    """
+    from google.api_core.exceptions import PreconditionFailed
+    
+    settings = get_settings()
+    bucket = get_storage_client().bucket(settings.gcs_bucket_name)
+    blob = bucket.blob(object_name)
+    blob.cache_control = IMMUTABLE_CACHE_CONTROL
+    if overwrite:
+        blob.upload_from_string(data, content_type=content_type)
+        return True
+    
+    # Cheap metadata lookup first so repeat images never transfer their bytes
+    if blob.exists():
+        return False
+    
+    try:
+        # if_generation_match=0 makes concurrent uploads of the same image safe
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+        return True
+    except PreconditionFailed:
+        return False
+
+
+async def upload_image_to_gcs(file_content: BinaryIO, filename: str, overwrite: bool = False) -> str:
     """
     Upload an image to Google Cloud Storage.
+    Objects are content-addressed (meals/{sha256}{ext}), so identical
+    images are stored once and repeat uploads skip the transfer.
     
     Args:
         file_content: Binary file content
         filename: Original filename
+        overwrite: Rewrite the object even if it exists (see _upload_if_absent)
         
     Returns:
         public_url: Public URL of the uploaded image
     """
-    settings = get_settings()
-    
     try:
-        # Initialize GCS client
-        client = get_storage_client()
-        bucket = client.bucket(settings.gcs_bucket_name)
-        
-        # Generate unique filename to avoid collisions
-        file_extension = os.path.splitext(filename)[1]
-        unique_filename = f"meals/{uuid.uuid4()}{file_extension}"
-        
-        # Create blob and upload
-        blob = bucket.blob(unique_filename)
-        
         # Reset file pointer to beginning
         file_content.seek(0)
+        data = file_content.read()
         
-        # Upload the file
-        blob.upload_from_file(file_content, content_type=get_content_type(file_extension))
-        
-        # For uniform bucket-level access, we need to make the bucket public or use signed URLs
-        # Using public URL (bucket must be configured for public access)
-        public_url = f"https://storage.googleapis.com/{settings.gcs_bucket_name}/{unique_filename}"
+        object_name = image_object_name(data, filename)
+        uploaded = await asyncio.to_thread(
+            _upload_if_absent, object_name, data, get_content_type(normalize_extension(filename)), overwrite
+        )
         
-        logger.info(f"Image uploaded to GCS: {unique_filename}")
-        logger.info(f"Public URL: {public_url}")
+        public_url = get_public_url(object_name)
+        if uploaded:
+            logger.debug("Image uploaded to GCS: %s", object_name)
+        else:
+            logger.debug("Image already in GCS, skipped upload: %s", object_name)
         
         return public_url
         
     except Exception as e:
-        logger.error(f"Failed to upload image to GCS: {e}")
+        logger.error("Failed to upload image to GCS: %s", e)
         raise
 
 
+def _staging_object_name(upload_id: str) -> str:
+    if not UPLOAD_ID_PATTERN.match(upload_id):
+        raise ValueError("Invalid upload id")
+    return f"{STAGING_PREFIX}{upload_id}"
+
+
+def _create_upload_session(object_name: str, content_type: str, size: int, origin: Optional[str]) -> str:
+    settings = get_settings()
+    bucket = get_storage_client().bucket(settings.gcs_bucket_name)
+    return bucket.blob(object_name).create_resumable_upload_session(
+        content_type=content_type,
+        size=size,                 # GCS rejects bodies of any other length
+        origin=origin,             # CORS for the browser's PUT
+        if_generation_match=0      # Session can never overwrite an object
+    )
+
+
+async def create_direct_upload(filename: str, content_type: str, size: int,
+                               origin: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Start a direct client-to-GCS upload (phase one of the two-phase flow).
+    The client PUTs the image bytes to the returned resumable session URL,
+    so they never pass through an API worker.
+    
+    Args:
+        filename: Original filename (its extension, if in UPLOAD_EXTENSIONS)
+        content_type: MIME type the client will upload
+        size: Exact byte size the client will upload
+        origin: Browser origin allowed to use the session URL
+        
+    Returns:
+        (upload_id, upload_url)
+    """
+    extension = normalize_extension(filename)
+    upload_id = f"{uuid.uuid4().hex}{extension if extension in UPLOAD_EXTENSIONS else ''}"
+    upload_url = await asyncio.to_thread(
+        _create_upload_session, _staging_object_name(upload_id), content_type, size, origin
+    )
+    logger.debug("Direct upload session created: %s", upload_id)
+    return upload_id, upload_url
+
+
+def _download_staged(object_name: str, max_bytes: int, max_age_seconds: int) -> bytes:
+    settings = get_settings()
+    bucket = get_storage_client().bucket(settings.gcs_bucket_name)
+    blob = bucket.get_blob(object_name)
+    
+    if blob is None:
+        raise FileNotFoundError("Upload not found or not finished")
+    if blob.size and blob.size > max_bytes:
+        raise ValueError("Uploaded file is too large")
+    age = (datetime.now(timezone.utc) - blob.time_created).total_seconds()
+    if age > max_age_seconds:
+        raise ValueError("Upload session has expired")
+    
+    return blob.download_as_bytes()
+
+
+async def fetch_direct_upload(upload_id: str, max_bytes: int, max_age_seconds: int) -> bytes:
+    """
+    Fetch the bytes of a finished direct upload (phase two) for analysis.
+    GCS to API-server transfer stays inside Google's network.
+    """
+    return await asyncio.to_thread(
+        _download_staged, _staging_object_name(upload_id), max_bytes, max_age_seconds
+    )
+
+
+def _promote_staged(staging_name: str, object_name: str, overwrite: bool) -> bool:
+    from google.api_core.exceptions import PreconditionFailed
+    
+    settings = get_settings()
+    bucket = get_storage_client().bucket(settings.gcs_bucket_name)
+    staged = bucket.blob(staging_name)
+    
+    copied = False
+    promoted = bucket.blob(object_name)
+    if overwrite or not promoted.exists():
+        try:
+            # Server-side rewrite: no image bytes leave GCS, and the object
+            # carries its cache headers from the moment it exists
+            staged.reload()
+            promoted.content_type = staged.content_type
+            promoted.cache_control = IMMUTABLE_CACHE_CONTROL
+            token = None
+            while True:
+                token, _, _ = promoted.rewrite(
+                    staged, token=token, if_generation_match=None if overwrite else 0
+                )
+                if token is None:
+                    break
+            copied = True
+        except PreconditionFailed:
+            pass
+    
+    staged.delete()
+    return copied
+
+
+async def promote_direct_upload(upload_id: str, data: bytes, overwrite: bool = False) -> str:
+    """
+    Move a finished direct upload to its content-addressed location and
+    remove the staging object.
+    
+    Args:
+        upload_id: Id returned by create_direct_upload
+        data: The uploaded bytes (already fetched for analysis)
+        overwrite: Replace the object even if it exists (see _upload_if_absent)
+        
+    Returns:
+        public_url: Public URL of the stored image
+    """
+    staging_name = _staging_object_name(upload_id)
+    object_name = image_object_name(data, upload_id)
+    
+    copied = await asyncio.to_thread(_promote_staged, staging_name, object_name, overwrite)
+    if copied:
+        logger.debug("Direct upload promoted to: %s", object_name)
+    else:
+        logger.debug("Direct upload duplicates existing image: %s", object_name)
+    
+    return get_public_url(object_name)
+
+
+async def delete_direct_upload(upload_id: str) -> bool:
+    """Delete a staged direct upload that will not be promoted."""
+    return await asyncio.to_thread(delete_image, _staging_object_name(upload_id))
+
+
+def _store_renditions(image_bytes: bytes, image_format: str, overwrite: bool) -> Dict[str, str]:
+    from images import RENDITION_CONTENT_TYPES, RENDITION_SIZES, generate_renditions
+    
+    settings = get_settings()
+    bucket = get_storage_client().bucket(settings.gcs_bucket_name)
+    content_hash = compute_content_hash(image_bytes)
+    object_names = {
+        name: rendition_object_name(content_hash, name, image_format) for name in RENDITION_SIZES
+    }
+    
+    # Repeat image: renditions already exist, skip the resize entirely
+    if not overwrite and all(bucket.blob(object_name).exists() for object_name in object_names.values()):
+        return {name: get_public_url(object_name) for name, object_name in object_names.items()}
+    
+    for name, data in generate_renditions(image_bytes, image_format).items():
+        _upload_if_absent(object_names[name], data, RENDITION_CONTENT_TYPES[image_format], overwrite)
+    
+    return {name: get_public_url(object_name) for name, object_name in object_names.items()}
+
+
+async def store_image_renditions(image_bytes: bytes, image_format: str, overwrite: bool = False) -> Dict[str, str]:
+    """
+    Generate and upload the thumbnail/medium renditions of an image.
+    Rendition objects are keyed by the original's content hash and share
+    its reference count (see image_object_names).
+    
+    Args:
+        image_bytes: Original image bytes
+        image_format: 'webp' or 'avif'
+        overwrite: Regenerate and rewrite existing renditions (see _upload_if_absent)
+        
+    Returns:
+        Mapping of rendition name ('thumb', 'medium') to public URL
+    """
+    renditions = await asyncio.to_thread(_store_renditions, image_bytes, image_format, overwrite)
+    logger.debug("Image renditions stored: %s", ', '.join(renditions))
+    return renditions
+
+
+def object_generation(object_name: str) -> Optional[int]:
+    """Current generation of an object, or None if it does not exist."""
+    settings = get_settings()
+    blob = get_storage_client().bucket(settings.gcs_bucket_name).get_blob(object_name)
+    return blob.generation if blob else None
+
+
+def delete_generation(object_name: str, generation: int) -> bool:
+    """
+    Delete an object only if it is still at `generation`, so a concurrent
+    rewrite is never removed.
+    
+    Returns:
+        True if the object was deleted
+    """
+    from google.api_core.exceptions import NotFound, PreconditionFailed
+    
+    settings = get_settings()
+    bucket = get_storage_client().bucket(settings.gcs_bucket_name)
+    try:
+        bucket.blob(object_name).delete(if_generation_match=generation)
+        return True
+    except (NotFound, PreconditionFailed):
+        return False
+
+
+def delete_image(object_name: str) -> bool:
+    """
+    Delete an image object.
+    
+    Returns:
+        True if the object was deleted, False if it was already gone
+    """
+    from google.api_core.exceptions import NotFound
+    
+    settings = get_settings()
+    bucket = get_storage_client().bucket(settings.gcs_bucket_name)
+    try:
+        bucket.blob(object_name).delete()
+        return True
+    except NotFound:
+        return False
+
+
 def get_content_type(file_extension: str) -> str:
     """
     Get MIME type based on file extension.
@@ -0,0 +1,106 @@
+"""
+Offline stand-in for the Gemini SDK, selected with AI_BACKEND=stub.
+
+It exposes the parts of `google.generativeai` the analyzer uses
+(configure, GenerativeModel.generate_content[_async]) and answers with a
+canned analysis. Usage metadata is estimated from the request the way
+Gemini bills it: about 4 characters per text token, and 258 tokens per
+image (images over 384px are cut into 768x768 tiles of 258 tokens each).
+That makes prompt and image-size changes measurable without an API key;
+see `python bench.py prompts`. Never use it in production.
+"""
+
+from typing import Any, Iterable, Tuple
+import asyncio
+import io
+import json
+import math
+
+TEXT_CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+IMAGE_SMALL_SIDE = 384
+IMAGE_TILE_SIDE = 768
+
+SAMPLE_ANALYSIS = {
+    "food_items": ["grilled chicken breast", "brown rice", "steamed broccoli"],
+    "health_verdict": "Healthy",
+    "nutrition_advice": "A balanced plate; keep sauces light to limit sodium.",
+    "benefits": ["High in lean protein", "Good source of fibre", "Rich in vitamin C"],
+    "cautions": ["Watch portion size of rice", "Sauces can add sodium"],
+    "calories": 560,
+    "protein": 45.0,
+    "carbs": 55.0,
+    "fats": 12.0,
+    "micronutrients": {
+        "vitamin_a": {"amount": 90, "unit": "mcg"},
+        "vitamin_c": {"amount": 80, "unit": "mg"},
+        "vitamin_d": {"amount": 0.2, "unit": "mcg"},
+        "calcium": {"amount": 70, "unit": "mg"},
+        "iron": {"amount": 2.1, "unit": "mg"},
+        "fiber": {"amount": 6.5, "unit": "g"},
+    },
+}
+
+
+def configure(**kwargs) -> None:
+    pass
+
+
+def image_tokens(width: int, height: int) -> int:
+    if width <= IMAGE_SMALL_SIDE and height <= IMAGE_SMALL_SIDE:
+        return IMAGE_TOKENS
+    tiles = math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE)
+    return tiles * IMAGE_TOKENS
+
+
+def text_tokens(text: str) -> int:
+    return math.ceil(len(text) / TEXT_CHARS_PER_TOKEN) if text else 0
+
+
+def _image_size(part: Any) -> Tuple[int, int]:
+    if isinstance(part, dict):  # {"mime_type": ..., "data": ...}
+        from PIL import Image
+        return Image.open(io.BytesIO(part["data"])).size
+    return part.size  # PIL image
+
+
+def _tokens(parts: Iterable[Any]) -> int:
+    return sum(text_tokens(part) if isinstance(part, str) else image_tokens(*_image_size(part)) for part in parts)
+
+
+class _Usage:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class StubResponse:
+    def __init__(self, text: str, prompt_tokens: int):
+        self.text = text
+        self.usage_metadata = _Usage(prompt_tokens, text_tokens(text))
+
+
+class GenerativeModel:
+    """Mirrors google.generativeai.GenerativeModel for the calls the app makes."""
+
+    def __init__(self, model_name: str = "stub", safety_settings=None, generation_config=None,
+                 system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def _contents(self, contents) -> list:
+        parts = list(contents) if isinstance(contents, (list, tuple)) else [contents]
+        if self.system_instruction:
+            parts.insert(0, self.system_instruction)
+        return parts
+
+    def generate_content(self, contents, **kwargs) -> StubResponse:
+        parts = self._contents(contents)
+        has_image = any(not isinstance(part, str) for part in parts)
+        text = json.dumps(SAMPLE_ANALYSIS) if has_image else "A steady week with mostly balanced meals."
+        return StubResponse(text, _tokens(parts))
+
+    async def generate_content_async(self, contents, **kwargs) -> StubResponse:
+        await asyncio.sleep(0)
+        return self.generate_content(contents, **kwargs)
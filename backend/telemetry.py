@@ -0,0 +1,125 @@
+"""
+Per-analysis telemetry: token usage, image size, model and latency.
+One document per model call goes into the analysis_telemetry collection
+(expired after TELEMETRY_TTL_DAYS) so prompt size and resize targets can
+be tuned against latency and spend.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import logging
+
+from pymongo import ASCENDING, IndexModel
+
+from config import get_settings
+from db import get_database
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_COLLECTION = "analysis_telemetry"
+
+# USD per million tokens (input, output); update when pricing changes
+MODEL_PRICES_PER_MILLION: Dict[str, tuple] = {
+    "gemini-2.0-flash-001": (0.10, 0.40),
+    "gemini-2.0-flash-lite-001": (0.075, 0.30),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+# Fields summarised by the admin endpoint
+SUMMARY_FIELDS = ("latency_ms", "input_tokens", "output_tokens", "image_pixels", "image_bytes")
+SUMMARY_PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    """Estimated USD cost of one call, or None for models without a price."""
+    prices = MODEL_PRICES_PER_MILLION.get(model)
+    if prices is None:
+        return None
+    return round((input_tokens * prices[0] + output_tokens * prices[1]) / 1e6, 8)
+
+
+def usage_from_response(response) -> Dict[str, int]:
+    """Token counts from a model response's usage metadata (zeros if absent)."""
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "input_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+
+
+def telemetry_indexes() -> List[IndexModel]:
+    ttl_seconds = get_settings().telemetry_ttl_days * 86400
+    return [
+        IndexModel([("created_at", ASCENDING)], name="created_ttl", expireAfterSeconds=ttl_seconds),
+        IndexModel([("model", ASCENDING), ("created_at", ASCENDING)], name="model_created"),
+    ]
+
+
+async def ensure_telemetry_indexes():
+    db = get_database()
+    await db[TELEMETRY_COLLECTION].create_indexes(telemetry_indexes())
+
+
+async def save_analysis_telemetry(telemetry: dict, meal_id: Optional[str], user_id: Optional[str]) -> None:
+    """Store one analysis record; failures are logged, never raised."""
+    try:
+        db = get_database()
+        await db[TELEMETRY_COLLECTION].insert_one({
+            **telemetry,
+            "meal_id": meal_id,
+            "user_id": user_id,
+            "created_at": datetime.utcnow(),
+        })
+    except Exception as e:
+        logger.warning("Failed to store analysis telemetry: %s", e)
+
+
+def build_telemetry_summary_pipeline(days: int, now: Optional[datetime] = None) -> List[dict]:
+    """
+    Per-model, per-day counts, sums and percentiles over the last `days` days.
+    Percentiles use $percentile (approximate), which needs MongoDB 7.0+.
+    """
+    since = (now or datetime.utcnow()) - timedelta(days=days)
+    group: dict = {
+        "_id": {
+            "model": "$model",
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+        },
+        "count": {"$sum": 1},
+        "errors": {"$sum": {"$cond": [{"$eq": ["$status", "ok"]}, 0, 1]}},
+        "input_tokens_total": {"$sum": "$input_tokens"},
+        "output_tokens_total": {"$sum": "$output_tokens"},
+        "cost_usd": {"$sum": {"$ifNull": ["$cost_usd", 0]}},
+    }
+    for name in SUMMARY_FIELDS:
+        group[name] = {"$percentile": {
+            "input": f"${name}", "p": list(SUMMARY_PERCENTILES), "method": "approximate",
+        }}
+
+    return [
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$group": group},
+        {"$sort": {"_id.day": -1, "_id.model": 1}},
+    ]
+
+
+def format_telemetry_summary(rows: List[dict]) -> List[dict]:
+    """Flatten aggregation rows into {model, day, ..., latency_ms: {p50, p90, p99}}."""
+    labels = [f"p{round(p * 100)}" for p in SUMMARY_PERCENTILES]
+    summary = []
+    for row in rows:
+        entry = {
+            "model": row["_id"]["model"],
+            "day": row["_id"]["day"],
+            "count": row["count"],
+            "errors": row["errors"],
+            "input_tokens_total": row["input_tokens_total"],
+            "output_tokens_total": row["output_tokens_total"],
+            "cost_usd": round(row["cost_usd"], 6),
+        }
+        for name in SUMMARY_FIELDS:
+            values = row.get(name) or [None] * len(labels)
+            entry[name] = dict(zip(labels, values))
+        summary.append(entry)
+    return summary
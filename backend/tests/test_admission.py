@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def make_controller(**overrides) -> AdmissionController:
+    options = dict(global_rate=0, global_burst=1, caller_rate=0, caller_burst=1,
+                   max_concurrency=1, max_queue=10, max_wait=5)
+    return AdmissionController(**{**options, **overrides})
+
+
+async def admitted_order(controller: AdmissionController, callers) -> list:
+    """Queue `callers` ((key, weight) pairs) behind a held slot; return the order they run in."""
+    order = []
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.admit("holder"):
+            await release.wait()
+
+    async def call(index, key, weight):
+        async with controller.admit(key, weight):
+            order.append(index)
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    calls = []
+    for index, (key, weight) in enumerate(callers):
+        calls.append(asyncio.create_task(call(index, key, weight)))
+        await asyncio.sleep(0)  # queue in submission order
+    release.set()
+    await asyncio.gather(holder, *calls)
+    return order
+
+
+def test_fair_queue_interleaves_callers():
+    callers = [("bulk", 1.0), ("bulk", 1.0), ("bulk", 1.0), ("other", 1.0)]
+    # The later caller is not stuck behind the bulk uploader's backlog
+    assert asyncio.run(admitted_order(make_controller(), callers)) == [0, 3, 1, 2]
+
+
+def test_lower_weight_gets_a_smaller_share():
+    callers = [("guest", 0.5), ("guest", 0.5), ("user", 1.0), ("user", 1.0)]
+    # Finish tags: guest 2, 4; user 1, 2 (ties go to the earlier arrival)
+    assert asyncio.run(admitted_order(make_controller(), callers)) == [2, 0, 3, 1]
+
+
+def test_caller_rate_limit_rejects_with_retry_after():
+    async def run():
+        controller = make_controller(caller_rate=1 / 60, caller_burst=1, max_concurrency=5)
+        async with controller.admit("u1"):
+            pass
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.admit("u1"):
+                pass
+        async with controller.admit("u2"):  # other callers are unaffected
+            pass
+        return rejected.value
+    rejected = asyncio.run(run())
+    assert rejected.reason == "caller_rate"
+    assert rejected.retry_after == pytest.approx(60, rel=0.01)
+
+
+def test_full_queue_rejects_immediately():
+    async def run():
+        controller = make_controller(max_queue=1)
+        release = asyncio.Event()
+
+        async def hold(key):
+            async with controller.admit(key):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold("a")), asyncio.create_task(hold("b"))]
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with controller.admit("c"):
+                    pass
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+        return rejected.value.reason
+    assert asyncio.run(run()) == "queue_full"
+
+
+def test_queue_timeout_frees_the_queue_position():
+    async def run():
+        controller = make_controller(max_wait=0.01)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("a"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.admit("b"):
+                pass
+        release.set()
+        await holder
+        return rejected.value.reason, controller._queued
+    assert asyncio.run(run()) == ("queue_timeout", 0)
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=1.0, burst=2)
+    now = bucket.updated
+    assert bucket.try_acquire(now) == 0
+    assert bucket.try_acquire(now) == 0
+    assert bucket.try_acquire(now) == pytest.approx(1.0)
+    assert bucket.try_acquire(now + 1.0) == 0
+
+
+def test_finish_tags_are_pruned_without_caller_rate_limits(monkeypatch):
+    monkeypatch.setattr("admission.MAX_TRACKED_CALLERS", 2)
+    controller = make_controller(caller_rate=0)
+    asyncio.run(admitted_order(controller, [(f"guest:{index}", 1.0) for index in range(4)]))
+    assert len(controller._last_finish) == 4
+    asyncio.run(admitted_order(controller, [("guest:new", 1.0)]))
+    assert list(controller._last_finish) == ["guest:new"]
@@ -0,0 +1,27 @@
+from cache import ResponseCache, etag_matches, make_etag
+
+
+def test_etag_changes_with_the_data_version():
+    assert make_etag("u1", 3, "history", (0, 20)) == make_etag("u1", 3, "history", (0, 20))
+    assert make_etag("u1", 3, "history", (0, 20)) != make_etag("u1", 4, "history", (0, 20))
+
+
+def test_etag_matches_if_none_match_lists_and_weak_tags():
+    etag = make_etag("u1", 3)
+    assert etag_matches(etag, etag)
+    assert etag.startswith('W/"')
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches(etag.removeprefix("W/"), etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_response_cache_evicts_the_least_recently_used_entry():
+    cache = ResponseCache("test", max_entries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    assert cache.get("a") == b"1"  # "b" is now the oldest
+    cache.put("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1" and cache.get("c") == b"3"
@@ -0,0 +1,16 @@
+from db import CALORIE_FACET_BOUNDARIES, _search_facet_stage, format_meal_search_result
+
+
+def test_calorie_facet_closes_the_top_bucket_and_labels_the_rest_unknown():
+    bucket = _search_facet_stage(None, 0, 10, {})["$facet"]["calories"][-1]["$bucket"]
+    assert bucket["boundaries"][:-1] == CALORIE_FACET_BOUNDARIES
+    assert bucket["boundaries"][-1] > CALORIE_FACET_BOUNDARIES[-1]
+    assert bucket["default"] == "unknown"
+
+    result = format_meal_search_result({
+        "results": [],
+        "total": [{"count": 4}],
+        "health_verdict": [{"_id": "Healthy", "count": 4}],
+        "calories": [{"_id": 0, "count": 1}, {"_id": 1200, "count": 2}, {"_id": "unknown", "count": 1}],
+    })
+    assert result["facets"]["calories"] == {"0-300": 1, "1200+": 2, "unknown": 1}
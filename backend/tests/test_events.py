@@ -0,0 +1,52 @@
+from datetime import datetime
+import asyncio
+
+import orjson
+
+import events
+from events import LocalEventBroker, meal_saved_event, stream_events
+
+
+def test_meal_saved_event_carries_the_stats_delta():
+    event = meal_saved_event({"meal_id": "m1", "created_at": datetime(2024, 5, 6, 9), "calories": 420, "protein": 30})
+    assert event["type"] == "meal_saved"
+    assert event["stats_delta"] == {
+        "_id": "2024-05-06", "total_calories": 420, "total_protein": 30,
+        "total_carbs": 0, "total_fats": 0, "meal_count": 1,
+    }
+
+
+def test_local_broker_delivers_per_user_and_drops_the_oldest_when_full(monkeypatch):
+    monkeypatch.setattr(events, "SUBSCRIBER_QUEUE_SIZE", 2)
+
+    async def run():
+        broker = LocalEventBroker()
+        async with broker.subscribe("u1") as queue:
+            for index in range(3):
+                await broker.publish("u1", {"index": index})
+            await broker.publish("u2", {"index": "other user"})
+            received = [queue.get_nowait()["index"] for _ in range(queue.qsize())]
+        return received, broker._subscribers
+    received, subscribers = asyncio.run(run())
+    assert received == [1, 2]
+    assert subscribers == {}  # unsubscribed on exit
+
+
+def test_stream_events_frames_events_and_heartbeats(monkeypatch):
+    broker = LocalEventBroker()
+    monkeypatch.setattr(events, "get_event_broker", lambda: broker)
+
+    async def run():
+        stream = stream_events("u1", heartbeat=0.01)
+        frames = [await stream.__anext__()]
+        frames.append(await stream.__anext__())  # idle: heartbeat
+        await broker.publish("u1", {"type": "meal_saved", "meal": {"meal_id": "m1"}})
+        frames.append(await stream.__anext__())
+        await stream.aclose()
+        return frames
+    retry, heartbeat, event = asyncio.run(run())
+    assert retry == b"retry: 5000\n\n"
+    assert heartbeat == b": heartbeat\n\n"
+    name, data = event.rstrip(b"\n").split(b"\n")
+    assert name == b"event: meal_saved"
+    assert orjson.loads(data.removeprefix(b"data: "))["meal"] == {"meal_id": "m1"}
@@ -0,0 +1,96 @@
+from datetime import datetime
+import asyncio
+import csv
+import io
+
+import orjson
+import pytest
+
+from export import EXPORT_COLUMNS, export_filename, flatten_meal, stream_export
+
+
+def make_meal(index: int) -> dict:
+    return {
+        "meal_id": f"m{index}",
+        "created_at": datetime(2024, 5, 6, 12, index),
+        "health_verdict": "Healthy",
+        "calories": 400 + index,
+        "protein": 20.0,
+        "carbs": 40.0,
+        "fats": 10.0,
+        "micronutrients": {"vitamin_c": {"amount": 0.05, "unit": "g"}, "iron": {"amount": 2, "unit": "mg"}},
+        "food_items": ["rice", "beans"],
+        "benefits": [],
+        "cautions": ["salty"],
+        "nutrition_advice": "Fine",
+        "image_url": "",
+    }
+
+
+class FakeCursor:
+    """Async iterator standing in for a Motor cursor."""
+
+    def __init__(self, meals):
+        self._meals = iter(meals)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._meals)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+def export_chunks(meals, export_format: str, batch_size: int = 2) -> list:
+    async def collect():
+        return [chunk async for chunk in stream_export(FakeCursor(meals), export_format, batch_size)]
+    return asyncio.run(collect())
+
+
+def test_flatten_meal_converts_micronutrients_and_joins_lists():
+    row = flatten_meal(make_meal(1))
+    assert row["vitamin_c_mg"] == 50.0
+    assert row["iron_mg"] == 2.0
+    assert row["calcium_mg"] is None
+    assert row["food_items"] == "rice; beans"
+    assert row["source"] == "image"
+
+
+def test_ndjson_streams_one_chunk_per_batch():
+    chunks = export_chunks([make_meal(i) for i in range(5)], "ndjson")
+    assert len(chunks) == 3
+    lines = b"".join(chunks).splitlines()
+    assert [orjson.loads(line)["meal_id"] for line in lines] == ["m0", "m1", "m2", "m3", "m4"]
+
+
+def test_csv_writes_the_header_once():
+    chunks = export_chunks([make_meal(i) for i in range(3)], "csv")
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+    assert len(rows) == 3
+    assert rows[0]["created_at"] == "2024-05-06T12:00:00"
+    assert list(rows[0]) == EXPORT_COLUMNS
+
+
+def test_empty_csv_export_is_just_the_header():
+    assert b"".join(export_chunks([], "csv")).decode().strip() == ",".join(EXPORT_COLUMNS)
+
+
+@pytest.mark.parametrize("export_format", ["parquet", "arrow"])
+def test_columnar_exports_round_trip(export_format):
+    pa = pytest.importorskip("pyarrow")
+    data = b"".join(export_chunks([make_meal(i) for i in range(5)], export_format))
+    if export_format == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(pa.BufferReader(data))
+    else:
+        table = pa.ipc.open_stream(data).read_all()
+    assert table.num_rows == 5
+    assert table.column("food_items").to_pylist()[0] == ["rice", "beans"]
+    assert table.column("vitamin_c_mg").to_pylist()[0] == 50.0
+
+
+def test_export_filename():
+    assert export_filename("arrow", datetime(2024, 5, 6)) == "eatright-meals-20240506.arrows"
+    assert export_filename("csv", datetime(2024, 5, 6)) == "eatright-meals-20240506.csv"
@@ -0,0 +1,145 @@
+from datetime import datetime
+import asyncio
+
+import pytest
+from pymongo import UpdateOne
+
+import insights
+from insights import (
+    InsightsScheduler, build_week, coalesce_updates, format_insights, in_window, insight_id, item_key, week_start
+)
+
+MONDAY = datetime(2024, 5, 6)
+
+
+def make_meal(user_id="u1", created_at=datetime(2024, 5, 8, 13), **fields) -> dict:
+    meal = {
+        "user_id": user_id,
+        "created_at": created_at,
+        "health_verdict": "Healthy",
+        "calories": 500,
+        "protein": 30.0,
+        "carbs": 50.0,
+        "fats": 10.0,
+        "benefits": ["High protein.", "Rich in fibre"],
+        "cautions": [],
+    }
+    return {**meal, **fields}
+
+
+def test_week_start_is_monday_midnight():
+    assert week_start(datetime(2024, 5, 12, 23, 59)) == MONDAY
+    assert week_start(MONDAY) == MONDAY
+    assert insight_id("u1", MONDAY) == "u1:2024-05-06"
+
+
+def test_item_key_folds_rewordings():
+    assert item_key("High protein.") == item_key("  high PROTEIN ") == "high_protein"
+
+
+def test_coalesce_updates_groups_by_user_week():
+    meals = [
+        make_meal(),
+        make_meal(health_verdict="Unhealthy", benefits=["high protein", "High Protein!"]),
+        make_meal(user_id="u2"),
+        make_meal(created_at=datetime(2024, 5, 13, 8)),  # next week
+    ]
+    now = datetime(2024, 5, 13, 9)
+    updates = coalesce_updates(meals, now)
+    assert len(updates) == 3
+    assert updates[0] == UpdateOne({"_id": "u1:2024-05-06"}, {
+        "$setOnInsert": {"user_id": "u1", "week_start": MONDAY},
+        "$inc": {
+            "meal_count": 2,
+            "verdicts.Healthy": 1,
+            "verdicts.Unhealthy": 1,
+            "totals.calories": 1000,
+            "totals.protein": 60.0,
+            "totals.carbs": 100.0,
+            "totals.fats": 20.0,
+            # A benefit repeated within one meal counts once for that meal
+            "benefits.high_protein.count": 2,
+            "benefits.rich_in_fibre.count": 1,
+        },
+        "$set": {
+            "benefits.high_protein.text": "high protein",
+            "benefits.rich_in_fibre.text": "Rich in fibre",
+            "updated_at": now,
+            "summary_stale": True,
+        },
+    }, upsert=True)
+
+
+def test_build_week_matches_the_incremental_counters():
+    meals = [make_meal(), make_meal(health_verdict="Neutral", cautions=["Salty"])]
+    week = build_week("u1", MONDAY, meals)
+    assert week["meal_count"] == 2
+    assert week["verdicts"] == {"Healthy": 1, "Neutral": 1}
+    assert week["totals"] == {"calories": 1000, "protein": 60.0, "carbs": 100.0, "fats": 20.0}
+    assert week["benefits"]["high_protein"] == {"count": 2, "text": "High protein."}
+    assert week["cautions"]["salty"] == {"count": 1, "text": "Salty"}
+
+
+def test_format_insights_ratios_balance_and_ranking():
+    meals = [make_meal(), make_meal(), make_meal(health_verdict="Unhealthy", benefits=["Rich in fibre"])]
+    insights = format_insights(build_week("u1", MONDAY, meals), "u1", MONDAY)
+    assert insights["week_start"] == "2024-05-06"
+    assert insights["verdict_ratios"] == {"Healthy": 0.667, "Neutral": 0.0, "Unhealthy": 0.333}
+    assert insights["average_calories"] == 500
+    # 30 g protein, 50 g carbs, 10 g fats -> 120 / 200 / 90 kcal
+    assert insights["macro_balance"] == {"protein": 29.3, "carbs": 48.8, "fats": 22.0}
+    assert insights["top_benefits"] == [
+        {"text": "Rich in fibre", "count": 3},
+        {"text": "High protein.", "count": 2},
+    ]
+
+
+def test_format_insights_for_an_empty_week():
+    insights = format_insights(None, "u1", MONDAY)
+    assert insights["meal_count"] == 0
+    assert insights["average_calories"] == 0
+    assert insights["top_benefits"] == []
+
+
+@pytest.mark.parametrize("hours, hour, expected", [
+    ("2-5", 2, True),
+    ("2-5", 4, True),
+    ("2-5", 5, False),
+    ("2-5", 1, False),
+    ("22-3", 23, True),
+    ("22-3", 0, True),
+    ("22-3", 3, False),
+    ("22-3", 12, False),
+])
+def test_in_window(hours, hour, expected):
+    assert in_window(hours, datetime(2024, 5, 6, hour, 30)) is expected
+
+
+def test_dropped_meals_flag_their_week_for_the_off_peak_rebuild(monkeypatch):
+    updates = []
+
+    class FakeCollection:
+        async def update_one(self, query, update, upsert=False):
+            updates.append((query, update, upsert))
+
+        async def bulk_write(self, requests, ordered=True):
+            pass
+
+    monkeypatch.setattr(insights, "get_database", lambda: {insights.INSIGHTS_COLLECTION: FakeCollection()})
+
+    async def run():
+        scheduler = InsightsScheduler(flush_interval=1, batch_size=10, max_queue=1, summary_interval=60,
+                                      summary_hours="0-0", summary_batch=10, summaries=False)
+        scheduler.enqueue(make_meal(meal_id="queued"))
+        scheduler.enqueue(make_meal(meal_id="dropped 1"))
+        scheduler.enqueue(make_meal(meal_id="dropped 2"))
+        scheduler.enqueue(make_meal(meal_id="other week", created_at=datetime(2024, 5, 13, 8)))
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler._marking == {}
+    assert [(query["_id"], upsert) for query, _, upsert in updates] == [("u1:2024-05-06", True), ("u1:2024-05-13", True)]
+    _, update, _ = updates[0]
+    assert update["$set"]["summary_stale"] is True
+    assert update["$setOnInsert"] == {"user_id": "u1", "week_start": MONDAY}
@@ -0,0 +1,108 @@
+from datetime import datetime
+import re
+
+from meal_buckets import (
+    bucket_text_search, compact_meal, expand_bucket, expand_meal, meal_text_match,
+    parse_text_query, save_meal_update, stats_from_buckets
+)
+from models import MealDocument
+
+CREATED_AT = datetime(2024, 5, 6, 12, 30)
+
+
+def make_meal(**fields) -> dict:
+    defaults = dict(
+        user_id="u1",
+        food_items=["Margherita pizza"],
+        health_verdict="Neutral",
+        nutrition_advice="Add a side salad.",
+        calories=800,
+        protein=30.0,
+        carbs=90.0,
+        fats=32.0,
+        micronutrients={"calcium": {"amount": 0.4, "unit": "g"}, "lycopene": {"amount": 5, "unit": "mg"}},
+        created_at=CREATED_AT,
+    )
+    return MealDocument(**{**defaults, **fields}).to_dict()
+
+
+def test_compact_meal_round_trips():
+    meal = make_meal()
+    compact = compact_meal(meal)
+    assert "img" not in compact and "src" not in compact  # defaults are omitted
+    expanded = expand_meal("u1", compact)
+    assert expanded["micronutrients"]["calcium"] == {"amount": 400.0, "unit": "mg"}
+    assert expanded["micronutrients"]["lycopene"] == {"amount": 5, "unit": "mg"}
+    for field in ("meal_id", "food_items", "calories", "protein", "created_at", "source", "image_url"):
+        assert expanded[field] == meal[field]
+
+
+def test_save_meal_update_appends_to_the_user_day_bucket():
+    bucket_filter, update = save_meal_update(make_meal())
+    assert bucket_filter == {"_id": "u1:2024-05-06"}
+    assert update["$inc"] == {
+        "count": 1, "totals.calories": 800, "totals.protein": 30.0, "totals.carbs": 90.0, "totals.fats": 32.0
+    }
+    assert update["$setOnInsert"]["day"] == datetime(2024, 5, 6)
+
+
+def test_bucket_expansion_and_stats():
+    early, late = make_meal(created_at=CREATED_AT), make_meal(created_at=CREATED_AT.replace(hour=19))
+    bucket = {
+        "user_id": "u1", "day": datetime(2024, 5, 6), "schema_version": 1, "count": 2,
+        "totals": {"calories": 1600, "protein": 60, "carbs": 180, "fats": 64},
+        "meals": [compact_meal(early), compact_meal(late)],
+    }
+    assert [meal["meal_id"] for meal in expand_bucket(bucket)] == [late["meal_id"], early["meal_id"]]
+    assert stats_from_buckets([bucket]) == [{
+        "_id": "2024-05-06", "total_calories": 1600, "total_protein": 60,
+        "total_carbs": 180, "total_fats": 64, "meal_count": 2,
+    }]
+
+
+def matches(condition: dict, meal: dict) -> bool:
+    """Evaluate the subset of MongoDB query operators meal_text_match emits."""
+    if "$and" in condition:
+        return all(matches(part, meal) for part in condition["$and"])
+    if "$or" in condition:
+        return any(matches(part, meal) for part in condition["$or"])
+    for field, spec in condition.items():
+        values = meal[field] if isinstance(meal[field], list) else [meal[field]]
+        negate = "$not" in spec
+        pattern = re.compile((spec["$not"] if negate else spec)["$regex"], re.IGNORECASE)
+        found = any(pattern.search(value) for value in values)
+        if found == negate:
+            return False
+    return True
+
+
+def search(query: str, meal: dict) -> bool:
+    return matches(meal_text_match(parse_text_query(query)), meal)
+
+
+def test_parse_text_query_follows_text_syntax():
+    parsed = parse_text_query('"Fried  rice" the chicken -salad -"side dish"')
+    assert parsed.phrases == ["fried rice"]
+    assert parsed.terms == ["chicken"]  # stop words are dropped
+    assert parsed.excluded == ["salad"]
+    assert parsed.excluded_phrases == ["side dish"]
+    # Negations only narrow meals; the bucket is found by the positive parts
+    assert bucket_text_search(parsed) == 'chicken "fried rice"'
+
+
+def test_meal_text_match_stems_and_negates():
+    pizza = {"food_items": ["Margherita pizza"], "nutrition_advice": "Add a side salad."}
+    berries = {"food_items": ["Mixed berries", "Greek yogurt"], "nutrition_advice": "Great snack."}
+    assert search("pizzas", pizza)
+    assert search("berry", berries) and search("berries", berries)
+    assert not search("pizza -salad", pizza)
+    assert search("yogurt -salad", berries)
+    assert not search("burger", pizza)
+
+
+def test_meal_text_match_requires_every_phrase():
+    meal = {"food_items": ["Chicken fried rice"], "nutrition_advice": "High in sodium."}
+    assert search('"fried rice"', meal)
+    assert not search('"fried rice" "brown rice"', meal)
+    # With a phrase, loose terms do not widen the match
+    assert not search('"brown rice" chicken', meal)
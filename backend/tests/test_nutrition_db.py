@@ -0,0 +1,83 @@
+import pytest
+
+from nutrition_db import MAX_QUANTITY, analyze_meal_text, parse_meal_text, reconcile_analysis
+
+
+def test_parses_quantities_units_and_names():
+    items = parse_meal_text("2 eggs, 200g chicken and half a cup of rice")
+    assert [(item.quantity, item.unit, item.name) for item in items] == [
+        (2.0, None, "eggs"),
+        (200.0, "g", "chicken"),
+        (0.5, "cup", "rice"),
+    ]
+
+
+def test_parses_fractions_and_mixed_numbers():
+    assert parse_meal_text("3/4 cup oats")[0].quantity == 0.75
+    item = parse_meal_text("1 1/2 cups rice")[0]
+    assert (item.quantity, item.unit, item.name) == (1.5, "cups", "rice")
+
+
+def test_missing_quantity_defaults_to_one():
+    assert parse_meal_text("banana")[0].quantity == 1.0
+
+
+@pytest.mark.parametrize("text", [
+    "1/0 cup rice",
+    "0 eggs",
+    "9" * 400 + " eggs",
+    f"{MAX_QUANTITY + 1} g rice",
+])
+def test_rejects_invalid_quantities(text):
+    with pytest.raises(ValueError):
+        parse_meal_text(text)
+
+
+def test_analysis_splits_known_and_unknown_items():
+    analysis = analyze_meal_text("2 eggs and 1 zzzfood")
+    assert len(analysis["food_items"]) == 1
+    assert analysis["unmatched"] == ["1 zzzfood"]
+    assert analysis["calories"] > 0
+
+
+def model_analysis(calories, protein, carbs, fats, food_items=("boiled egg", "toast")) -> dict:
+    return {"food_items": list(food_items), "calories": calories, "protein": protein, "carbs": carbs, "fats": fats}
+
+
+def test_reconcile_accepts_consistent_totals():
+    result = reconcile_analysis(model_analysis(300, 18, 20, 14))
+    assert result["reconciliation"]["status"] == "consistent"
+    assert result["reconciliation"]["matched_items"] == 2
+
+
+def test_reconcile_flags_without_changing_totals():
+    result = reconcile_analysis(model_analysis(900, 18, 20, 14), "flag")
+    assert result["reconciliation"]["status"] == "flagged"
+    assert "energy_mismatch" in result["reconciliation"]["issues"]
+    assert result["calories"] == 900
+
+
+def test_reconcile_corrects_calories_from_macros():
+    result = reconcile_analysis(model_analysis(900, 18, 20, 14), "correct")
+    assert result["calories"] == 18 * 4 + 20 * 4 + 14 * 9
+    assert result["reconciliation"]["corrected"] == ["calories"]
+
+
+def test_reconcile_replaces_implausible_totals_with_the_table_estimate():
+    result = reconcile_analysis(model_analysis(3000, 180, 200, 140), "correct")
+    reconciliation = result["reconciliation"]
+    assert reconciliation["issues"] == ["implausible_calories"]
+    assert result["calories"] == reconciliation["expected_calories"]
+    assert result["protein"] < 180
+
+
+def test_reconcile_skips_plausibility_for_unknown_items():
+    result = reconcile_analysis(model_analysis(500, 10, 10, 10, ["mystery stew"]))
+    assert result["reconciliation"]["expected_calories"] is None
+    assert result["reconciliation"]["issues"] == ["energy_mismatch"]
+
+
+def test_reconcile_treats_zero_quantity_item_names_as_unresolved():
+    result = reconcile_analysis(model_analysis(300, 18, 20, 14, ["0% fat greek yogurt", "0 g sugar jam", "boiled egg"]))
+    assert result["reconciliation"]["matched_items"] == 1
+    assert result["calories"] == 300
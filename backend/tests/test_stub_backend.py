@@ -0,0 +1,33 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+import stub_backend
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, "JPEG")
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+
+def test_token_estimates_follow_gemini_billing():
+    assert stub_backend.text_tokens("") == 0
+    assert stub_backend.text_tokens("abcde") == 2
+    assert stub_backend.image_tokens(384, 384) == 258
+    assert stub_backend.image_tokens(1024, 768) == 2 * 258
+    assert stub_backend.image_tokens(1600, 1600) == 9 * 258
+
+
+def test_generate_content_reports_usage_for_the_whole_request():
+    model = stub_backend.GenerativeModel(system_instruction="abcdefgh")
+    response = asyncio.run(model.generate_content_async(["abcd", _jpeg(800, 600)]))
+    assert json.loads(response.text) == stub_backend.SAMPLE_ANALYSIS
+    assert response.usage_metadata.prompt_token_count == 2 + 1 + 2 * 258
+    assert response.usage_metadata.total_token_count == (
+        response.usage_metadata.prompt_token_count + response.usage_metadata.candidates_token_count
+    )
@@ -0,0 +1,94 @@
+"""
+Background warmup of external clients and readiness tracking.
+The server binds its port first (after a MongoDB ping, unless in
+fast-start mode) and warms the model client, GCS client, Mongo pool,
+indexes, Pillow's rendition codecs and OAuth metadata afterwards.
+"""
+
+from typing import Dict
+import asyncio
+import logging
+import time
+
+from db import ensure_indexes, ping_mongodb
+from insights import ensure_insights_indexes
+from telemetry import ensure_telemetry_indexes
+
+logger = logging.getLogger(__name__)
+
+# Components that must be warm before the instance reports ready
+REQUIRED_COMPONENTS = ("mongo",)
+
+_status: Dict[str, str] = {}
+_warmup_done = False
+
+
+def _warm_model():
+    from ai import initialize_gemini
+    initialize_gemini()
+
+
+def _warm_images():
+    from config import get_settings
+    from images import resolve_rendition_format
+    resolve_rendition_format(get_settings().image_rendition_format)
+
+
+def _warm_storage():
+    from storage import get_storage_client
+    get_storage_client()
+
+
+def _warm_nutrition():
+    from nutrition_db import get_nutrition_index
+    get_nutrition_index()
+
+
+async def _warm_oauth():
+    from auth import get_oauth
+    await get_oauth().google.load_server_metadata()
+
+
+async def _warm_component(name: str, coro) -> None:
+    start = time.perf_counter()
+    _status[name] = "warming"
+    try:
+        await coro
+        _status[name] = "ready"
+        logger.info("Warmup: %s ready in %.0fms", name, (time.perf_counter() - start) * 1000)
+    except Exception as e:
+        _status[name] = "failed"
+        logger.warning("Warmup: %s failed: %s", name, e)
+
+
+async def run_warmup() -> None:
+    """Warm every external dependency concurrently; failures are non-fatal."""
+    global _warmup_done
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        _warm_component("mongo", ping_mongodb()),
+        _warm_component("indexes", asyncio.gather(
+            ensure_indexes(), ensure_telemetry_indexes(), ensure_insights_indexes()
+        )),
+        _warm_component("model", asyncio.to_thread(_warm_model)),
+        _warm_component("storage", asyncio.to_thread(_warm_storage)),
+        _warm_component("images", asyncio.to_thread(_warm_images)),
+        _warm_component("nutrition", asyncio.to_thread(_warm_nutrition)),
+        _warm_component("oauth", _warm_oauth()),
+    )
+    _warmup_done = True
+    logger.info("Warmup finished in %.0fms", (time.perf_counter() - start) * 1000)
+
+
+async def check_readiness() -> Dict[str, object]:
+    """
+    Report readiness. A failed required component is re-checked so the
+    instance can become ready once the dependency recovers.
+    """
+    for name in REQUIRED_COMPONENTS:
+        if _warmup_done and _status.get(name) == "failed":
+            await _warm_component(name, ping_mongodb())
+
+    ready = _warmup_done and all(_status.get(name) == "ready" for name in REQUIRED_COMPONENTS)
+    return {"ready": ready, "components": dict(_status)}
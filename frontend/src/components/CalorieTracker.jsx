@@ -1,16 +1,40 @@
 import { useState, useEffect } from 'react';
 import { useAuth } from '../contexts/AuthContext';
-import { getMealStats } from '../utils/api';
+import { getMealStats, getWeeklyInsights, subscribeToMealEvents } from '../utils/api';
+import { WeeklyInsights } from './HealthInsights';
 import { BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer } from 'recharts';
 import './CalorieTracker.css';
 
 function CalorieTracker() {
     const [stats, setStats] = useState([]);
+    const [insights, setInsights] = useState(null);
     const [loading, setLoading] = useState(true);
     const { token } = useAuth();
 
     useEffect(() => {
-        if (token) loadStats();
+        if (token) {
+            loadStats();
+            getWeeklyInsights(token).then(setInsights).catch(() => setInsights(null));
+        }
+    }, [token]);
+
+    // Apply pushed stat deltas instead of refetching after every meal
+    useEffect(() => {
+        if (!token) return;
+        return subscribeToMealEvents(token, ({ stats_delta: delta }) => {
+            setStats(current => {
+                const existing = current.find(day => day._id === delta._id);
+                if (!existing) return [...current, delta].slice(-7);
+                return current.map(day => day._id !== delta._id ? day : {
+                    ...day,
+                    total_calories: day.total_calories + delta.total_calories,
+                    total_protein: day.total_protein + delta.total_protein,
+                    total_carbs: day.total_carbs + delta.total_carbs,
+                    total_fats: day.total_fats + delta.total_fats,
+                    meal_count: day.meal_count + delta.meal_count
+                });
+            });
+        });
     }, [token]);
 
     const loadStats = async () => {
@@ -46,6 +70,12 @@ function CalorieTracker() {
                     </ResponsiveContainer>
                 </div>
             </div>
+            {insights && insights.meal_count > 0 && (
+                <div className="chart-card glass">
+                    <h3>This Week</h3>
+                    <WeeklyInsights insights={insights} />
+                </div>
+            )}
         </div>
     );
 }
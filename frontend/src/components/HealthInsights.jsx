@@ -55,3 +55,26 @@ export function CautionsChecklist({ cautions }) {
         </div>
     );
 }
+
+// Weekly Insights Component (materialized by the backend)
+export function WeeklyInsights({ insights }) {
+    if (!insights || insights.meal_count === 0) {
+        return null;
+    }
+
+    const ratios = insights.verdict_ratios;
+    const balance = insights.macro_balance;
+    const withCounts = (items) => items.map(item => item.count > 1 ? `${item.text} (${item.count}×)` : item.text);
+
+    return (
+        <div className="weekly-insights">
+            <p className="weekly-stats">
+                {insights.meal_count} meals · {Math.round(ratios.Healthy * 100)}% healthy ·
+                {' '}{insights.average_calories} kcal per meal · protein {balance.protein}% / carbs {balance.carbs}% / fats {balance.fats}%
+            </p>
+            {insights.summary && <p className="weekly-summary">{insights.summary}</p>}
+            <BenefitsChecklist benefits={withCounts(insights.top_benefits)} />
+            <CautionsChecklist cautions={withCounts(insights.top_cautions)} />
+        </div>
+    );
+}
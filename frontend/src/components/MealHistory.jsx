@@ -1,17 +1,30 @@
 import { useState, useEffect } from 'react';
 import { useAuth } from '../contexts/AuthContext';
-import { getMealHistory } from '../utils/api';
+import { getMealHistory, searchMeals, subscribeToMealEvents } from '../utils/api';
 import './MealHistory.css';
 
+const VERDICTS = ['Healthy', 'Neutral', 'Unhealthy'];
+
 function MealHistory() {
     const [meals, setMeals] = useState([]);
     const [loading, setLoading] = useState(true);
+    const [query, setQuery] = useState('');
+    const [verdict, setVerdict] = useState('');
+    const [facets, setFacets] = useState(null);
     const { token } = useAuth();
 
     useEffect(() => {
         if (token) loadHistory();
     }, [token]);
 
+    // New meals are pushed by the server; search results are left as they are
+    useEffect(() => {
+        if (!token || facets) return;
+        return subscribeToMealEvents(token, ({ meal }) => {
+            setMeals(current => [meal, ...current.filter(item => item.meal_id !== meal.meal_id)]);
+        });
+    }, [token, facets]);
+
     const loadHistory = async () => {
         try {
             const data = await getMealHistory(token);
@@ -23,15 +36,68 @@ function MealHistory() {
         }
     };
 
+    const runSearch = async (q, v) => {
+        if (!q && !v) {
+            setFacets(null);
+            return loadHistory();
+        }
+        try {
+            const data = await searchMeals(token, { q, verdict: v });
+            setMeals(data.results);
+            setFacets(data.facets);
+        } catch (error) {
+            console.error('Failed to search meals:', error);
+        }
+    };
+
+    const handleSearch = (event) => {
+        event.preventDefault();
+        runSearch(query.trim(), verdict);
+    };
+
+    const toggleVerdict = (value) => {
+        const next = verdict === value ? '' : value;
+        setVerdict(next);
+        runSearch(query.trim(), next);
+    };
+
     if (loading) return <div className="loading-spinner">Loading history...</div>;
 
     return (
         <div className="history-container">
             <h2>Meal History</h2>
+            <form className="history-search" onSubmit={handleSearch}>
+                <input
+                    type="search"
+                    value={query}
+                    onChange={(event) => setQuery(event.target.value)}
+                    placeholder="Search meals, e.g. pizza"
+                />
+                <div className="verdict-filters">
+                    {VERDICTS.map(value => (
+                        <button
+                            key={value}
+                            type="button"
+                            className={`verdict-tag ${value.toLowerCase()} ${verdict === value ? 'active' : ''}`}
+                            onClick={() => toggleVerdict(value)}
+                        >
+                            {value}{facets ? ` (${facets.health_verdict[value] || 0})` : ''}
+                        </button>
+                    ))}
+                </div>
+            </form>
             <div className="history-grid">
                 {meals.map(meal => (
                     <div key={meal.meal_id} className="history-card glass">
-                        <img src={meal.image_url} alt="Meal" className="history-image" />
+                        {(meal.thumbnail_url || meal.image_url) && (
+                            <img
+                                src={meal.thumbnail_url || meal.image_url}
+                                alt="Meal"
+                                className="history-image"
+                                loading="lazy"
+                                decoding="async"
+                            />
+                        )}
                         <div className="history-details">
                             <span className={`verdict-tag ${meal.health_verdict.toLowerCase()}`}>
                                 {meal.health_verdict}
@@ -51,7 +117,9 @@ function MealHistory() {
                     </div>
                 ))}
             </div>
-            {meals.length === 0 && <p className="empty-history">No meals recorded yet.</p>}
+            {meals.length === 0 && (
+                <p className="empty-history">{facets ? 'No meals match your search.' : 'No meals recorded yet.'}</p>
+            )}
         </div>
     );
 }
@@ -53,6 +53,40 @@ async function retryWithBackoff(fn, maxRetries = 2, baseDelay = 1000) {
     throw lastError;
 }
 
+/**
+ * First half of the direct upload flow: send the image straight to cloud
+ * storage so the backend only receives a small finalize request.
+ * @param {Blob} file - The (compressed) image to upload
+ * @param {Object} headers - Auth headers
+ * @returns {Promise<string>} Upload id to finalize
+ */
+async function stageMealUpload(file, headers) {
+    const sessionResponse = await fetchWithTimeout(`${API_BASE_URL}/meals/upload-url`, {
+        method: 'POST',
+        headers: { ...headers, 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            filename: file.name || 'meal.jpg',
+            content_type: file.type || 'image/jpeg',
+            size: file.size
+        })
+    }, 15000);
+    if (!sessionResponse.ok) {
+        throw new Error(`Upload session failed with status ${sessionResponse.status}`);
+    }
+    const { upload_id, upload_url } = await sessionResponse.json();
+
+    const putResponse = await fetchWithTimeout(upload_url, {
+        method: 'PUT',
+        body: file,
+        headers: { 'Content-Type': file.type || 'image/jpeg' }
+    }, 30000);
+    if (!putResponse.ok) {
+        throw new Error(`Direct upload failed with status ${putResponse.status}`);
+    }
+
+    return upload_id;
+}
+
 /**
  * Upload a meal image for AI analysis
  * @param {File} file - The image file to upload
@@ -82,14 +116,40 @@ export async function uploadMeal(file, token = null) {
             headers['Authorization'] = `Bearer ${token}`;
         }
 
-        // Use retry logic with timeout
-        const response = await retryWithBackoff(async () => {
-            return await fetchWithTimeout(`${API_BASE_URL}/upload-meal`, {
+        // Signed-in users prefer the direct-to-storage flow, falling back to a
+        // multipart upload through the API (e.g. when bucket CORS is not
+        // configured). Guest images are not stored, so guests post directly.
+        let uploadId = null;
+        if (token) {
+            try {
+                uploadId = await stageMealUpload(fileToUpload, headers);
+            } catch (directError) {
+                console.warn('Direct upload unavailable, using multipart upload:', directError);
+            }
+        }
+
+        let response;
+        if (uploadId) {
+            response = await fetchWithTimeout(`${API_BASE_URL}/meals/finalize-upload`, {
                 method: 'POST',
-                body: formData,
-                headers: headers
-            }, 30000); // 30 second timeout
-        }, 2, 1000); // Max 2 retries with 1s base delay
+                headers: { ...headers, 'Content-Type': 'application/json' },
+                body: JSON.stringify({ upload_id: uploadId })
+            }, 30000);
+        } else {
+            // Use retry logic with timeout
+            response = await retryWithBackoff(async () => {
+                return await fetchWithTimeout(`${API_BASE_URL}/upload-meal`, {
+                    method: 'POST',
+                    body: formData,
+                    headers: headers
+                }, 30000); // 30 second timeout
+            }, 2, 1000); // Max 2 retries with 1s base delay
+        }
+
+        if (response.status === 429) {
+            const retryAfter = response.headers.get('Retry-After');
+            throw new Error(`The analyzer is busy right now. Please try again${retryAfter ? ` in ${retryAfter}s` : ' shortly'}.`);
+        }
 
         if (!response.ok) {
             const errorData = await response.json().catch(() => ({}));
@@ -125,6 +185,31 @@ export async function getMealHistory(token) {
     }
 }
 
+/**
+ * Search meal history with optional filters
+ * @param {string} token - Auth token
+ * @param {Object} filters - q, verdict, date_from, date_to, min_calories, max_calories, ...
+ * @returns {Promise<Object>} { results, total, facets }
+ */
+export async function searchMeals(token, filters = {}) {
+    try {
+        const params = new URLSearchParams();
+        Object.entries(filters).forEach(([key, value]) => {
+            if (value !== undefined && value !== null && value !== '') params.append(key, value);
+        });
+
+        const response = await fetch(`${API_BASE_URL}/meals/search?${params}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+
+        if (!response.ok) throw new Error('Failed to search meals');
+        return await response.json();
+    } catch (error) {
+        console.error('Search API Error:', error);
+        throw error;
+    }
+}
+
 /**
  * Get calorie stats for user
  * @param {string} token - Auth token
@@ -144,6 +229,46 @@ export async function getMealStats(token) {
     }
 }
 
+/**
+ * Get the materialized insights for one week
+ * @param {string} token - Auth token
+ * @param {string} [week] - Any YYYY-MM-DD in the week (default: this week)
+ * @returns {Promise<Object>} Verdict ratios, macro balance, top benefits/cautions, summary
+ */
+export async function getWeeklyInsights(token, week) {
+    try {
+        const query = week ? `?week=${week}` : '';
+        const response = await fetch(`${API_BASE_URL}/insights/weekly${query}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+
+        if (!response.ok) throw new Error('Failed to fetch insights');
+        return await response.json();
+    } catch (error) {
+        console.error('Insights API Error:', error);
+        throw error;
+    }
+}
+
+/**
+ * Subscribe to live meal events for the signed-in user (Server-Sent Events).
+ * EventSource reconnects on its own; call the returned function to close.
+ * @param {string} token - Auth token
+ * @param {Function} onMealSaved - Called with { meal, stats_delta } for each new meal
+ * @returns {Function} Unsubscribe
+ */
+export function subscribeToMealEvents(token, onMealSaved) {
+    const source = new EventSource(`${API_BASE_URL}/meals/events?access_token=${encodeURIComponent(token)}`);
+    source.addEventListener('meal_saved', (event) => {
+        try {
+            onMealSaved(JSON.parse(event.data));
+        } catch (error) {
+            console.error('Meal event error:', error);
+        }
+    });
+    return () => source.close();
+}
+
 export async function checkHealth() {
     try {
         const response = await fetch(`${API_BASE_URL}/health`);